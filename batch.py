@@ -0,0 +1,209 @@
+"""
+Vectorized simulator that steps N boards at once with NumPy.
+
+Follows the rules of engine.TetrisEngine (same ROTATIONS, KICKS, gravity
+and scoring) except that cleared lines are removed immediately instead of
+playing the clear animation. Each step applies one action and then
+advances dt milliseconds, 33 by default. Requires numpy, which the game
+itself does not; it's in requirements-dev.txt:
+
+    pip install -r requirements-dev.txt
+"""
+import numpy as np
+
+from engine import ROTATIONS, KICKS, OFFSET_INDICES, HIDDEN_ROWS, WALL_BITS, START_FALL_MS, SOFT_DROP_MS
+
+
+
+NOOP, LEFT, RIGHT, ROTATE_CLOCK, ROTATE_COUNT, DOWN = range(6)
+ACTION_COUNT = 6
+STEP_MS = 33
+
+LINE_COUNT_POINTS = np.array([0, 10, 30, 60, 100], dtype=np.int64)
+
+# CELLS[id, rotation] holds the four (dx, dy) squares of a piece.
+CELLS = np.array(ROTATIONS, dtype=np.int64)
+
+# KICK_TABLE[id, old, new] holds five (dj, di) kicks. The O piece only has
+# one kick, so its list is padded by repeating it.
+KICK_TABLE = np.zeros((len(ROTATIONS), 4, 4, 5, 2), dtype=np.int64)
+for _id, _offset_index in enumerate(OFFSET_INDICES):
+    for _old in range(4):
+        for _new in range(4):
+            _kicks = KICKS[_offset_index][_old][_new]
+            KICK_TABLE[_id, _old, _new] = [_kicks[min(k, len(_kicks)-1)] for k in range(5)]
+
+
+
+
+
+class BatchTetris(object):
+    def __init__(self, n, rows=20, cols=10, seed=None, auto_reset=True):
+        self.n = n
+        self.rows = rows
+        self.cols = cols
+        self.height = rows + HIDDEN_ROWS
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+
+        # Grid row gi is board row gi + 3 and grid column gj is board column
+        # gj + 3, leaving WALL_BITS cells of wall and floor around the field
+        # for kicks to probe, plus WALL_BITS rows of ceiling above it.
+        self.top = WALL_BITS + self.height
+        self.right = WALL_BITS + cols
+        self.boards = np.zeros((n, self.top + WALL_BITS, self.right + WALL_BITS), dtype=np.uint8)
+        self.boards[:, :WALL_BITS] = 1
+        self.boards[:, self.top:] = 1
+        self.boards[:, :, :WALL_BITS] = 1
+        self.boards[:, :, self.right:] = 1
+
+        self.piece_id = np.zeros(n, dtype=np.int64)
+        self.next_id = np.zeros(n, dtype=np.int64)
+        self.rotation = np.zeros(n, dtype=np.int64)
+        self.i = np.zeros(n, dtype=np.int64)
+        self.j = np.zeros(n, dtype=np.int64)
+        self.time = np.zeros(n, dtype=np.int64)
+        self.fall_interval = np.zeros(n, dtype=np.int64)
+        self.level = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.lines_cleared = np.zeros(n, dtype=np.int64)
+        self.pieces = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.reset()
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        count = int(mask.sum())
+        if not count:
+            return
+        self.boards[mask, WALL_BITS:self.top, WALL_BITS:self.right] = 0
+        self.time[mask] = 0
+        self.fall_interval[mask] = START_FALL_MS
+        self.level[mask] = 1
+        self.score[mask] = 0
+        self.lines_cleared[mask] = 0
+        self.pieces[mask] = 0
+        self.done[mask] = False
+        self.next_id[mask] = self.rng.integers(0, len(ROTATIONS), count)
+        self.new_piece(mask)
+
+    def new_piece(self, mask):
+        count = int(mask.sum())
+        self.piece_id[mask] = self.next_id[mask]
+        self.next_id[mask] = self.rng.integers(0, len(ROTATIONS), count)
+        self.rotation[mask] = 0
+        self.j[mask] = 4
+        self.i[mask] = np.where(self.piece_id[mask] == 5, 20, 19)
+        self.pieces[mask] += 1
+
+    def intersect(self, index, rotation, i, j):
+        cells = CELLS[self.piece_id[index], rotation]
+        rows = i[:, None] + cells[:, :, 1] + WALL_BITS - 1
+        cols = j[:, None] + cells[:, :, 0] + WALL_BITS
+        return self.boards[index[:, None], rows, cols].any(axis=1)
+
+    def shift(self, index, dj):
+        j = self.j[index] + dj
+        free = ~self.intersect(index, self.rotation[index], self.i[index], j)
+        self.j[index[free]] = j[free]
+
+    def rotate(self, index, turn):
+        old = self.rotation[index]
+        new = (old + turn) & 3
+        kicks = KICK_TABLE[self.piece_id[index], old, new]
+        pending = np.ones(len(index), dtype=bool)
+        for k in range(5):
+            if not pending.any():
+                break
+            sub = np.flatnonzero(pending)
+            i = self.i[index[sub]] + kicks[sub, k, 1]
+            j = self.j[index[sub]] + kicks[sub, k, 0]
+            free = ~self.intersect(index[sub], new[sub], i, j)
+            moved = index[sub[free]]
+            self.i[moved] = i[free]
+            self.j[moved] = j[free]
+            self.rotation[moved] = new[sub[free]]
+            pending[sub[free]] = False
+
+    def place_pieces(self, index):
+        ids = self.piece_id[index]
+        cells = CELLS[ids, self.rotation[index]]
+        rows = self.i[index, None] + cells[:, :, 1] + WALL_BITS - 1
+        cols = self.j[index, None] + cells[:, :, 0] + WALL_BITS
+        self.boards[index[:, None], rows, cols] = (ids + 1)[:, None]
+
+    def remove_full_lines(self, index):
+        field = self.boards[index, WALL_BITS:self.top, WALL_BITS:self.right]
+        full = field.all(axis=2)
+        counts = full.sum(axis=1)
+        cleared = counts > 0
+        if cleared.any():
+            field = field[cleared]
+            full = full[cleared]
+            # Stable sort moves full rows to the top and keeps the others in
+            # order, then the rows that were full are emptied.
+            order = np.argsort(full, axis=1, kind="stable")
+            field = np.take_along_axis(field, order[:, :, None], axis=1)
+            emptied = np.arange(self.height)[None, :] >= (self.height - counts[cleared])[:, None]
+            field[emptied] = 0
+            self.boards[index[cleared], WALL_BITS:self.top, WALL_BITS:self.right] = field
+        return counts
+
+    def step(self, actions, dt=STEP_MS):
+        """
+        Applies one action per board followed by dt milliseconds of gravity.
+        Returns (rewards, lines, dones) arrays of length n.
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.n, dtype=np.int64)
+        lines = np.zeros(self.n, dtype=np.int64)
+        live = ~self.done
+
+        for action, func, arg in (
+                (LEFT, self.shift, -1),
+                (RIGHT, self.shift, 1),
+                (ROTATE_CLOCK, self.rotate, 1),
+                (ROTATE_COUNT, self.rotate, -1)):
+            index = np.flatnonzero(live & (actions == action))
+            if len(index):
+                func(index, arg)
+
+        # Same timing as TetrisEngine.update: DOWN is a held soft drop and
+        # at most dt of the time past a fall carries over.
+        self.time[live] += dt
+        interval = np.where(actions == DOWN, np.minimum(self.fall_interval, SOFT_DROP_MS), self.fall_interval)
+        falling = live & (self.time >= interval)
+        self.time[falling] = np.minimum(self.time - interval, dt)[falling]
+        index = np.flatnonzero(falling)
+        if len(index):
+            below = self.i[index] - 1
+            landed = self.intersect(index, self.rotation[index], below, self.j[index])
+            self.i[index[~landed]] = below[~landed]
+            index = index[landed]
+        if len(index):
+            self.time[index] = 0
+            self.place_pieces(index)
+            counts = self.remove_full_lines(index)
+            lines[index] = counts
+            rewards[index] = LINE_COUNT_POINTS[counts]
+            self.score[index] += rewards[index]
+            self.lines_cleared[index] += counts
+            scored = index[counts > 0]
+            self.level[scored] = self.lines_cleared[scored] // 10 + 1
+            self.fall_interval[scored] = np.maximum(15 - self.level[scored], 1) * 1000 // 30
+
+            spawned = np.zeros(self.n, dtype=bool)
+            spawned[index] = True
+            self.new_piece(spawned)
+            blocked = self.intersect(index, self.rotation[index], self.i[index], self.j[index])
+            self.done[index[blocked]] = True
+
+        dones = self.done.copy()
+        if self.auto_reset and dones.any():
+            self.reset(dones)
+        return rewards, lines, dones
+
+    def observe(self):
+        """Occupancy of the visible field, shape (n, rows, cols), row 0 at the bottom."""
+        return self.boards[:, WALL_BITS:WALL_BITS+self.rows, WALL_BITS:self.right] != 0
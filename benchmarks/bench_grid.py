@@ -0,0 +1,157 @@
+"""
+Compares the bitboard grid in engine.TetrisEngine with the list-of-lists
+grid it replaced. Prints moves/sec (left/right shifts), rotations/sec
+(including wall kicks) and locks/sec (place, line check, line removal)
+for both.
+
+    python benchmarks/bench_grid.py [seconds]
+"""
+import os
+import sys
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import TetrisEngine, EMPTY, WHITE
+
+
+
+WALL = 9
+RIGHT_WALLS = 4
+
+
+
+
+
+class ListGridEngine(TetrisEngine):
+    """The previous grid: one Python list per row, cell by cell lookups."""
+
+    def init_grid(self):
+        self.grid = []
+        self.grid.append([WALL] * (self.cols+1+RIGHT_WALLS))
+        for _ in range(self.height):
+            self.grid.append([WALL] + ([EMPTY] * self.cols) + [WALL] * RIGHT_WALLS)
+        self.colors = self.grid
+
+    def clear_grid(self):
+        for i in range(1, self.height+1):
+            for j in range(1, self.cols + 1):
+                self.grid[i][j] = EMPTY
+
+    def set_cell(self, gi, gj, color):
+        self.grid[gi][gj] = color
+
+    def grid_intersect(self):
+        for sq in self.piece.shape:
+            gj = self.piece.j + sq[0] + 1
+            gi = self.piece.i + sq[1]
+            if self.grid[gi][gj]:
+                return True
+        return False
+
+    def clear_lines(self):
+        cleared_lines = []
+        for i in range(1, self.rows+1):
+            full = True
+            for j in range(1, self.cols+1):
+                if not self.grid[i][j]:
+                    full = False
+                    break
+            if full:
+                cleared_lines.append(i)
+        return cleared_lines
+
+    def place_piece(self):
+        color = self.piece.color
+        for sq in self.piece.shape:
+            gj = self.piece.j + sq[0] + 1
+            gi = self.piece.i + sq[1]
+            self.grid[gi][gj] = color
+
+    def turn_cleared_white(self):
+        for row in self.cleared_lines:
+            for j in range(1, self.cols+1):
+                self.grid[row][j] = WHITE
+
+    def remove_cleared_lines(self):
+        for i in range(len(self.cleared_lines)-1, -1, -1):
+            row = self.cleared_lines[i]
+            self.grid.pop(row)
+            self.grid.append([WALL] + [EMPTY] * self.cols + [WALL] * RIGHT_WALLS)
+        self.cleared_lines = []
+
+
+
+
+
+def fill_rows(engine, rows, rand):
+    # Half-full stack with one hole per row so nothing clears by accident.
+    for gi in range(1, rows+1):
+        hole = rand.randint(1, engine.cols)
+        for gj in range(1, engine.cols+1):
+            if gj != hole and rand.random() < 0.6:
+                engine.set_cell(gi, gj, 1)
+
+
+def bench_moves(engine_class, seconds, rotate=False):
+    rand = Random(1)
+    engine = engine_class()
+    engine.reset()
+    fill_rows(engine, 8, rand)
+    if rotate:
+        moves = (engine.rotate_clock, engine.rotate_count, engine.rotate_clock, engine.piece_left)
+    else:
+        moves = (engine.piece_left, engine.piece_left, engine.piece_right, engine.piece_right)
+    count = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        engine.piece = engine.spawn_piece(rand.randint(0, 6))
+        engine.piece.i = rand.randint(9, 12)
+        for _ in range(1000):
+            moves[count & 3]()
+            count += 1
+    return count / seconds
+
+
+def bench_locks(engine_class, seconds):
+    rand = Random(2)
+    engine = engine_class()
+    engine.reset()
+    count = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for _ in range(100):
+            engine.piece = engine.spawn_piece(rand.randint(0, 6))
+            engine.piece.j = rand.randint(1, engine.cols-3)
+            while not engine.next_down_inter():
+                engine.piece.i -= 1
+            engine.place_piece()
+            engine.cleared_lines = engine.clear_lines()
+            if engine.cleared_lines:
+                engine.turn_cleared_white()
+                engine.remove_cleared_lines()
+            if engine.piece.i > engine.rows - 4:
+                engine.clear_grid()
+            count += 1
+    return count / seconds
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    print("%-10s %14s %14s %14s" % ("grid", "moves/sec", "rotations/sec", "locks/sec"))
+    results = {}
+    for name, engine_class in (("list", ListGridEngine), ("bitboard", TetrisEngine)):
+        results[name] = (
+            bench_moves(engine_class, seconds),
+            bench_moves(engine_class, seconds, rotate=True),
+            bench_locks(engine_class, seconds)
+        )
+        print("%-10s %14.0f %14.0f %14.0f" % ((name,) + results[name]))
+    speedups = [new / old for new, old in zip(results["bitboard"], results["list"])]
+    print("%-10s %13.2fx %13.2fx %13.2fx" % tuple(["speedup"] + speedups))
+
+
+
+if __name__ == "__main__":
+    main()
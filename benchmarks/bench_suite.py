@@ -0,0 +1,323 @@
+"""
+Times the code that runs every frame, headless under SDL's dummy video and
+audio drivers, and compares the results with a saved baseline.
+
+    python benchmarks/bench_suite.py --save-baseline      # on a known good tree
+    python benchmarks/bench_suite.py                      # later; exits 1 on regressions
+    python benchmarks/bench_suite.py --json out.json -k draw
+
+Every benchmark plays a scripted game on a fixed seed, so each run does the
+same work. Timings are per operation. A benchmark regresses when its best
+repeat is more than --threshold slower than the baseline's best; the best
+is much steadier from run to run than the median.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from random import Random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame
+
+from engine import TetrisEngine, BagGenerator, Piece, TICK_MS
+from bot import Bot
+
+
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+SEED = 1234
+BENCHMARKS = []
+
+
+def benchmark(func):
+    # func() sets up its state and returns the callable to time.
+    BENCHMARKS.append(func)
+    return func
+
+
+
+
+
+class FixedClock(object):
+    """Stands in for pygame.time.Clock so every frame advances the game 16 ms."""
+
+    def __init__(self, ms=16):
+        self.ms = ms
+
+    def tick(self, fps=0):
+        return self.ms
+
+    def get_time(self):
+        return self.ms
+
+    def get_fps(self):
+        return 1000 / self.ms
+
+
+
+
+
+def played_engine(pieces=40, seed=SEED, engine=None):
+    """An engine partway through a bot game, so the board has a realistic stack."""
+    if engine is None:
+        engine = TetrisEngine()
+    engine.generator = BagGenerator()
+    engine.reset(seed)
+    bot = Bot()
+    placed = 0
+    while placed < pieces and not engine.game_done:
+        bot.act(engine)
+        piece = engine.piece
+        engine.update(TICK_MS)
+        if engine.piece is not piece:
+            placed += 1
+    while engine.clearing_lines:
+        engine.update(TICK_MS)
+    return engine
+
+
+def new_controller():
+    from tetro import TetrisController
+    from leaderboard import LeaderboardClient
+    from score_queue import ScoreQueue
+    pygame.init()
+    # Nothing is queued and the URL goes nowhere, so the frames being timed
+    # never send scores or touch ~/.tetro.
+    leaderboard = LeaderboardClient("http://127.0.0.1:9/tetro/high-scores", queue=ScoreQueue())
+    controller = TetrisController(fps=0, record=False, leaderboard=leaderboard)
+    controller.clock = FixedClock()
+    return controller
+
+
+@benchmark
+def grid_intersect():
+    engine = played_engine()
+    piece = engine.piece
+    states = [(rotation, i, j) for rotation in range(4) for i in range(1, 20, 3) for j in range(0, 10)]
+    def run():
+        for rotation, i, j in states:
+            piece.rotation, piece.i, piece.j = rotation, i, j
+            engine.grid_intersect()
+    return run, len(states)
+
+
+@benchmark
+def check_offsets():
+    # Rotations against the walls and the stack, where the kicks get tried.
+    engine = played_engine()
+    piece = engine.piece
+    states = [(rotation, i, j) for rotation in range(4) for i in (2, 5, 8) for j in (0, 1, 8, 9)]
+    def run():
+        for rotation, i, j in states:
+            piece.rotation, piece.i, piece.j = rotation, i, j
+            new = (rotation + 1) & 3
+            piece.rotation = new
+            engine.check_offsets(rotation, new)
+    return run, len(states)
+
+
+@benchmark
+def clear_lines():
+    engine = played_engine()
+    return engine.clear_lines, 1
+
+
+@benchmark
+def remove_cleared_lines():
+    # Each iteration refills the two bottom rows and removes them again.
+    engine = played_engine()
+    full_row = engine.full_row
+    white = bytearray(engine.cols+2)
+    def run():
+        grid = engine.grid
+        grid[1] = grid[2] = full_row
+        engine.colors[1] = engine.colors[2] = white
+        engine.cleared_lines = [1, 2]
+        engine.remove_cleared_lines()
+    return run, 1
+
+
+@benchmark
+def piece_rotate_clock():
+    piece = Piece(0)
+    def run():
+        for _ in range(100):
+            piece.rotate_clock()
+    return run, 100
+
+
+@benchmark
+def tetris_game_draw():
+    controller = new_controller()
+    controller.start_game()
+    tetris = controller.tetris
+    played_engine(engine=tetris.engine)
+    window = controller.window
+    return lambda: tetris.draw(window), 1
+
+
+@benchmark
+def label_render_text():
+    # A score label counting up, as during a game.
+    from widgetstuff import Label
+    pygame.init()
+    label = Label(None, (0, 0), "0", glyphs=True)
+    label.set_font("menlottc", 30)
+    values = iter(range(10**9))
+    def run():
+        label.set_text(next(values) * 10)
+        label.render_text()
+    return run, 1
+
+
+@benchmark
+def text_input_update():
+    # Typing a name, with a backspace after every three letters.
+    from pygame_textinput import TextInput
+    pygame.init()
+    text_input = TextInput(font_family="menlottc", font_size=14, max_string_length=15, clock=FixedClock())
+    random = Random(SEED)
+    keys = []
+    for n in range(300):
+        if n % 4 == 3:
+            key, char = pygame.K_BACKSPACE, ""
+        else:
+            char = random.choice("abcdefghijklmnopqrstuvwxyz")
+            key = ord(char)
+        keys.append((pygame.event.Event(pygame.KEYDOWN, key=key, unicode=char),
+                     pygame.event.Event(pygame.KEYUP, key=key)))
+    index = [0]
+    def run():
+        # Release every key before the next, so key repeat never posts events.
+        down, up = keys[index[0] % len(keys)]
+        index[0] += 1
+        text_input.check_event(down)
+        text_input.update()
+        text_input.check_event(up)
+    return run, 1
+
+
+@benchmark
+def controller_frame():
+    # TetrisController.frame with the bot playing a seeded game.
+    controller = new_controller()
+    controller.engine.generator = BagGenerator()
+    controller.bot = Bot(move_ms=20)
+    controller.start_game()
+    controller.engine.reset(SEED)
+    controller.frame()
+    def run():
+        if controller.game_done:
+            controller.start_game()
+        controller.frame()
+    return run, 1
+
+
+
+
+
+def time_benchmark(func, repeat, min_time):
+    run, ops = func()
+    # Calibrate how many calls make up one repeat, as timeit.autorange does.
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    times = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append(time.perf_counter() - start)
+    per_op = [t / (number * ops) * 1e6 for t in times]
+    return {
+        "median_us": statistics.median(per_op),
+        "min_us": min(per_op),
+        "max_us": max(per_op),
+        "ops_per_sec": 1e6 / statistics.median(per_op),
+        "ops": number * ops * repeat
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print("%-22s %12s %12s %12s %9s" % ("benchmark", "median us", "best us", "baseline us", "change"))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("%-22s %12.3f %12.3f %12s %9s" % (name, result["median_us"], result["min_us"], "-", "new"))
+            continue
+        change = result["min_us"] / base["min_us"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-22s %12.3f %12.3f %12.3f %+8.1f%%%s" % (
+            name, result["median_us"], result["min_us"], base["min_us"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tetro hot path benchmarks")
+    parser.add_argument("-k", dest="select", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per repeat")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    for func in BENCHMARKS:
+        if args.select and args.select not in func.__name__:
+            continue
+        results[func.__name__] = time_benchmark(func, args.repeat, args.min_time)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("saved baseline to %s" % args.baseline)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    pygame.quit()
+    if regressions:
+        print("%d regression(s): %s" % (len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    main()
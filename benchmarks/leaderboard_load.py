@@ -0,0 +1,113 @@
+"""
+Load generator for leaderboard_server.py. Opens keep-alive connections,
+sends a mix of top-N GETs and score POSTs as fast as the server answers
+them and prints requests/sec with latency percentiles.
+
+    python leaderboard_server.py --data /tmp/scores.jsonl &
+    python benchmarks/leaderboard_load.py --connections 32 --seconds 10
+"""
+import argparse
+import asyncio
+import time
+from random import Random
+from urllib.parse import urlsplit, urlencode
+
+
+
+PATH = "/tetro/high-scores"
+
+
+
+
+
+class Worker(object):
+    def __init__(self, host, port, path, post_ratio, seed):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.post_ratio = post_ratio
+        self.random = Random(seed)
+        self.latencies = {"GET": [], "POST": []}
+        self.errors = 0
+
+    def next_request(self):
+        if self.random.random() < self.post_ratio:
+            body = urlencode({"name": "load%d" % self.random.randrange(1000), "score": self.random.randrange(100000)}).encode()
+            head = ("POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+                    "Content-Length: %d\r\n\r\n" % (self.path, self.host, len(body)))
+            return "POST", head.encode() + body
+        head = "GET %s?qnt=10&sort=True HTTP/1.1\r\nHost: %s\r\n\r\n" % (self.path, self.host)
+        return "GET", head.encode()
+
+    async def read_response(self, reader):
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.partition(b":")
+            if key.strip().lower() == b"content-length":
+                length = int(value)
+        if length:
+            await reader.readexactly(length)
+        return status
+
+    async def run(self, deadline):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            while time.perf_counter() < deadline:
+                method, request = self.next_request()
+                start = time.perf_counter()
+                writer.write(request)
+                status = await self.read_response(reader)
+                self.latencies[method].append(time.perf_counter() - start)
+                if status >= 400:
+                    self.errors += 1
+        finally:
+            writer.close()
+
+
+
+
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values) * p))] if values else 0.0
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    workers = [Worker(url.hostname, url.port or 80, url.path or PATH, args.post_ratio, seed)
+               for seed in range(args.connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker.run(start + args.seconds) for worker in workers))
+    elapsed = time.perf_counter() - start
+
+    print("%d connections, %.1f s, %d%% POST" % (args.connections, elapsed, args.post_ratio * 100))
+    print("%-6s %10s %10s %9s %9s %9s %9s" % ("", "requests", "req/sec", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    total = 0
+    for method in ("GET", "POST", "all"):
+        if method == "all":
+            latencies = sorted(l for worker in workers for values in worker.latencies.values() for l in values)
+        else:
+            latencies = sorted(l for worker in workers for l in worker.latencies[method])
+        print("%-6s %10d %10.0f %9.2f %9.2f %9.2f %9.2f" % (
+            method, len(latencies), len(latencies) / elapsed,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+        total = len(latencies)
+    print("errors: %d of %d" % (sum(worker.errors for worker in workers), total))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Tetro high score server")
+    parser.add_argument("--url", default="http://127.0.0.1:8080" + PATH)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--post-ratio", type=float, default=0.2, help="fraction of requests that submit a score")
+    asyncio.run(run(parser.parse_args()))
+
+
+
+if __name__ == "__main__":
+    main()
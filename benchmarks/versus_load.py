@@ -0,0 +1,113 @@
+"""
+Load generator for versus_server.py. Opens pairs of connections that join
+the same match and then send traffic shaped like a game: an EVENTS frame
+every 50 ms and a SNAPSHOT every 2 s. Each frame carries its send time, so
+the relay latency is measured by the opponent that receives it.
+
+    python versus_server.py --port 7777 &
+    python benchmarks/versus_load.py --matches 500 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from versus import FRAME_HEADER, JOIN, START, EVENTS, SNAPSHOT, frame
+
+
+
+EVENTS_MS = 50
+SNAPSHOT_MS = 2000
+# Send time, then padding to the size of a typical frame.
+STAMP = struct.Struct("<d")
+EVENTS_PADDING = bytes(4)
+SNAPSHOT_PADDING = bytes(28)
+
+
+
+
+
+class Player(object):
+    def __init__(self, host, port, match):
+        self.host = host
+        self.port = port
+        self.match = match
+        self.latencies = []
+        self.bytes_sent = 0
+        self.started = asyncio.Event()
+
+    def send(self, writer, type, payload):
+        data = frame(type, payload)
+        self.bytes_sent += len(data)
+        writer.write(data)
+
+    async def receive(self, reader):
+        while True:
+            header = await reader.readexactly(FRAME_HEADER.size)
+            length, type = FRAME_HEADER.unpack(header)
+            payload = await reader.readexactly(length)
+            if type == START:
+                self.started.set()
+            elif type in (EVENTS, SNAPSHOT):
+                self.latencies.append(time.perf_counter() - STAMP.unpack_from(payload)[0])
+
+    async def run(self, deadline):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        receiving = asyncio.ensure_future(self.receive(reader))
+        try:
+            self.send(writer, JOIN, b"\x01" + self.match.encode())
+            await self.started.wait()
+            next_snapshot = time.perf_counter() + SNAPSHOT_MS / 1000
+            while time.perf_counter() < deadline:
+                now = time.perf_counter()
+                self.send(writer, EVENTS, STAMP.pack(now) + EVENTS_PADDING)
+                if now >= next_snapshot:
+                    next_snapshot += SNAPSHOT_MS / 1000
+                    self.send(writer, SNAPSHOT, STAMP.pack(now) + SNAPSHOT_PADDING)
+                await asyncio.sleep(EVENTS_MS / 1000)
+            # Let the last frames arrive.
+            await asyncio.sleep(0.2)
+        finally:
+            receiving.cancel()
+            writer.close()
+
+
+
+
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values) * p))] if values else 0.0
+
+
+async def run(args):
+    players = [Player(args.host, args.port, "load-%d" % (n // 2)) for n in range(args.matches * 2)]
+    start = time.perf_counter()
+    await asyncio.gather(*(player.run(start + args.seconds) for player in players))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(l for player in players for l in player.latencies)
+    sent = sum(player.bytes_sent for player in players)
+    print("%d matches, %d players, %.1f s" % (args.matches, len(players), elapsed))
+    print("%d frames relayed, %.0f frames/sec, %.0f B/s per player" % (
+        len(latencies), len(latencies) / elapsed, sent / len(players) / elapsed))
+    print("relay latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" % (
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000,
+        percentile(latencies, 0.99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Tetro versus server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--matches", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+A bot that plays through the same inputs as a player.
+
+For each new piece it searches every placement the piece can reach,
+breadth first over (rotation, row, column) with the engine's collision
+masks and wall kicks, scores the board each placement leaves with an
+Evaluator and then steers the piece there one input at a time.
+
+Headless soak test and search benchmark:
+
+    python bot.py --games 10 --generator bag [--lookahead]
+"""
+import argparse
+import time
+from collections import deque
+
+from engine import TetrisEngine, GENERATORS, MASKS, KICKS, OFFSET_INDICES, WALL_BITS, TICK_MS
+
+
+
+# (input, dj, di) for the moves that don't rotate; rotations are tried
+# first so that paths turn the piece before sliding it.
+ROTATE_MOVES = (("rotate_clock", 1), ("rotate_count", -1))
+SHIFT_MOVES = (("piece_left", -1, 0), ("piece_right", 1, 0), ("piece_down", 0, -1))
+
+
+def popcount(x):
+    return bin(x).count("1")
+
+
+def fits(grid, id, rotation, i, j):
+    shift = j + WALL_BITS - 2
+    for dy, mask in MASKS[id][rotation]:
+        if grid[i + dy] & mask << shift:
+            return False
+    return True
+
+
+def search(grid, id, rotation, i, j, top):
+    """
+    Returns {cells: (rotation, i, j)} for every resting place the piece can
+    reach from (rotation, i, j), plus the parent links to rebuild paths.
+    cells identifies the squares the piece covers, so rotations that cover
+    the same squares count once. top is the highest row a piece may reach.
+    """
+    start = (rotation, i, j)
+    parents = {start: None}
+    queue = deque([start])
+    placements = {}
+    offset_index = OFFSET_INDICES[id]
+    while queue:
+        state = queue.popleft()
+        rotation, i, j = state
+        for name, turn in ROTATE_MOVES:
+            new = (rotation + turn) & 3
+            for ox, oy in KICKS[offset_index][rotation][new]:
+                if fits(grid, id, new, i + oy, j + ox):
+                    next_state = (new, i + oy, j + ox)
+                    if next_state not in parents and i + oy <= top:
+                        parents[next_state] = (state, name)
+                        queue.append(next_state)
+                    break
+        for name, dj, di in SHIFT_MOVES:
+            next_state = (rotation, i + di, j + dj)
+            if next_state not in parents and fits(grid, id, rotation, i + di, j + dj):
+                parents[next_state] = (state, name)
+                queue.append(next_state)
+        if not fits(grid, id, rotation, i - 1, j):
+            shift = j + WALL_BITS - 2
+            cells = tuple((i + dy, mask << shift) for dy, mask in MASKS[id][rotation])
+            if cells not in placements:
+                placements[cells] = state
+    return placements, parents
+
+
+def path_to(parents, state):
+    # [(input, state after it), ...] from the search's start to state.
+    path = []
+    while parents[state] is not None:
+        prev_state, name = parents[state]
+        path.append((name, state))
+        state = prev_state
+    path.reverse()
+    return path
+
+
+def place(grid, cells, engine):
+    """Returns (grid, lines cleared) after locking cells into a copy of grid."""
+    grid = list(grid)
+    for gi, mask in cells:
+        grid[gi] |= mask
+    full_row = engine.full_row
+    rows = engine.rows
+    full = [gi for gi, _ in cells if gi <= rows and grid[gi] == full_row]
+    if full:
+        for gi in sorted(set(full), reverse=True):
+            grid.pop(gi)
+            grid.insert(engine.height, engine.empty_row)
+    return grid, len(set(full))
+
+
+
+
+
+class Evaluator(object):
+    """
+    Scores a board as a weighted sum of its features. The default weights
+    are the well known ones from Yiyuan Lee's genetic search. Subclass and
+    override evaluate() or features() to try other heuristics.
+    """
+
+    def __init__(self, height=-0.510066, lines=0.760666, holes=-0.35663, bumpiness=-0.184483):
+        self.weights = {"height": height, "lines": lines, "holes": holes, "bumpiness": bumpiness}
+
+    def features(self, grid, lines, engine):
+        field = engine.empty_row ^ engine.full_row
+        covered = 0
+        holes = 0
+        heights = [0] * engine.cols
+        for gi in range(engine.height, 0, -1):
+            row = grid[gi] & field
+            if not row and not covered:
+                continue
+            new = row & ~covered
+            while new:
+                bit = new & -new
+                heights[bit.bit_length() - 1 - WALL_BITS] = gi
+                new ^= bit
+            holes += popcount(covered & ~row & field)
+            covered |= row
+        return {
+            "height": sum(heights),
+            "lines": lines,
+            "holes": holes,
+            "bumpiness": sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+        }
+
+    def evaluate(self, grid, lines, engine):
+        features = self.features(grid, lines, engine)
+        return sum(self.weights[name] * value for name, value in features.items())
+
+
+
+
+
+class Bot(object):
+    """
+    Drives an engine through engine.input. Call act(engine) before every
+    engine.update, as ReplayPlayer.apply is. With lookahead the next piece's
+    best placement is searched for every placement of the current one.
+    move_ms spaces out the bot's inputs; 0 makes one input per update. With
+    hard_drop the piece is hard dropped once the rest of the way is straight
+    down, instead of soft dropped.
+    """
+
+    def __init__(self, evaluator=None, lookahead=False, move_ms=0, hard_drop=False):
+        self.evaluator = evaluator or Evaluator()
+        self.lookahead = lookahead
+        self.move_ms = move_ms
+        self.hard_drop = hard_drop
+        self.reset()
+        self.evaluated = 0
+        self.searches = 0
+        self.search_time = 0.0
+
+    def reset(self):
+        self.piece = None
+        self.target = None
+        self.moves = []
+        self.expected = None
+        self.next_move = 0
+        self.last_elapsed = 0
+
+    def placements(self, grid, id, rotation, i, j, engine):
+        self.searches += 1
+        return search(grid, id, rotation, i, j, engine.height - 2)
+
+    def best_placement(self, engine, placements):
+        next_piece = engine.next_piece
+        best, best_value = None, None
+        for cells in placements:
+            grid, lines = place(engine.grid, cells, engine)
+            if self.lookahead and next_piece is not None:
+                # The next piece spawns where it always does; if it can't, the
+                # game would be over, which is the worst outcome there is.
+                value = None
+                if fits(grid, next_piece.id, 0, next_piece.i, next_piece.j):
+                    next_placements, _ = self.placements(grid, next_piece.id, 0, next_piece.i, next_piece.j, engine)
+                    for next_cells in next_placements:
+                        next_grid, next_lines = place(grid, next_cells, engine)
+                        self.evaluated += 1
+                        v = self.evaluator.evaluate(next_grid, lines + next_lines, engine)
+                        if value is None or v > value:
+                            value = v
+                if value is None:
+                    value = float("-inf")
+            else:
+                self.evaluated += 1
+                value = self.evaluator.evaluate(grid, lines, engine)
+            if best_value is None or value > best_value:
+                best, best_value = cells, value
+        return best
+
+    def plan(self, engine):
+        start = time.perf_counter()
+        piece = engine.piece
+        placements, parents = self.placements(engine.grid, piece.id, piece.rotation, piece.i, piece.j, engine)
+        if self.target is None or self.target not in placements:
+            self.target = self.best_placement(engine, placements)
+        self.moves = path_to(parents, placements[self.target]) if self.target else []
+        self.expected = (piece.rotation, piece.i, piece.j)
+        self.search_time += time.perf_counter() - start
+
+    def act(self, engine):
+        if engine.game_done or engine.clearing_lines or engine.piece is None:
+            return
+        if engine.elapsed < self.last_elapsed:
+            # A new game has started.
+            self.reset()
+        self.last_elapsed = engine.elapsed
+        piece = engine.piece
+        if piece is not self.piece:
+            self.piece = piece
+            self.target = None
+            self.plan(engine)
+        elif (piece.rotation, piece.i, piece.j) != self.expected:
+            # Gravity moved the piece; find a new way to the same spot, or a
+            # new spot if it's out of reach now.
+            self.plan(engine)
+        if engine.elapsed < self.next_move:
+            return
+        if self.hard_drop and self.straight_down(engine):
+            self.moves = []
+            engine.input("hard_drop")
+            self.next_move = engine.elapsed + self.move_ms
+        elif self.moves:
+            name, self.expected = self.moves.pop(0)
+            engine.input(name)
+            self.next_move = engine.elapsed + self.move_ms
+        elif not engine.down_down:
+            engine.input("start_soft_drop")
+
+    def straight_down(self, engine):
+        # Whether the rest of the path only drops the piece to where it lands.
+        moves = self.moves
+        for name, _ in moves:
+            if name != "piece_down":
+                return False
+        target = moves[-1][1][1] if moves else engine.piece.i
+        return engine.landing_row() == target
+
+    def summary(self):
+        rate = self.evaluated / self.search_time if self.search_time else 0
+        return "%d searches, %d placements evaluated, %.0f placements/sec" % (self.searches, self.evaluated, rate)
+
+
+
+
+
+def play(engine, bot, max_pieces=1000):
+    """Lets bot play engine's game until it ends or max_pieces have spawned; returns the pieces."""
+    pieces = 0
+    while not engine.game_done and pieces < max_pieces:
+        # A hard drop locks the piece in act, so look before it.
+        piece = engine.piece
+        bot.act(engine)
+        engine.update(TICK_MS)
+        if engine.piece is not piece:
+            pieces += 1
+    return pieces
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Let the bot play headless games")
+    parser.add_argument("--games", type=int, default=5)
+    parser.add_argument("--generator", choices=sorted(GENERATORS), default="bag")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game; each game adds one")
+    parser.add_argument("--lookahead", action="store_true")
+    parser.add_argument("--hard-drop", action="store_true", help="hard drop pieces instead of soft dropping them")
+    parser.add_argument("--max-pieces", type=int, default=1000, help="end a game after this many pieces")
+    args = parser.parse_args()
+
+    bot = Bot(lookahead=args.lookahead, hard_drop=args.hard_drop)
+    start = time.perf_counter()
+    total_pieces = 0
+    for game in range(args.games):
+        engine = TetrisEngine(generator=GENERATORS[args.generator]())
+        engine.reset(args.seed + game)
+        pieces = play(engine, bot, args.max_pieces)
+        total_pieces += pieces
+        print("game %d: %d pieces, %d lines, score %d%s" % (
+            game + 1, pieces, engine.lines_cleared, engine.score, ", topped out" if engine.game_done else ""))
+    elapsed = time.perf_counter() - start
+    print("%.0f pieces/sec, %s" % (total_pieces / elapsed, bot.summary()))
+
+
+
+if __name__ == "__main__":
+    main()
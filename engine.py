@@ -0,0 +1,680 @@
+from random import Random, getrandbits
+
+
+
+# Bumped whenever a change to the rules would make a recorded game play out
+# differently, so old recordings can be told apart.
+VERSION = 2
+
+EMPTY = 0
+WHITE = 8
+HIDDEN_ROWS = 6
+
+# Each grid row is an int with one bit per cell. Grid column gj lives at bit
+# gj + 3, so bits 0-3 are the left wall and the four bits past the last
+# column are the right wall; kicks can probe up to four cells past an edge.
+# The grid also ends with WALL_BITS full rows, which is where the negative
+# row indices of a kick below the floor wrap around to.
+WALL_BITS = 4
+
+# Timings are in milliseconds. They're the original frame counts at 30
+# frames per second: a piece fell every 15 frames at the start and every
+# 15 - level frames after that, soft drop moved it every frame and each
+# step of the line clear animation took one frame.
+TICK_MS = 10
+START_FALL_MS = 500
+SOFT_DROP_MS = 33
+CLEAR_STEP_MS = 33
+# Under 20G a piece that has landed locks after this long, 30 frames at 60
+# frames per second, or at once with soft drop.
+LOCK_MS = 500
+
+# Garbage lines sent to the opponent for clearing 1, 2, 3 and 4 lines.
+GARBAGE_LINES = (0, 1, 2, 4)
+
+def fall_interval(level):
+    return max(15 - level, 1) * 1000 // 30
+
+
+def twenty_g(level):
+    # A fall interval of 0 is 20G: pieces drop as far as they can every
+    # update. See TetrisEngine.update.
+    return 0
+
+GRAVITIES = {
+    "normal": fall_interval,
+    "20g": twenty_g
+}
+
+
+
+
+SHAPES = (
+    ((0, 0), (-1, 0), (1, 0), ( 0, 1)),
+    ((0, 0), (-1, 0), (1, 0), (-1, 1)),
+    ((0, 0), (-1, 0), (1, 0), ( 1, 1)),
+    ((0, 0), (-1, 1), (0, 1), ( 1, 0)),
+    ((0, 0), (-1, 0), (0, 1), ( 1, 1)),
+    ((0, 0), (-1, 0), (1, 0), ( 2, 0)),
+    ((0, 0), ( 0, 1), (1, 1), ( 1, 0))
+)
+
+OFFSET_INDICES = (0, 0, 0, 0, 0, 1, 2)
+
+OFFSETS = (
+    (
+        ((0, 0), (0,  0), (0, 0), ( 0,  0)),
+        ((0, 0), (1,  0), (0, 0), (-1,  0)),
+        ((0, 0), (1, -1), (0, 0), (-1, -1)),
+        ((0, 0), (0,  2), (0, 0), ( 0,  2)),
+        ((0, 0), (1,  2), (0, 0), (-1,  2))
+    ),
+    (
+        (( 0, 0), (-1,  0), (-1, 1), (0,  1)),
+        ((-1, 0), ( 0,  0), ( 1, 1), (0,  1)),
+        (( 2, 0), ( 0,  0), (-2, 1), (0,  1)),
+        ((-1, 0), ( 0,  1), ( 1, 0), (0, -1)),
+        (( 2, 0), ( 0, -2), (-2, 0), (0,  2))
+    ),
+    (
+        ((0, 0), (0, -1), (-1, -1), (-1, 0)),
+    )
+)
+
+
+
+
+
+def rotate_shape(shape):
+    return tuple((y, -x) for x, y in shape)
+
+
+def shape_masks(shape):
+    # Row masks of a shape, relative to the piece's position: bit dx + 2 of
+    # the mask for row dy is set for every square (dx, dy).
+    masks = {}
+    for dx, dy in shape:
+        masks[dy] = masks.get(dy, 0) | 1 << (dx + 2)
+    return tuple(masks.items())
+
+
+def build_rotations():
+    rotations = []
+    for shape in SHAPES:
+        states = [shape]
+        for _ in range(3):
+            states.append(rotate_shape(states[-1]))
+        rotations.append(tuple(states))
+    return tuple(rotations)
+
+
+def shape_bottoms(shape):
+    # (dx, lowest dy) for every column of a shape.
+    bottoms = {}
+    for dx, dy in shape:
+        bottoms[dx] = min(dy, bottoms.get(dx, dy))
+    return tuple(bottoms.items())
+
+
+def build_kicks():
+    # KICKS[offset_index][old][new] is the list of (dj, di) translations to
+    # try, in order, when rotating from rotation old to rotation new.
+    kicks = []
+    for offsets in OFFSETS:
+        table = []
+        for old in range(4):
+            table.append(tuple(
+                tuple((offset[old][0]-offset[new][0], offset[old][1]-offset[new][1]) for offset in offsets)
+                for new in range(4)
+            ))
+        kicks.append(tuple(table))
+    return tuple(kicks)
+
+
+ROTATIONS = build_rotations()
+MASKS = tuple(tuple(shape_masks(shape) for shape in states) for states in ROTATIONS)
+BOTTOMS = tuple(tuple(shape_bottoms(shape) for shape in states) for states in ROTATIONS)
+KICKS = build_kicks()
+
+
+
+
+
+class Piece(object):
+    __slots__ = ("id", "rotation", "i", "j")
+
+    def __init__(self, id):
+        self.id = id
+        self.rotation = 0
+        self.j = 4
+        self.i = 20 if id == 5 else 19
+
+    @property
+    def shape(self):
+        return ROTATIONS[self.id][self.rotation]
+
+    @property
+    def masks(self):
+        return MASKS[self.id][self.rotation]
+
+    @property
+    def offset_index(self):
+        return OFFSET_INDICES[self.id]
+
+    @property
+    def color(self):
+        return self.id + 1
+
+    def rotate_clock(self):
+        self.rotation = (self.rotation + 1) & 3
+
+    def rotate_count(self):
+        self.rotation = (self.rotation - 1) & 3
+
+
+
+
+
+class UniformGenerator(object):
+    """Every piece is picked independently, so droughts and floods happen."""
+    name = "uniform"
+
+    def __init__(self, seed=None):
+        self.random = Random(seed)
+
+    def seed(self, seed):
+        self.random.seed(seed)
+
+    def next(self):
+        return self.random.randint(0, len(SHAPES)-1)
+
+    def getstate(self):
+        return self.random.getstate()
+
+    def setstate(self, state):
+        self.random.setstate(state)
+
+
+
+
+
+class BagGenerator(object):
+    """Deals the seven pieces in a shuffled order, then reshuffles."""
+    name = "bag"
+
+    def __init__(self, seed=None):
+        self.random = Random(seed)
+        self.bag = []
+
+    def seed(self, seed):
+        self.random.seed(seed)
+        self.bag = []
+
+    def next(self):
+        if not self.bag:
+            self.bag = list(range(len(SHAPES)))
+            self.random.shuffle(self.bag)
+        return self.bag.pop()
+
+    def getstate(self):
+        return self.random.getstate(), list(self.bag)
+
+    def setstate(self, state):
+        random_state, bag = state
+        self.random.setstate(random_state)
+        self.bag = list(bag)
+
+GENERATORS = {
+    UniformGenerator.name: UniformGenerator,
+    BagGenerator.name: BagGenerator
+}
+
+
+
+
+
+class TetrisEngine(object):
+    # The moves a player can make, as accepted by input(). Recordings store
+    # the index, so new moves go on the end.
+    INPUTS = ("piece_left", "piece_right", "piece_down", "rotate_clock", "rotate_count", "start_soft_drop", "stop_soft_drop",
+              "hard_drop")
+
+    def __init__(self, rows=20, cols=10, generator=None, gravity=None):
+        self.rows = rows
+        self.cols = cols
+        self.generator = generator or UniformGenerator()
+        # gravity(level) is the ms between falls. A game starts out at
+        # gravity(0), one frame slower than level 1.
+        self.gravity = gravity or fall_interval
+        self.seed = None
+        self.elapsed = 0
+        self.height = rows + HIDDEN_ROWS
+        self.walls = (1 << WALL_BITS) - 1
+        self.empty_row = self.walls | (self.walls << (cols + WALL_BITS))
+        self.full_row = (1 << (cols + WALL_BITS*2)) - 1
+        self.piece = None
+        self.next_piece = None
+        # The lowest row the piece has been on, for the 20G lock delay.
+        self.lowest_row = 0
+        self.init_grid()
+
+        self.time = 0
+        self.fall_interval = self.gravity(0)
+        self.down_down = False
+        self.cleared_lines = []
+        self.clear_step = 0
+        self.clear_time = 0
+        self.clearing_lines = False
+
+        self.level = 1
+        self.score = 0
+        self.lines_cleared = 0
+        self.line_count_points = [10, 30, 60, 100]
+        self.game_done = False
+        # (count, hole) garbage waiting to come up under the stack.
+        self.garbage_queue = []
+
+        self.lines_cleared_func = None
+        self.game_over_func = None
+        self.cells_changed_func = None
+        self.rows_removed_func = None
+        self.grid_cleared_func = None
+        self.input_func = None
+        self.garbage_sent_func = None
+        self.garbage_added_func = None
+
+    def connect_lines_cleared(self, func):
+        self.lines_cleared_func = func
+
+    def connect_game_over(self, func):
+        self.game_over_func = func
+
+    def connect_cells_changed(self, func):
+        # func(cells) with a list of (gi, gj) whose colour changed.
+        self.cells_changed_func = func
+
+    def connect_rows_removed(self, func):
+        # func(rows) with the removed rows, highest first, in removal order.
+        self.rows_removed_func = func
+
+    def connect_grid_cleared(self, func):
+        self.grid_cleared_func = func
+
+    def connect_input(self, func):
+        # func(elapsed, name) before each input is applied.
+        self.input_func = func
+
+    def connect_garbage_sent(self, func):
+        # func(count) with the garbage lines a multi-line clear sends to the
+        # opponent, after cancelling any garbage still queued here.
+        self.garbage_sent_func = func
+
+    def connect_garbage_added(self, func):
+        # func(count) after count garbage rows pushed the stack up.
+        self.garbage_added_func = func
+
+    def spawn_piece(self, id):
+        return Piece(id)
+
+    def new_piece(self):
+        self.piece = self.next_piece
+        self.next_piece = self.spawn_piece(self.generator.next())
+        self.lowest_row = self.piece.i
+
+    def reset_pieces(self):
+        self.piece = self.spawn_piece(self.generator.next())
+        self.next_piece = self.spawn_piece(self.generator.next())
+        self.lowest_row = self.piece.i
+
+    def reset(self, seed=None):
+        # Every game gets a seed, so that it can be replayed from its inputs.
+        self.seed = getrandbits(32) if seed is None else seed
+        self.generator.seed(self.seed)
+        self.elapsed = 0
+        self.time = 0
+        self.fall_interval = self.gravity(0)
+        self.down_down = False
+        self.cleared_lines = []
+        self.clear_step = 0
+        self.clear_time = 0
+        self.clearing_lines = False
+        self.level = 1
+        self.score = 0
+        self.lines_cleared = 0
+        self.game_done = False
+        self.garbage_queue = []
+        self.reset_pieces()
+        self.clear_grid()
+
+    def grid_intersect(self):
+        piece = self.piece
+        grid = self.grid
+        i = piece.i
+        shift = piece.j + WALL_BITS - 2
+        for dy, mask in MASKS[piece.id][piece.rotation]:
+            if grid[i + dy] & mask << shift:
+                return True
+        return False
+
+    def input(self, name):
+        if self.input_func:
+            self.input_func(self.elapsed, name)
+        getattr(self, name)()
+
+    def start_soft_drop(self):
+        self.down_down = True
+
+    def stop_soft_drop(self):
+        self.down_down = False
+
+    def piece_down(self):
+        self.piece.i -= 1
+        if self.grid_intersect():
+            self.piece.i += 1
+
+    def hard_drop(self):
+        if self.clearing_lines or self.game_done:
+            return
+        self.piece.i = self.landing_row()
+        self.lock_piece()
+
+    def landing_row(self):
+        """The row the piece would land on if it fell straight down from where it is."""
+        piece = self.piece
+        heights = self.heights
+        j = piece.j + 1
+        i = max(heights[j + dx] + 1 - dy for dx, dy in BOTTOMS[piece.id][piece.rotation])
+        if i <= piece.i:
+            return i
+        # Part of the piece is under an overhang, below the top of its
+        # column, so the skyline doesn't tell where it stops.
+        start = piece.i
+        while not self.next_down_inter():
+            piece.i -= 1
+        i = piece.i
+        piece.i = start
+        return i
+
+    def piece_right(self):
+        self.piece.j += 1
+        if self.grid_intersect():
+            self.piece.j -= 1
+
+    def piece_left(self):
+        self.piece.j -= 1
+        if self.grid_intersect():
+            self.piece.j += 1
+
+    def rotate_clock(self):
+        old = self.piece.rotation
+        self.piece.rotation = (old + 1) & 3
+        if not self.check_offsets(old, self.piece.rotation):
+            self.piece.rotation = old
+
+    def rotate_count(self):
+        old = self.piece.rotation
+        self.piece.rotation = (old - 1) & 3
+        if not self.check_offsets(old, self.piece.rotation):
+            self.piece.rotation = old
+
+    def check_offsets(self, old, new):
+        piece = self.piece
+        for ox, oy in KICKS[OFFSET_INDICES[piece.id]][old][new]:
+            piece.j += ox
+            piece.i += oy
+            if not self.grid_intersect():
+                return True
+            piece.j -= ox
+            piece.i -= oy
+        return False
+
+    def set_cell(self, gi, gj, color):
+        if color:
+            self.grid[gi] |= 1 << (gj + WALL_BITS - 1)
+        else:
+            self.grid[gi] &= ~(1 << (gj + WALL_BITS - 1))
+        self.colors[gi][gj] = color
+        self.heights[gj] = self.column_height(gj, self.height)
+        if self.cells_changed_func:
+            self.cells_changed_func([(gi, gj)])
+
+    def clear_lines(self):
+        full_row = self.full_row
+        grid = self.grid
+        return [i for i in range(1, self.rows+1) if grid[i] == full_row]
+
+    def place_piece(self):
+        grid = self.grid
+        colors = self.colors
+        heights = self.heights
+        piece = self.piece
+        color = piece.id + 1
+        i = piece.i
+        j = piece.j
+        for sq in ROTATIONS[piece.id][piece.rotation]:
+            gi = i + sq[1]
+            gj = j + sq[0] + 1
+            grid[gi] |= 1 << (gj + WALL_BITS - 1)
+            colors[gi][gj] = color
+            if gi > heights[gj]:
+                heights[gj] = gi
+        if self.cells_changed_func:
+            self.cells_changed_func([(i + sq[1], j + sq[0] + 1) for sq in ROTATIONS[piece.id][piece.rotation]])
+
+    def check_clear_lines(self):
+        self.cleared_lines = self.clear_lines()
+        self.update_score(len(self.cleared_lines))
+        if self.cleared_lines:
+            self.clearing_lines = True
+            self.turn_cleared_white()
+            self.send_garbage(GARBAGE_LINES[len(self.cleared_lines)-1])
+        elif self.garbage_queue:
+            self.add_garbage()
+
+    def receive_garbage(self, count, hole):
+        # Queued garbage comes up the next time a piece locks without
+        # clearing a line.
+        self.garbage_queue.append((count, hole))
+
+    def send_garbage(self, count):
+        # Lines sent first cancel garbage that hasn't come up yet.
+        queue = self.garbage_queue
+        while count and queue:
+            cancelled = min(count, queue[0][0])
+            count -= cancelled
+            if cancelled == queue[0][0]:
+                queue.pop(0)
+            else:
+                queue[0] = (queue[0][0] - cancelled, queue[0][1])
+        if count and self.garbage_sent_func:
+            self.garbage_sent_func(count)
+
+    def add_garbage(self):
+        # Pushes the stack up by the queued garbage rows, each full but for
+        # its hole column. Rows pushed off the top of the grid are lost.
+        added = 0
+        for count, hole in self.garbage_queue:
+            row = self.full_row & ~(1 << (hole + WALL_BITS - 1))
+            colors = bytearray([WHITE]) * (self.cols+2)
+            colors[0] = colors[hole] = colors[self.cols+1] = EMPTY
+            for _ in range(count):
+                self.grid.pop(self.height)
+                self.grid.insert(1, row)
+                self.colors.pop()
+                self.colors.insert(1, bytearray(colors))
+            added += count
+        self.garbage_queue = []
+        self.reset_heights()
+        if self.garbage_added_func:
+            self.garbage_added_func(added)
+
+    def update_score(self, clear_count):
+        if clear_count:
+            self.lines_cleared += clear_count
+            self.score += self.line_count_points[clear_count-1]
+            self.level = self.lines_cleared // 10 + 1
+            self.fall_interval = self.gravity(self.level)
+            if self.lines_cleared_func:
+                self.lines_cleared_func(clear_count)
+
+    def next_down_inter(self):
+        self.piece.i -= 1
+        if self.grid_intersect():
+            self.piece.i += 1
+            return True
+        self.piece.i += 1
+        return False
+
+    def clear_grid(self):
+        for i in range(1, self.height+1):
+            self.grid[i] = self.empty_row
+            self.colors[i] = bytearray(self.cols+2)
+        self.heights = [0] * (self.cols+1)
+        if self.grid_cleared_func:
+            self.grid_cleared_func()
+
+    def game_over(self):
+        self.game_done = True
+        if self.game_over_func:
+            self.game_over_func()
+
+    def update(self, dt=TICK_MS):
+        # Advances the game by dt milliseconds. Time left over after a step
+        # carries into the next update, so the timings hold for any dt shorter
+        # than SOFT_DROP_MS.
+        if self.game_done:
+            return
+        self.elapsed += dt
+        if self.clearing_lines:
+            self.clear_time += dt
+            while self.clearing_lines and self.clear_time >= CLEAR_STEP_MS:
+                self.clear_time -= CLEAR_STEP_MS
+                self.clear_lines_animation()
+        elif not self.fall_interval:
+            self.time += dt
+            self.update_20g()
+        else:
+            self.time += dt
+            interval = min(self.fall_interval, SOFT_DROP_MS) if self.down_down else self.fall_interval
+            if self.time >= interval:
+                # Carry at most one update's worth, so pressing soft drop
+                # late in a long fall doesn't make up the difference at once.
+                self.time = min(self.time - interval, dt)
+                if self.next_down_inter():
+                    self.lock_piece()
+                else:
+                    self.piece.i -= 1
+
+    def update_20g(self):
+        # The piece drops to where it lands every update. The lock delay
+        # only starts over when it gets lower than it has been, so kicking
+        # it up a row and letting it fall back can't hold it off forever.
+        landing = self.landing_row()
+        self.piece.i = landing
+        if landing < self.lowest_row:
+            self.lowest_row = landing
+            self.time = 0
+        elif self.down_down or self.time >= LOCK_MS:
+            self.lock_piece()
+
+    def lock_piece(self):
+        self.time = 0
+        self.place_piece()
+        self.check_clear_lines()
+        self.new_piece()
+        self.down_down = False
+        if self.grid_intersect():
+            self.game_over()
+
+    def turn_cleared_white(self):
+        for row in self.cleared_lines:
+            self.colors[row][1:self.cols+1] = self.white_row
+        if self.cells_changed_func:
+            self.cells_changed_func([(row, j) for row in self.cleared_lines for j in range(1, self.cols+1)])
+
+    def clear_lines_animation(self):
+        if self.clear_step == 5:
+            self.remove_cleared_lines()
+            self.clear_step = 0
+            self.clear_time = 0
+            self.clearing_lines = False
+        else:
+            for row in self.cleared_lines:
+                self.colors[row][5-self.clear_step] = EMPTY
+                self.colors[row][6+self.clear_step] = EMPTY
+            if self.cells_changed_func:
+                self.cells_changed_func(
+                    [(row, j) for row in self.cleared_lines for j in (5-self.clear_step, 6+self.clear_step)]
+                )
+            self.clear_step += 1
+
+    def remove_cleared_lines(self):
+        for i in range(len(self.cleared_lines)-1, -1, -1):
+            row = self.cleared_lines[i]
+            self.grid.pop(row)
+            self.grid.insert(self.height, self.empty_row)
+            self.colors.pop(row)
+            self.colors.append(bytearray(self.cols+2))
+        # Every column comes down by the cleared rows under its top. If its
+        # top cell was in a cleared row the new top is further down.
+        heights = self.heights
+        for gj in range(1, self.cols+1):
+            height = heights[gj]
+            if height:
+                height -= sum(1 for row in self.cleared_lines if row <= height)
+                heights[gj] = self.column_height(gj, height)
+        if self.rows_removed_func:
+            self.rows_removed_func(self.cleared_lines[::-1])
+        self.cleared_lines = []
+
+    def column_height(self, gj, start):
+        # The highest filled cell in column gj at or below row start.
+        grid = self.grid
+        bit = 1 << (gj + WALL_BITS - 1)
+        while start and not grid[start] & bit:
+            start -= 1
+        return start
+
+    def reset_heights(self):
+        self.heights = [0] + [self.column_height(gj, self.height) for gj in range(1, self.cols+1)]
+
+    def snapshot(self):
+        """Everything needed to put the game back to this moment with restore()."""
+        return (
+            list(self.grid), [bytearray(row) for row in self.colors], list(self.heights),
+            self.copy_piece(self.piece), self.copy_piece(self.next_piece), self.generator.getstate(),
+            self.lowest_row, self.seed, self.elapsed, self.time, self.fall_interval, self.down_down,
+            list(self.cleared_lines), self.clear_step, self.clear_time, self.clearing_lines,
+            self.level, self.score, self.lines_cleared, self.game_done, list(self.garbage_queue)
+        )
+
+    def restore(self, state):
+        (grid, colors, heights, piece, next_piece, generator_state,
+         self.lowest_row, self.seed, self.elapsed, self.time, self.fall_interval, self.down_down,
+         cleared_lines, self.clear_step, self.clear_time, self.clearing_lines,
+         self.level, self.score, self.lines_cleared, self.game_done, garbage_queue) = state
+        self.grid = list(grid)
+        self.colors = [bytearray(row) for row in colors]
+        self.heights = list(heights)
+        self.piece = self.copy_piece(piece)
+        self.next_piece = self.copy_piece(next_piece)
+        self.generator.setstate(generator_state)
+        self.cleared_lines = list(cleared_lines)
+        self.garbage_queue = list(garbage_queue)
+
+    def copy_piece(self, piece):
+        if piece is None:
+            return None
+        copy = self.spawn_piece(piece.id)
+        copy.rotation, copy.i, copy.j = piece.rotation, piece.i, piece.j
+        return copy
+
+    def init_grid(self):
+        self.grid = [self.full_row] + [self.empty_row] * self.height + [self.full_row] * WALL_BITS
+        self.colors = [bytearray(self.cols+2) for _ in range(self.height+1)]
+        # The skyline: heights[gj] is the row of the highest filled cell in
+        # column gj, 0 for an empty column. It's kept up to date as pieces
+        # lock and rows go, so a piece's landing row takes one lookup per
+        # column it covers.
+        self.heights = [0] * (self.cols+1)
+        self.white_row = bytes([WHITE]) * self.cols
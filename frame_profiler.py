@@ -0,0 +1,253 @@
+"""
+Per-frame timings, for finding out where a stutter came from.
+
+TetrisController.frame reports each phase of the frame (waiting on the
+clock, leaderboard callbacks, updating, drawing, the display flip, warm-up
+and events) and WidgetSurfaceHolder reports every widget surface's update,
+dirty-rect and draw time. The last few hundred frames are kept in a ring
+buffer; histograms and over-budget counts cover the whole run.
+
+    python tetro.py --profile                 # F3 toggles the overlay
+    python tetro.py --profile --profile-out /tmp/tetro-profile
+
+When the game closes the results are written to PATH.json and PATH.csv.
+Without --profile no profiler exists and the hooks are skipped.
+"""
+import bisect
+import csv
+import json
+import os
+import time
+from collections import deque
+
+import pygame
+
+from widgetstuff import get_font
+
+
+
+# Upper bounds of the histogram buckets in ms; the last bucket is open.
+BUCKETS_MS = (1, 2, 4, 8, 12, 16, 20, 25, 33, 50, 100, 250)
+OVERLAY_KEY = pygame.K_F3
+OVERLAY_REFRESH_MS = 250
+
+
+
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        labels = ["<=%g" % ms for ms in self.buckets] + [">%g" % self.buckets[-1]]
+        return {
+            "count": self.count,
+            "mean_ms": self.mean(),
+            "max_ms": self.max,
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+
+
+
+class FrameProfiler(object):
+    """
+    Call start_frame() at the top of a frame, lap(name) after each phase and
+    end_frame() at the bottom. frame_ms is the time from one end_frame() to
+    the next, which is what the player sees; work_ms leaves out the "wait"
+    phase, the time spent sleeping in clock.tick. A frame whose work doesn't
+    fit in the budget counts as over budget, and one that took more than
+    one and a half budgets to show counts as late.
+    """
+
+    def __init__(self, fps=60, capacity=600):
+        self.budget_ms = 1000 / (fps or 60)
+        self.frames = deque(maxlen=capacity)
+        self.histograms = {"frame": Histogram(), "work": Histogram()}
+        self.surface_histograms = {}
+        self.count = 0
+        self.over_budget = 0
+        self.late = 0
+        self.last_end = None
+        self.last_lap = None
+        self.phases = {}
+        self.surfaces = {}
+        self.overlay = None
+
+    def start_frame(self):
+        self.last_lap = time.perf_counter()
+        self.phases = {}
+        self.surfaces = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self.last_lap) * 1000
+        self.last_lap = now
+
+    def time_surface(self, name, part, func, *args):
+        # Times one call of a widget surface's update, get_dirty_rects or draw.
+        start = time.perf_counter()
+        result = func(*args)
+        key = name + "." + part
+        self.surfaces[key] = self.surfaces.get(key, 0.0) + (time.perf_counter() - start) * 1000
+        return result
+
+    def end_frame(self):
+        now = time.perf_counter()
+        phases = self.phases
+        work_ms = sum(phases.values()) - phases.get("wait", 0.0)
+        frame_ms = (now - self.last_end) * 1000 if self.last_end is not None else work_ms
+        self.last_end = now
+        self.count += 1
+        if work_ms > self.budget_ms:
+            self.over_budget += 1
+        if frame_ms > self.budget_ms * 1.5:
+            self.late += 1
+        histograms = self.histograms
+        histograms["frame"].add(frame_ms)
+        histograms["work"].add(work_ms)
+        for name, ms in phases.items():
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            histogram.add(ms)
+        for key, ms in self.surfaces.items():
+            histogram = self.surface_histograms.get(key)
+            if histogram is None:
+                histogram = self.surface_histograms[key] = Histogram()
+            histogram.add(ms)
+        self.frames.append({
+            "frame": self.count,
+            "frame_ms": frame_ms,
+            "work_ms": work_ms,
+            "phases": phases,
+            "surfaces": self.surfaces
+        })
+
+    def recent(self, n):
+        return list(self.frames)[-n:]
+
+    def check_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key == OVERLAY_KEY:
+            self.overlay = None if self.overlay else ProfilerOverlay(self)
+
+    def to_dict(self):
+        return {
+            "budget_ms": self.budget_ms,
+            "frames": self.count,
+            "over_budget": self.over_budget,
+            "late": self.late,
+            "phases": {name: h.to_dict() for name, h in self.histograms.items()},
+            "surfaces": {key: h.to_dict() for key, h in self.surface_histograms.items()},
+            "recent": list(self.frames)
+        }
+
+    def save(self, base):
+        """Writes base.json with everything and base.csv with the recent frames."""
+        directory = os.path.dirname(base)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(base + ".json", "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        phase_names = sorted(set(name for frame in self.frames for name in frame["phases"]))
+        surface_keys = sorted(set(key for frame in self.frames for key in frame["surfaces"]))
+        with open(base + ".csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "frame_ms", "work_ms"] + phase_names + surface_keys)
+            for frame in self.frames:
+                row = [frame["frame"], "%.3f" % frame["frame_ms"], "%.3f" % frame["work_ms"]]
+                row += ["%.3f" % frame["phases"].get(name, 0.0) for name in phase_names]
+                row += ["%.3f" % frame["surfaces"].get(key, 0.0) for key in surface_keys]
+                writer.writerow(row)
+        return base + ".json", base + ".csv"
+
+    def summary(self):
+        frame = self.histograms["frame"]
+        return "profile: %d frames, mean %.1f ms, max %.1f ms, %d over the %.1f ms budget, %d late" % (
+            self.count, frame.mean(), frame.max, self.over_budget, self.budget_ms, self.late)
+
+
+
+
+
+class ProfilerOverlay(object):
+    """
+    Text box in the top left corner with the averages of the last second
+    of frames. The text is re-rendered a few times a second; in between the
+    same surface is blitted every frame.
+    """
+
+    def __init__(self, profiler, pos=(5, 5)):
+        self.profiler = profiler
+        self.pos = pos
+        self.font = get_font("menlottc", 12)
+        self.surface = None
+        self.rect = pygame.Rect(pos, (0, 0))
+        self.next_refresh = 0
+
+    def lines(self):
+        profiler = self.profiler
+        frames = profiler.recent(60)
+        if not frames:
+            return ["profiling..."]
+        n = len(frames)
+        frame_ms = sum(frame["frame_ms"] for frame in frames) / n
+        work_ms = sum(frame["work_ms"] for frame in frames) / n
+        lines = [
+            "%5.1f fps  frame %5.2f ms  max %5.1f" % (1000 / frame_ms if frame_ms else 0, frame_ms,
+                                                      max(frame["frame_ms"] for frame in frames)),
+            "work %5.2f ms  over budget %d  late %d" % (work_ms, profiler.over_budget, profiler.late)
+        ]
+        phases = {}
+        surfaces = {}
+        for frame in frames:
+            for name, ms in frame["phases"].items():
+                phases[name] = phases.get(name, 0.0) + ms
+            for key, ms in frame["surfaces"].items():
+                surfaces[key] = surfaces.get(key, 0.0) + ms
+        for name, ms in sorted(phases.items(), key=lambda item: -item[1]):
+            lines.append("  %-12s %6.2f" % (name, ms / n))
+        for key, ms in sorted(surfaces.items(), key=lambda item: -item[1])[:4]:
+            lines.append("  %-20s %6.2f" % (key, ms / n))
+        return lines
+
+    def refresh(self):
+        rendered = [self.font.render(line, True, (255, 255, 255)) for line in self.lines()]
+        w = max(text.get_width() for text in rendered) + 8
+        h = sum(text.get_height() for text in rendered) + 8
+        self.surface = pygame.Surface((w, h))
+        self.surface.set_alpha(200)
+        y = 4
+        for text in rendered:
+            self.surface.blit(text, (4, y))
+            y += text.get_height()
+        self.rect = self.surface.get_rect(topleft=self.pos)
+
+    def draw(self, surface):
+        # Returns the rect drawn over, which has to be redrawn next frame.
+        now = pygame.time.get_ticks()
+        if self.surface is None or now >= self.next_refresh:
+            self.next_refresh = now + OVERLAY_REFRESH_MS
+            old_rect = self.rect
+            self.refresh()
+            rect = self.rect.union(old_rect)
+        else:
+            rect = self.rect
+        surface.blit(self.surface, self.rect)
+        return rect
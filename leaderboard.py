@@ -0,0 +1,191 @@
+import threading
+import time
+from queue import Queue, Empty
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from score_queue import ScoreQueue
+
+
+
+
+
+class LeaderboardClient(object):
+    """
+    Talks to the high score API on a background thread so the game loop
+    never waits on the network. Callbacks are queued by the worker and run
+    on the caller's thread from poll(), which the game loop calls each frame.
+    """
+
+    def __init__(self, url, timeout=(3.05, 5), retries=3, backoff=0.5, ttl=60, queue=None, batch_size=50):
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+
+        # Submitted scores are journaled in queue and sent in batches; after a
+        # failed flush the next one waits flush_delay, doubling up to a limit.
+        self.queue = queue if queue is not None else ScoreQueue()
+        self.batch_size = batch_size
+        self.batch_supported = True
+        self.flushing = False
+        self.next_flush = 0
+        self.flush_delay = 0
+        self.min_flush_delay = 5
+        self.max_flush_delay = 300
+
+        self.session = requests.Session()
+        # Only idempotent requests (GETs) are retried on errors.
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # {qnt: {"scores", "expires", "etag", "last_modified"}}
+        self.cache = {}
+        self.waiting = {}
+
+        self.jobs = Queue()
+        self.results = Queue()
+        self.worker = threading.Thread(target=self.work, name="leaderboard", daemon=True)
+        self.worker.start()
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            func, args, done = job
+            # Any failure, including OSError from the score journal, goes
+            # back to done, so the worker never dies with a job unanswered.
+            try:
+                result = func(*args)
+            except Exception as e:
+                result = e
+            self.results.put((done, result))
+
+    def poll(self):
+        while True:
+            try:
+                done, result = self.results.get_nowait()
+            except Empty:
+                break
+            done(result)
+        if len(self.queue) and not self.flushing and time.monotonic() >= self.next_flush:
+            self.flush()
+
+    def close(self):
+        self.jobs.put(None)
+        self.worker.join(1)
+        self.session.close()
+
+    def fetch_high_scores(self, qnt, etag, last_modified):
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        params = {"qnt": qnt, "sort": True}
+        response = self.session.get(self.url, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        return response.json(), response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+    def get_high_scores(self, callback, qnt=10):
+        """
+        Calls callback(scores) with the top qnt scores as [name, score] pairs,
+        or callback(None) if they couldn't be loaded. Cached scores are passed
+        straight away; if they're older than ttl they are revalidated and
+        callback is called again when that finishes.
+        """
+        entry = self.cache.get(qnt)
+        if entry:
+            callback(entry["scores"])
+            if time.monotonic() < entry["expires"]:
+                return
+        if qnt in self.waiting:
+            self.waiting[qnt].append(callback)
+            return
+        self.waiting[qnt] = [callback]
+        etag = entry["etag"] if entry else None
+        last_modified = entry["last_modified"] if entry else None
+        done = lambda result: self.high_scores_fetched(qnt, result)
+        self.jobs.put((self.fetch_high_scores, (qnt, etag, last_modified), done))
+
+    def high_scores_fetched(self, qnt, result):
+        entry = self.cache.get(qnt)
+        if result is None and entry is None:
+            # Not modified, but the cache was cleared while we waited; fetch
+            # the scores again without the validators.
+            done = lambda result: self.high_scores_fetched(qnt, result)
+            self.jobs.put((self.fetch_high_scores, (qnt, None, None), done))
+            return
+        if isinstance(result, Exception):
+            scores = entry["scores"] if entry else None
+        else:
+            if result is not None:
+                scores, etag, last_modified = result
+                entry = self.cache[qnt] = {"scores": scores, "etag": etag, "last_modified": last_modified}
+            entry["expires"] = time.monotonic() + self.ttl
+            scores = entry["scores"]
+        for callback in self.waiting.pop(qnt, []):
+            callback(scores)
+
+    def post_batch(self, batch):
+        scores = [{"id": entry["id"], "name": entry["name"], "score": entry["score"]} for entry in batch]
+        response = self.session.post(self.url + "/batch", json={"scores": scores}, timeout=self.timeout)
+        if response.status_code in (404, 405, 501):
+            return False
+        response.raise_for_status()
+        self.queue.ack([entry["id"] for entry in batch])
+        return True
+
+    def post_high_score(self, entry):
+        data = {"name": entry["name"], "score": entry["score"]}
+        headers = {"Idempotency-Key": entry["id"]}
+        response = self.session.post(self.url, data=data, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        self.queue.ack([entry["id"]])
+
+    def flush_scores(self):
+        # Runs on the worker. Falls back to one POST per score for APIs
+        # without a batch endpoint. A journal write that failed when a score
+        # was submitted is tried again first.
+        self.queue.sync()
+        sent = 0
+        while True:
+            batch = self.queue.batch(self.batch_size)
+            if not batch:
+                return sent
+            if self.batch_supported and not self.post_batch(batch):
+                self.batch_supported = False
+            if not self.batch_supported:
+                for entry in batch:
+                    self.post_high_score(entry)
+            sent += len(batch)
+
+    def flush(self):
+        self.flushing = True
+        self.jobs.put((self.flush_scores, (), self.scores_flushed))
+
+    def scores_flushed(self, result):
+        self.flushing = False
+        if isinstance(result, Exception):
+            self.flush_delay = min(max(self.flush_delay * 2, self.min_flush_delay), self.max_flush_delay)
+            self.next_flush = time.monotonic() + self.flush_delay
+        else:
+            self.flush_delay = 0
+            if result:
+                # The cached top scores may now be out of date.
+                self.cache.clear()
+
+    def submit_high_score(self, name, score):
+        """
+        Journals a score on disk straight away; it is sent with the next
+        flush, which poll() starts whenever scores are waiting.
+        """
+        self.queue.add(name, score)
+        if not self.flushing:
+            self.next_flush = 0
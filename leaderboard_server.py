@@ -0,0 +1,301 @@
+"""
+Self-hosted high score API, compatible with the one TetrisController uses.
+
+    GET  /tetro/high-scores?qnt=10&sort=True   [[name, score], ...]
+    POST /tetro/high-scores                    form fields name, score
+    POST /tetro/high-scores/batch              {"scores": [{"id", "name", "score"}]}
+    GET  /tetro/high-scores/player?name=...    {"name", "score", "rank"}
+    GET  /tetro/high-scores/rank?score=...     {"score", "rank"}
+
+Scores are kept in a ScoreIndex and appended to a JSONL log, which is
+replayed on startup. POSTs carrying an Idempotency-Key header (or batch
+entries with an id) are only recorded once.
+
+    python leaderboard_server.py --port 8080 --data scores.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import traceback
+from urllib.parse import urlsplit, parse_qs
+
+from score_index import ScoreIndex
+
+
+
+PREFIX = "/tetro/high-scores"
+MAX_NAME_LENGTH = 15
+MAX_BODY = 1 << 20
+
+REASONS = {
+    200: "OK", 201: "Created", 304: "Not Modified", 400: "Bad Request",
+    404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"
+}
+
+
+
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        Exception.__init__(self, message or REASONS[status])
+        self.status = status
+
+
+
+
+
+class LeaderboardServer(object):
+    def __init__(self, data_path=None, fsync_interval=1.0):
+        self.index = ScoreIndex()
+        self.recent = []
+        self.ids = set()
+        self.version = 0
+        self.data_path = data_path
+        self.fsync_interval = fsync_interval
+        self.log = None
+        self.unsynced = False
+        if data_path:
+            self.load()
+            self.log = open(data_path, "a")
+
+    def load(self):
+        if not os.path.exists(self.data_path):
+            return
+        end = 0
+        with open(self.data_path, "rb") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if not line.endswith(b"\n"):
+                        # A record cut short by a crash mid-write.
+                        break
+                    record = None
+                end += len(line)
+                try:
+                    if not isinstance(record, dict):
+                        raise HttpError(400, "not a JSON object")
+                    name, score = self.parse_score(record.get("name"), record.get("score"))
+                    id = self.parse_id(record.get("id"))
+                except HttpError as e:
+                    print("Skipping bad record on line %d of %s: %s" % (number, self.data_path, e), file=sys.stderr)
+                    continue
+                self.add_score(name, score, id, log=False)
+        if end < os.path.getsize(self.data_path):
+            # Cut off a line torn by a crash mid-write, so the next score
+            # isn't appended onto it and lost with it on the next start.
+            print("Truncating a torn record at the end of %s" % self.data_path, file=sys.stderr)
+            os.truncate(self.data_path, end)
+        elif end and not line.endswith(b"\n"):
+            with open(self.data_path, "a") as f:
+                f.write("\n")
+
+    def add_score(self, name, score, id=None, log=True):
+        """Returns the rank of the new score, or None if id was already recorded."""
+        if id is not None:
+            if id in self.ids:
+                return None
+            self.ids.add(id)
+        rank = self.index.insert(name, score)
+        self.recent.append((name, score))
+        self.version += 1
+        if log and self.log:
+            self.log.write(json.dumps({"id": id, "name": name, "score": score}) + "\n")
+            self.unsynced = True
+        return rank
+
+    async def sync_log(self):
+        # Log writes are buffered; they reach the disk at most fsync_interval
+        # seconds later.
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            if self.unsynced:
+                self.unsynced = False
+                self.log.flush()
+                os.fsync(self.log.fileno())
+
+    def close(self):
+        if self.log:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.log.close()
+            self.log = None
+
+    def parse_score(self, name, score):
+        name = name.strip() if isinstance(name, str) else ""
+        if not name or len(name) > MAX_NAME_LENGTH:
+            raise HttpError(400, "name must be 1 to %d characters" % MAX_NAME_LENGTH)
+        try:
+            score = int(score)
+        except (TypeError, ValueError, OverflowError):
+            raise HttpError(400, "score must be an integer")
+        if score < 0:
+            raise HttpError(400, "score must not be negative")
+        return name, score
+
+    def parse_id(self, id):
+        # Idempotency keys are strings or integers; anything else can't be
+        # looked up, or would be confused with a number (True == 1).
+        if id is not None and (not isinstance(id, (str, int)) or isinstance(id, bool)):
+            raise HttpError(400, "id must be a string or an integer")
+        return id
+
+    def get_high_scores(self, query, headers):
+        etag = '"%d"' % self.version
+        if headers.get("if-none-match") == etag:
+            return 304, None, {"ETag": etag}
+        try:
+            qnt = int(query.get("qnt", ["10"])[0])
+        except ValueError:
+            raise HttpError(400, "qnt must be an integer")
+        qnt = max(0, qnt)
+        sort = query.get("sort", ["True"])[0].lower() not in ("false", "0", "")
+        if sort:
+            scores = self.index.top(qnt)
+        else:
+            scores = self.recent[-qnt:] if qnt else []
+        return 200, [list(score) for score in scores], {"ETag": etag}
+
+    def post_high_score(self, form, headers):
+        name, score = self.parse_score(form.get("name", [None])[0], form.get("score", [None])[0])
+        rank = self.add_score(name, score, self.parse_id(headers.get("idempotency-key")))
+        return 201, {"rank": rank, "duplicate": rank is None}, {}
+
+    def post_batch(self, body):
+        try:
+            entries = json.loads(body)["scores"]
+            if not all(isinstance(entry, dict) for entry in entries):
+                raise TypeError
+            # Every entry is checked before any is added, so a bad one
+            # doesn't leave the batch half recorded.
+            scores = [self.parse_score(entry.get("name"), entry.get("score")) + (self.parse_id(entry.get("id")),)
+                      for entry in entries]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise HttpError(400, "expected {\"scores\": [{\"name\", \"score\"}, ...]}")
+        accepted = sum(1 for name, score, id in scores if self.add_score(name, score, id) is not None)
+        return 200, {"accepted": accepted, "duplicates": len(scores) - accepted}, {}
+
+    def get_player(self, query):
+        name = query.get("name", [""])[0]
+        best = self.index.player_best(name)
+        if best is None:
+            raise HttpError(404, "no scores for %r" % name)
+        return 200, {"name": name, "score": best[0], "rank": best[1]}, {}
+
+    def get_rank(self, query):
+        try:
+            score = int(query["score"][0])
+        except (KeyError, ValueError):
+            raise HttpError(400, "score must be an integer")
+        return 200, {"score": score, "rank": self.index.rank_of_score(score)}, {}
+
+    def route(self, method, target, headers, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+        query = parse_qs(url.query)
+        if path == PREFIX:
+            if method == "GET":
+                return self.get_high_scores(query, headers)
+            if method == "POST":
+                return self.post_high_score(parse_qs(body.decode("utf-8", "replace")), headers)
+        elif path == PREFIX + "/batch":
+            if method == "POST":
+                return self.post_batch(body)
+        elif path == PREFIX + "/player":
+            if method == "GET":
+                return self.get_player(query)
+        elif path == PREFIX + "/rank":
+            if method == "GET":
+                return self.get_rank(query)
+        else:
+            raise HttpError(404)
+        raise HttpError(405)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    if length < 0:
+                        # There's no telling where the body ends.
+                        keep_alive = False
+                        raise HttpError(400, "bad Content-Length")
+                    if length > MAX_BODY:
+                        keep_alive = False
+                        raise HttpError(413)
+                    body = await reader.readexactly(length) if length else b""
+                    status, data, extra = self.route(method, target, headers, body)
+                except HttpError as e:
+                    status, data, extra = e.status, {"error": str(e)}, {}
+                payload = b"" if data is None else json.dumps(data).encode()
+                head = ["HTTP/1.1 %d %s" % (status, REASONS[status])]
+                head.append("Content-Type: application/json")
+                head.append("Content-Length: %d" % len(payload))
+                head.extend("%s: %s" % item for item in extra.items())
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        if self.log:
+            asyncio.ensure_future(self.sync_log())
+        print("Serving %d scores on http://%s:%d%s" % (len(self.index), host, port, PREFIX))
+        async with server:
+            await server.serve_forever()
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tetro high score server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--data", default="high_scores.jsonl", help="score log, replayed on startup")
+    args = parser.parse_args()
+    server = LeaderboardServer(args.data)
+    # Stop on SIGTERM the same way as Ctrl-C, so the log is flushed.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+
+if __name__ == "__main__":
+    main()
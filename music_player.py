@@ -0,0 +1,64 @@
+import os
+
+import pygame
+
+
+
+EXTENSIONS = (".ogg", ".wav", ".mp3")
+
+
+
+
+
+class MusicPlayer(object):
+    """
+    Streams background music from disk with pygame.mixer.music instead of
+    decoding the whole track into a Sound, so only the mixer's buffer is
+    kept in memory. The track can be OGG, WAV or MP3; if none is found the
+    player stays silent.
+    """
+
+    def __init__(self, path):
+        self.path = self.find(path)
+        self.volume = 1.0
+        self.paused = False
+
+    def find(self, path):
+        # path may be given without an extension, or with one that doesn't
+        # exist, in which case the other supported formats are tried.
+        base, ext = os.path.splitext(path)
+        for candidate in ([path] if ext else []) + [base + ext for ext in EXTENSIONS]:
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def play(self, loops=-1):
+        if self.path is None:
+            return
+        pygame.mixer.music.load(self.path)
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.play(loops)
+        self.paused = False
+
+    def pause(self):
+        pygame.mixer.music.pause()
+        self.paused = True
+
+    def unpause(self):
+        pygame.mixer.music.unpause()
+        self.paused = False
+
+    def fadeout(self, ms):
+        pygame.mixer.music.fadeout(ms)
+        self.paused = False
+
+    def stop(self):
+        pygame.mixer.music.stop()
+        self.paused = False
+
+    def set_volume(self, volume):
+        self.volume = volume
+        pygame.mixer.music.set_volume(volume)
+
+    def get_busy(self):
+        return pygame.mixer.music.get_busy()
@@ -12,6 +12,8 @@ class TextInput:
     This class let's the user input a short, one-lines piece of text at a blinking cursor
     that can be moved using the arrow-keys. Delete, home and end work as well.
     """
+    event_types = (pl.KEYDOWN, pl.KEYUP)
+
     def __init__(
             self,
             pos=(0, 0),
@@ -24,7 +26,8 @@ class TextInput:
             cursor_color=(0, 0, 1),
             repeat_keys_initial_ms=400,
             repeat_keys_interval_ms=35,
-            max_string_length=-1):
+            max_string_length=-1,
+            clock=None):
         """
         :param initial_string: Initial text to be displayed
         :param font_family: name or list of names for font (see pygame.font.match_font for precise format)
@@ -35,6 +38,9 @@ class TextInput:
         :param repeat_keys_initial_ms: Time in ms before keys are repeated when held
         :param repeat_keys_interval_ms: Interval between key press repetition when held
         :param max_string_length: Allowed length of text
+        :param clock: pygame.time.Clock ticked once per frame by the main loop; its
+            get_time() drives key repeat and cursor blinking. Without one, the time
+            between update calls is measured with pygame.time.get_ticks()
         """
 
         self.pos = (pos[0] + parent_pos[0], pos[1] + parent_pos[1])
@@ -68,7 +74,19 @@ class TextInput:
         self.cursor_switch_ms = 500  # /|\
         self.cursor_ms_counter = 0
 
-        self.clock = pygame.time.Clock()
+        # The text surface is only re-rendered when text or colour change, and
+        # the cursor is drawn over it in draw():
+        self.rendered_state = None
+        self.cursor_state = None
+        self.cursor_x = 0
+
+        # Area covered by the last frame drawn, and what it showed:
+        self.drawn_rect = self.surface.get_rect(topleft=self.pos)
+        self.drawn_state = None
+        self.dirty_rects = []
+
+        self.clock = clock
+        self.last_ticks = pygame.time.get_ticks()
 
     def check_event(self, event):
         if event.type == pygame.KEYDOWN:
@@ -123,10 +141,20 @@ class TextInput:
             if event.key in self.keyrepeat_counters:
                 del self.keyrepeat_counters[event.key]
 
+    def get_elapsed_ms(self):
+        if self.clock:
+            return self.clock.get_time()
+        ticks = pygame.time.get_ticks()
+        elapsed = ticks - self.last_ticks
+        self.last_ticks = ticks
+        return elapsed
+
     def update(self):
+        elapsed = self.get_elapsed_ms()
+
         # Update key counters:
         for key in self.keyrepeat_counters:
-            self.keyrepeat_counters[key][0] += self.clock.get_time()  # Update clock
+            self.keyrepeat_counters[key][0] += elapsed
 
             # Generate new key events if enough time has passed:
             if self.keyrepeat_counters[key][0] >= self.keyrepeat_intial_interval_ms:
@@ -139,30 +167,56 @@ class TextInput:
                 pygame.event.post(pygame.event.Event(pl.KEYDOWN, key=event_key, unicode=event_unicode))
 
         # Re-render text surface:
-        self.surface = self.font_object.render(self.input_string, self.antialias, self.text_color)
+        rendered_state = (self.input_string, self.text_color)
+        if rendered_state != self.rendered_state:
+            self.rendered_state = rendered_state
+            self.surface = self.font_object.render(self.input_string, self.antialias, self.text_color)
+
+        cursor_state = (self.input_string, self.cursor_position)
+        if cursor_state != self.cursor_state:
+            self.cursor_state = cursor_state
+            self.cursor_x = self.font_object.size(self.input_string[:self.cursor_position])[0]
+            # Without this, the cursor is invisible when self.cursor_position > 0:
+            if self.cursor_position > 0:
+                self.cursor_x -= self.cursor_surface.get_width()
 
         # Update self.cursor_visible
-        self.cursor_ms_counter += self.clock.get_time()
+        self.cursor_ms_counter += elapsed
         if self.cursor_ms_counter >= self.cursor_switch_ms:
             self.cursor_ms_counter %= self.cursor_switch_ms
             self.cursor_visible = not self.cursor_visible
 
-        if self.cursor_visible:
-            cursor_y_pos = self.font_object.size(self.input_string[:self.cursor_position])[0]
-            # Without this, the cursor is invisible when self.cursor_position > 0:
-            if self.cursor_position > 0:
-                cursor_y_pos -= self.cursor_surface.get_width()
-            self.surface.blit(self.cursor_surface, (cursor_y_pos, 0))
+        state = (self.surface, self.cursor_x, self.cursor_visible)
+        if state != self.drawn_state:
+            self.drawn_state = state
+            self.dirty_rects.append(self.drawn_rect)
+            self.drawn_rect = self.surface.get_rect(topleft=self.pos).union(self.get_cursor_rect())
+            self.dirty_rects.append(self.drawn_rect)
 
-        self.clock.tick()
         return False
 
+    def get_cursor_rect(self):
+        # The cursor is cut to the height of the text, as it used to be when it
+        # was drawn into the text surface.
+        return pygame.Rect(
+            self.pos[0] + self.cursor_x, self.pos[1],
+            self.cursor_surface.get_width(), min(self.cursor_surface.get_height(), self.surface.get_height())
+        )
+
     def draw(self, surface):
         surface.blit(self.surface, self.pos)
+        if self.cursor_visible:
+            rect = self.get_cursor_rect()
+            surface.blit(self.cursor_surface, rect, ((0, 0), rect.size))
 
     def get_surface(self):
         return self.surface
 
+    def get_dirty_rects(self):
+        rects = self.dirty_rects
+        self.dirty_rects = []
+        return rects
+
     def get_text(self):
         return self.input_string
 
@@ -171,9 +225,11 @@ class TextInput:
 
     def set_text_color(self, color):
         self.text_color = color
+        self.drawn_state = None
 
     def set_cursor_color(self, color):
         self.cursor_surface.fill(color)
+        self.drawn_state = None
 
     def clear_text(self):
         self.input_string = ""
@@ -184,11 +240,11 @@ class TextInput:
 if __name__ == "__main__":
     pygame.init()
 
-    textinput = TextInput()
-
     screen = pygame.display.set_mode((1000, 200))
     clock = pygame.time.Clock()
 
+    textinput = TextInput(pos=(10, 10), clock=clock)
+
     while True:
         screen.fill((225, 255, 255))
 
@@ -198,9 +254,7 @@ if __name__ == "__main__":
                 exit()
 
         textinput.update()
-        ni = textinput.get_surface()
-        print(ni.get_size())
-        screen.blit(ni, (10, 10))
+        textinput.draw(screen)
 
         pygame.display.update()
         clock.tick(30)
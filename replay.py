@@ -0,0 +1,196 @@
+"""
+Game recordings: the piece generator, its seed, the gravity and every
+input with the game time it was made at. The engine only depends on those, so replaying
+the inputs against a fresh engine reproduces the game exactly.
+
+Headless playback re-scores recordings as fast as the engine runs:
+
+    python replay.py ~/.tetro/replays/*.json
+
+To watch one at normal speed, run python tetro.py --replay FILE.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from engine import TetrisEngine, GENERATORS, GRAVITIES, TICK_MS, VERSION as ENGINE_VERSION
+
+
+
+VERSION = 1
+
+
+
+
+
+def gravity_name(gravity):
+    for name, func in GRAVITIES.items():
+        if func is gravity:
+            return name
+    raise ValueError("only games with one of the GRAVITIES can be recorded")
+
+
+def version_problem(recording):
+    return "recorded with engine version %d, this is version %d" % (recording.engine_version, ENGINE_VERSION)
+
+
+
+
+
+class Recording(object):
+    def __init__(self, seed, generator="uniform", rows=20, cols=10, tick_ms=TICK_MS, gravity="normal"):
+        self.seed = seed
+        self.generator = generator
+        self.gravity = gravity
+        self.rows = rows
+        self.cols = cols
+        self.tick_ms = tick_ms
+        self.engine_version = ENGINE_VERSION
+        self.inputs = []
+        self.duration = None
+        self.score = None
+        self.lines = None
+
+    @classmethod
+    def start(cls, engine):
+        """Starts recording engine, which must have just been reset."""
+        recording = cls(engine.seed, engine.generator.name, engine.rows, engine.cols,
+                        gravity=gravity_name(engine.gravity))
+        engine.connect_input(recording.add)
+        return recording
+
+    def add(self, elapsed, name):
+        self.inputs.append((elapsed, name))
+
+    def finish(self, engine):
+        self.duration = engine.elapsed
+        self.score = engine.score
+        self.lines = engine.lines_cleared
+
+    def to_dict(self):
+        return {
+            "version": VERSION,
+            "seed": self.seed,
+            "generator": self.generator,
+            "gravity": self.gravity,
+            "rows": self.rows,
+            "cols": self.cols,
+            "tick_ms": self.tick_ms,
+            "engine_version": self.engine_version,
+            "duration": self.duration,
+            "score": self.score,
+            "lines": self.lines,
+            "inputs": [list(entry) for entry in self.inputs]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        recording = cls(data["seed"], data["generator"], data["rows"], data["cols"], data["tick_ms"],
+                        data.get("gravity", "normal"))
+        recording.engine_version = data.get("engine_version", 1)
+        recording.inputs = [tuple(entry) for entry in data["inputs"]]
+        recording.duration = data["duration"]
+        recording.score = data["score"]
+        recording.lines = data["lines"]
+        return recording
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+
+
+
+class ReplayPlayer(object):
+    """
+    Feeds a recording's inputs to an engine. Call apply() before each
+    engine.update(recording.tick_ms); the game is over once finished()
+    is true. A recording made by another engine version won't play the
+    same game, so it raises ValueError unless force is set.
+    """
+
+    def __init__(self, recording, force=False):
+        if recording.engine_version != ENGINE_VERSION and not force:
+            raise ValueError(version_problem(recording))
+        self.recording = recording
+        self.index = 0
+
+    def new_engine(self):
+        recording = self.recording
+        engine = TetrisEngine(recording.rows, recording.cols, GENERATORS[recording.generator](),
+                              GRAVITIES[recording.gravity])
+        engine.reset(recording.seed)
+        return engine
+
+    def apply(self, engine):
+        inputs = self.recording.inputs
+        while self.index < len(inputs) and inputs[self.index][0] <= engine.elapsed:
+            engine.input(inputs[self.index][1])
+            self.index += 1
+
+    def finished(self, engine):
+        duration = self.recording.duration
+        return engine.game_done or (duration is not None and engine.elapsed >= duration)
+
+    def run(self, engine=None):
+        """Plays the whole recording without rendering and returns the engine."""
+        if engine is None:
+            engine = self.new_engine()
+        tick_ms = self.recording.tick_ms
+        while not self.finished(engine):
+            self.apply(engine)
+            engine.update(tick_ms)
+        return engine
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score Tetro recordings without rendering")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the summary")
+    parser.add_argument("--force", action="store_true", help="replay recordings from other engine versions too")
+    args = parser.parse_args()
+
+    mismatches = 0
+    skipped = 0
+    game_ms = 0
+    start = time.perf_counter()
+    for path in args.paths:
+        recording = Recording.load(path)
+        try:
+            engine = ReplayPlayer(recording, args.force).run()
+        except ValueError as e:
+            skipped += 1
+            print("%s skipped: %s" % (path, e))
+            continue
+        game_ms += engine.elapsed
+        matches = recording.score is None or (engine.score, engine.lines_cleared) == (recording.score, recording.lines)
+        if not matches:
+            mismatches += 1
+        if not args.quiet or not matches:
+            print("%s score %d lines %d%s" % (path, engine.score, engine.lines_cleared,
+                                              "" if matches else " (recorded %s)" % recording.score))
+    elapsed = time.perf_counter() - start
+    print("%d games, %.0f games/sec, %.0fx real time, %d mismatches" % (
+        len(args.paths) - skipped, (len(args.paths) - skipped) / elapsed, game_ms / 1000 / elapsed, mismatches) +
+        (", %d skipped from other engine versions" % skipped if skipped else ""))
+    if mismatches:
+        sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    main()
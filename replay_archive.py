@@ -0,0 +1,312 @@
+"""
+An append-only archive of recordings in a compact binary format.
+
+Each record is a fixed header (format and engine version, generator and
+gravity, board size, tick, seed, duration, final score and lines) followed
+by the inputs.
+Every input is one varint: the number of ticks since the previous input,
+shifted left four bits, with the input's index in TetrisEngine.INPUTS in
+the low bits. Most inputs take a single byte.
+
+Records go into ARCHIVE, one after another. ARCHIVE.idx holds one
+fixed-size entry per record with its offset, length, CRC and the fields
+worth filtering on. Listing and filtering read that index through mmap and
+never touch the records themselves.
+
+    python replay_archive.py games.tra add ~/.tetro/replays/*.json
+    python replay_archive.py games.tra list --min-score 1000 --since 2024-01-01
+    python replay_archive.py games.tra extract 12 40 -o /tmp/replays
+    python replay_archive.py games.tra verify
+
+python tetro.py --archive games.tra saves every game played into an archive.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import namedtuple
+
+from engine import TetrisEngine, VERSION as ENGINE_VERSION
+from replay import Recording, ReplayPlayer
+
+
+
+FORMAT_VERSION = 1
+RECORD_MAGIC = b"TR"
+DATA_MAGIC = b"TROA"
+INDEX_MAGIC = b"TROI"
+
+# Generators and gravities by the id stored in records; new ones go on the
+# end. They share a byte, the generator in the low four bits.
+GENERATOR_IDS = ("uniform", "bag")
+GRAVITY_IDS = ("normal", "20g")
+INPUT_IDS = {name: i for i, name in enumerate(TetrisEngine.INPUTS)}
+INPUT_BITS = 4
+
+# magic, format version, engine version, generator and gravity, rows, cols, tick_ms,
+# seed, duration, score, lines, input count
+RECORD_HEADER = struct.Struct("<2sBBBBBHQIIII")
+# magic, format version, entry size
+FILE_HEADER = struct.Struct("<4sHH")
+# offset, length, seed, score, lines, date, duration, crc32
+INDEX_ENTRY = struct.Struct("<QIQIIIII")
+
+IndexEntry = namedtuple("IndexEntry", "number offset length seed score lines date duration crc")
+
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode(recording):
+    """Packs a finished recording into bytes."""
+    if recording.duration is None:
+        raise ValueError("recording isn't finished")
+    if not 0 <= recording.seed < 1 << 64:
+        raise ValueError("seed %r doesn't fit in 64 bits" % recording.seed)
+    out = bytearray(RECORD_HEADER.pack(
+        RECORD_MAGIC, FORMAT_VERSION, recording.engine_version,
+        GENERATOR_IDS.index(recording.generator) | GRAVITY_IDS.index(recording.gravity) << 4,
+        recording.rows, recording.cols, recording.tick_ms, recording.seed,
+        recording.duration, recording.score, recording.lines, len(recording.inputs)))
+    tick = 0
+    for elapsed, name in recording.inputs:
+        input_tick, rest = divmod(elapsed, recording.tick_ms)
+        if rest:
+            raise ValueError("input at %d ms is between ticks" % elapsed)
+        write_varint(out, (input_tick - tick) << INPUT_BITS | INPUT_IDS[name])
+        tick = input_tick
+    return bytes(out)
+
+
+def decode(data):
+    (magic, version, engine_version, generator, rows, cols, tick_ms,
+     seed, duration, score, lines, count) = RECORD_HEADER.unpack_from(data)
+    if magic != RECORD_MAGIC or version != FORMAT_VERSION:
+        raise ValueError("not a version %d replay record" % FORMAT_VERSION)
+    recording = Recording(seed, GENERATOR_IDS[generator & 0xf], rows, cols, tick_ms, GRAVITY_IDS[generator >> 4])
+    recording.engine_version = engine_version
+    recording.duration = duration
+    recording.score = score
+    recording.lines = lines
+    inputs = TetrisEngine.INPUTS
+    mask = (1 << INPUT_BITS) - 1
+    pos = RECORD_HEADER.size
+    tick = 0
+    for _ in range(count):
+        n, pos = read_varint(data, pos)
+        tick += n >> INPUT_BITS
+        recording.inputs.append((tick * tick_ms, inputs[n & mask]))
+    return recording
+
+
+
+
+
+class ReplayArchive(object):
+    """
+    Appending writes the record before its index entry, so a crash can leave
+    unindexed bytes at the end of the archive but never an index entry
+    pointing at nothing. A torn index entry is cut off when the archive is
+    next opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.data_file = None
+        self.index_file = None
+        for file_path, magic in ((self.path, DATA_MAGIC), (self.index_path, INDEX_MAGIC)):
+            if not os.path.exists(file_path):
+                directory = os.path.dirname(file_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(file_path, "wb") as f:
+                    f.write(FILE_HEADER.pack(magic, FORMAT_VERSION, INDEX_ENTRY.size))
+            else:
+                with open(file_path, "rb") as f:
+                    header = f.read(FILE_HEADER.size)
+                if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[:2] != (magic, FORMAT_VERSION):
+                    raise ValueError("%s isn't a version %d replay archive" % (file_path, FORMAT_VERSION))
+        size = os.path.getsize(self.index_path)
+        torn = (size - FILE_HEADER.size) % INDEX_ENTRY.size
+        if torn:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(size - torn)
+
+    def __len__(self):
+        return (os.path.getsize(self.index_path) - FILE_HEADER.size) // INDEX_ENTRY.size
+
+    def append(self, recording, date=None):
+        """Adds a finished recording and returns its number in the archive."""
+        data = encode(recording)
+        if self.data_file is None:
+            self.data_file = open(self.path, "ab")
+            self.index_file = open(self.index_path, "ab")
+        self.data_file.seek(0, os.SEEK_END)
+        offset = self.data_file.tell()
+        self.data_file.write(data)
+        self.data_file.flush()
+        self.index_file.write(INDEX_ENTRY.pack(
+            offset, len(data), recording.seed, recording.score, recording.lines,
+            int(time.time() if date is None else date), recording.duration, zlib.crc32(data)))
+        self.index_file.flush()
+        return len(self) - 1
+
+    def close(self):
+        if self.data_file is not None:
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = self.index_file = None
+
+    def find(self, min_score=0, min_lines=0, since=None, until=None, numbers=None):
+        """
+        Returns the IndexEntry of every record matching the filters, read
+        straight from the mapped index. since and until are Unix times;
+        numbers limits the search to those record numbers.
+        """
+        since = 0 if since is None else since
+        until = float("inf") if until is None else until
+        entries = []
+        with open(self.index_path, "rb") as f:
+            count = (os.fstat(f.fileno()).st_size - FILE_HEADER.size) // INDEX_ENTRY.size
+            if count <= 0:
+                return entries
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                unpack_from = INDEX_ENTRY.unpack_from
+                size = INDEX_ENTRY.size
+                for number in range(count) if numbers is None else numbers:
+                    if not 0 <= number < count:
+                        raise IndexError("no record %d in %s" % (number, self.path))
+                    fields = unpack_from(index, FILE_HEADER.size + number * size)
+                    if fields[3] >= min_score and fields[4] >= min_lines and since <= fields[5] < until:
+                        entries.append(IndexEntry(number, *fields))
+        return entries
+
+    def entry(self, number):
+        return self.find(numbers=[number])[0]
+
+    def read_bytes(self, entry):
+        if self.data_file is not None:
+            self.data_file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(entry.offset)
+            data = f.read(entry.length)
+        if len(data) != entry.length or zlib.crc32(data) != entry.crc:
+            raise ValueError("record %d is corrupt" % entry.number)
+        return data
+
+    def read(self, number):
+        return decode(self.read_bytes(self.entry(number)))
+
+    def verify(self, entry):
+        """Replays a record; returns None if it checks out, or what's wrong."""
+        try:
+            recording = decode(self.read_bytes(entry))
+        except (ValueError, IndexError, struct.error) as e:
+            return str(e)
+        if (recording.seed, recording.score, recording.lines) != (entry.seed, entry.score, entry.lines):
+            return "record doesn't match its index entry"
+        # Old engine versions are replayed anyway; a mismatch says which.
+        engine = ReplayPlayer(recording, force=True).run()
+        if (engine.score, engine.lines_cleared) != (recording.score, recording.lines):
+            problem = "replays to score %d lines %d, recorded %d lines %d" % (
+                engine.score, engine.lines_cleared, recording.score, recording.lines)
+            if recording.engine_version != ENGINE_VERSION:
+                problem += " (recorded with engine version %d)" % recording.engine_version
+            return problem
+        return None
+
+
+
+
+
+def parse_date(text):
+    return time.mktime(time.strptime(text, "%Y-%m-%d"))
+
+
+def run_command(archive, args):
+    if args.command == "add":
+        for path in args.paths:
+            number = archive.append(Recording.load(path), date=os.path.getmtime(path))
+            print("%d %s" % (number, path))
+        archive.close()
+
+    elif args.command == "list":
+        start = time.perf_counter()
+        entries = archive.find(args.min_score, args.min_lines, args.since, args.until)
+        elapsed = time.perf_counter() - start
+        if not args.quiet:
+            for entry in entries[-args.limit:] if args.limit else entries:
+                print("%8d  %s  score %7d  lines %4d  %6.1f s  seed %d" % (
+                    entry.number, time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.date)),
+                    entry.score, entry.lines, entry.duration / 1000, entry.seed))
+        print("%d of %d records match, scanned in %.1f ms" % (len(entries), len(archive), elapsed * 1000))
+
+    elif args.command == "extract":
+        for number in args.numbers:
+            recording = archive.read(number)
+            path = os.path.join(args.out, "%d-%d.json" % (number, recording.seed))
+            recording.save(path)
+            print(path)
+
+    elif args.command == "verify":
+        entries = archive.find(numbers=args.numbers or None)
+        bad = 0
+        for entry in entries:
+            problem = archive.verify(entry)
+            if problem:
+                bad += 1
+                print("%d: %s" % (entry.number, problem))
+        print("%d records checked, %d bad" % (len(entries), bad))
+        if bad:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a Tetro replay archive")
+    parser.add_argument("archive")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    add = commands.add_parser("add", help="add JSON recordings")
+    add.add_argument("paths", nargs="+")
+    find = commands.add_parser("list", help="list records, filtered by score, lines or date")
+    find.add_argument("--min-score", type=int, default=0)
+    find.add_argument("--min-lines", type=int, default=0)
+    find.add_argument("--since", type=parse_date, help="YYYY-MM-DD")
+    find.add_argument("--until", type=parse_date, help="YYYY-MM-DD, exclusive")
+    find.add_argument("--limit", type=int, help="only show the last N matches")
+    find.add_argument("-q", "--quiet", action="store_true", help="only print the summary")
+    extract = commands.add_parser("extract", help="write records out as JSON for tetro.py --replay")
+    extract.add_argument("numbers", type=int, nargs="+")
+    extract.add_argument("-o", "--out", default=".", help="directory to write to")
+    verify = commands.add_parser("verify", help="check CRCs and replay records against their scores")
+    verify.add_argument("numbers", type=int, nargs="*", help="records to check, all by default")
+    args = parser.parse_args()
+
+    try:
+        run_command(ReplayArchive(args.archive), args)
+    except (IndexError, ValueError) as e:
+        sys.exit("error: %s" % e)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from random import Random
+
+
+
+MAX_LEVELS = 24
+
+
+
+
+
+class Node(object):
+    __slots__ = ("key", "value", "next", "width")
+
+    def __init__(self, key, value, levels):
+        self.key = key
+        self.value = value
+        self.next = [None] * levels
+        self.width = [0] * levels
+
+
+
+
+
+class ScoreIndex(object):
+    """
+    Order-statistics index of scores: an indexable skip list ordered by
+    highest score first, then by submission order. Each link stores how many
+    entries it skips, so inserts and rank lookups are O(log n) and reading
+    the top n is O(n). Values are (name, score) pairs.
+    """
+
+    def __init__(self, seed=None):
+        self.random = Random(seed)
+        self.nil = Node((float("inf"),), None, 0)
+        self.head = Node(None, None, MAX_LEVELS)
+        self.head.next = [self.nil] * MAX_LEVELS
+        self.head.width = [1] * MAX_LEVELS
+        self.size = 0
+        self.levels = 1
+        self.seq = 0
+        self.best = {}
+
+    def __len__(self):
+        return self.size
+
+    def random_levels(self):
+        levels = 1
+        while levels < MAX_LEVELS and self.random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, name, score):
+        """Adds a score and returns its rank, starting at 1."""
+        self.seq += 1
+        key = (-score, self.seq)
+        levels = self.random_levels()
+        if levels > self.levels:
+            # Levels above self.levels aren't maintained; their head link
+            # skips every entry so far.
+            for level in range(self.levels, levels):
+                self.head.width[level] = self.size + 1
+            self.levels = levels
+        chain = [None] * self.levels
+        steps_at_level = [0] * self.levels
+        node = self.head
+        for level in range(self.levels-1, -1, -1):
+            while node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_node = Node(key, (name, score), levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+        best = self.best.get(name)
+        if best is None or score > best[0]:
+            self.best[name] = (score, key)
+        return sum(steps_at_level) + 1
+
+    def count_before(self, key):
+        count = 0
+        node = self.head
+        for level in range(self.levels-1, -1, -1):
+            while node.next[level].key < key:
+                count += node.width[level]
+                node = node.next[level]
+        return count
+
+    def rank_of_score(self, score):
+        """The rank a new score would get: one more than the number of higher scores."""
+        return self.count_before((-score, 0)) + 1
+
+    def player_best(self, name):
+        """Returns (best score, rank of that score) for name, or None."""
+        best = self.best.get(name)
+        if best is None:
+            return None
+        score, key = best
+        return score, self.count_before(key) + 1
+
+    def top(self, n):
+        scores = []
+        node = self.head.next[0]
+        while node is not self.nil and len(scores) < n:
+            scores.append(node.value)
+            node = node.next[0]
+        return scores
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        node = self.head
+        i += 1
+        for level in range(self.levels-1, -1, -1):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.value
@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+
+
+
+class ScoreQueue(object):
+    """
+    Append-only journal of high scores waiting to be sent to the API.
+
+    Every line of the file is a JSON record, either
+        {"op": "add", "id": ..., "name": ..., "score": ..., "time": ...}
+    or
+        {"op": "ack", "ids": [...]}
+    The id of each score doubles as its idempotency key, so a batch that is
+    sent twice after a lost response isn't recorded twice. With path=None
+    the queue only lives in memory.
+
+    A failed write (a full disk, a read-only directory) doesn't lose the
+    score or raise: the queue carries on in memory and the whole journal
+    is rewritten by the next write, or by sync().
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.unsaved = False
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.load()
+            except OSError as e:
+                # Without the journal's contents, writing it could only
+                # clobber them.
+                print("Score journal unavailable, keeping scores in memory: %s" % e, file=sys.stderr)
+                self.path = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        torn = False
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-write; nothing after it
+                    # can have been written either.
+                    torn = True
+                    break
+                if record["op"] == "add":
+                    self.pending[record["id"]] = record
+                elif record["op"] == "ack":
+                    for id in record["ids"]:
+                        self.pending.pop(id, None)
+                if not line.endswith("\n"):
+                    torn = True
+        if torn:
+            # Appending after the torn bytes would run the next record into
+            # them, and that record would be lost on the next load too.
+            self.save()
+
+    def save(self, record=None):
+        # Appends record to the journal, or rewrites the whole journal when
+        # record is None or an earlier write failed; pending must already
+        # include the record's change. Returns whether the journal is
+        # up to date.
+        if not self.path:
+            return True
+        try:
+            if record is None or self.unsaved:
+                self.compact()
+            else:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError:
+            self.unsaved = True
+            return False
+        self.unsaved = False
+        return True
+
+    def sync(self):
+        """Retries writing the journal after a failed write."""
+        with self.lock:
+            return self.save() if self.unsaved else True
+
+    def add(self, name, score):
+        record = {"op": "add", "id": uuid.uuid4().hex, "name": name, "score": score, "time": int(time.time())}
+        with self.lock:
+            self.pending[record["id"]] = record
+            self.save(record)
+        return record
+
+    def batch(self, size):
+        with self.lock:
+            return list(self.pending.values())[:size]
+
+    def ack(self, ids):
+        with self.lock:
+            for id in ids:
+                self.pending.pop(id, None)
+            if self.pending:
+                self.save({"op": "ack", "ids": list(ids)})
+            else:
+                self.save()
+
+    def compact(self):
+        # Rewrites the journal with only the scores still waiting.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record in self.pending.values():
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from leaderboard_server import LeaderboardServer, HttpError
+
+
+
+def test_malformed_batch_adds_nothing(tmp_path):
+    server = LeaderboardServer(str(tmp_path / "scores.jsonl"))
+    for scores in ([1], 5, [{"id": "a", "name": "a", "score": 1}, {"id": [1], "name": "b", "score": 2}],
+                   [{"id": True, "name": "a", "score": 1}], [{"name": 5, "score": 1}]):
+        with pytest.raises(HttpError) as error:
+            server.post_batch(json.dumps({"scores": scores}).encode())
+        assert error.value.status == 400
+    assert server.index.top(10) == []
+    assert server.post_batch(b'{"scores": [{"id": 7, "name": "a", "score": 1}]}')[1]["accepted"] == 1
+    server.close()
+
+
+def test_load_skips_bad_records(tmp_path):
+    path = tmp_path / "scores.jsonl"
+    path.write_text('{"id": null, "name": "a", "score": 5}\n'
+                    '{"id": null, "name": "b"}\n'
+                    '[1, 2]\n'
+                    'not json\n'
+                    '{"id": {}, "name": "c", "score": 6}\n'
+                    '{"id": "x", "name": "d", "score": 7}\n'
+                    '{"id": null, "name": "e", "sc')
+    server = LeaderboardServer(str(path))
+    server.add_score("f", 8)
+    server.close()
+    assert LeaderboardServer(str(path)).index.top(10) == [("f", 8), ("d", 7), ("a", 5)]
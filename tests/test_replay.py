@@ -0,0 +1,33 @@
+import pytest
+
+from engine import TetrisEngine, GENERATORS, VERSION as ENGINE_VERSION
+from replay import Recording, ReplayPlayer
+
+
+
+def record_game(seed=3):
+    engine = TetrisEngine(generator=GENERATORS["bag"]())
+    engine.reset(seed)
+    recording = Recording.start(engine)
+    for tick in range(300):
+        if tick % 7 == 0:
+            engine.input(("piece_left", "rotate_clock", "piece_right")[tick % 3])
+        engine.update(recording.tick_ms)
+    recording.finish(engine)
+    return recording, engine
+
+
+def test_replays_same_engine_version():
+    recording, engine = record_game()
+    replayed = ReplayPlayer(Recording.from_dict(recording.to_dict())).run()
+    assert (replayed.score, replayed.lines_cleared, replayed.grid) == (engine.score, engine.lines_cleared, engine.grid)
+
+
+def test_refuses_other_engine_version():
+    recording, _ = record_game()
+    data = recording.to_dict()
+    data["engine_version"] = ENGINE_VERSION - 1
+    old = Recording.from_dict(data)
+    with pytest.raises(ValueError, match="engine version %d" % (ENGINE_VERSION - 1)):
+        ReplayPlayer(old)
+    assert ReplayPlayer(old, force=True).run().elapsed > 0
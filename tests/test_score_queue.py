@@ -0,0 +1,51 @@
+from score_queue import ScoreQueue
+
+
+
+def names(path):
+    return [record["name"] for record in ScoreQueue(path).pending.values()]
+
+
+def test_append_after_torn_line(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    queue = ScoreQueue(path)
+    queue.add("a", 1)
+    with open(path, "a") as f:
+        f.write('{"op": "add", "id": "x", "na')
+
+    queue = ScoreQueue(path)
+    queue.add("c", 3)
+    queue.add("d", 4)
+    assert names(path) == ["a", "c", "d"]
+
+
+def test_append_after_missing_newline(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    queue = ScoreQueue(path)
+    queue.add("a", 1)
+    with open(path, "a") as f:
+        f.write('{"op": "add", "id": "b", "name": "b", "score": 2, "time": 0}')
+
+    queue = ScoreQueue(path)
+    queue.add("c", 3)
+    assert names(path) == ["a", "b", "c"]
+
+
+def test_unwritable_journal(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    queue = ScoreQueue(str(path))
+    queue.add("a", 1)
+    # A directory in the journal's place makes every write fail, the way a
+    # full disk or read-only directory would (even when running as root).
+    path.unlink()
+    path.mkdir()
+    queue.add("b", 2)
+    assert queue.unsaved
+    assert [record["name"] for record in queue.batch(10)] == ["a", "b"]
+    assert not queue.sync()
+
+    path.rmdir()
+    assert queue.sync()
+    assert names(str(path)) == ["a", "b"]
+    queue.ack([record["id"] for record in queue.batch(1)])
+    assert names(str(path)) == ["b"]
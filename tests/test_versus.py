@@ -0,0 +1,128 @@
+from random import Random
+
+import pytest
+
+from engine import TetrisEngine, TICK_MS, GENERATORS
+from versus import VersusSession, SNAPSHOT_MS, frame, FRAME_HEADER
+
+
+
+KEYS = ("piece_left", "piece_right", "rotate_clock", "rotate_count")
+
+
+class LinkedClient(object):
+    # Stands in for VersusClient: frames sent on one end come out of the
+    # other end's poll().
+    def __init__(self):
+        self.other = None
+        self.received = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, type, payload=b""):
+        self.bytes_sent += len(frame(type, payload))
+        self.other.received.append((type, payload))
+        self.other.bytes_received += FRAME_HEADER.size + len(payload)
+
+    def poll(self):
+        received, self.received = self.received, []
+        return received
+
+
+def linked_sessions(input_delay_ms, seed=7):
+    a, b = LinkedClient(), LinkedClient()
+    a.other, b.other = b, a
+    local, remote = VersusSession(a, input_delay_ms=input_delay_ms), VersusSession(b)
+    for player, session in enumerate((local, remote)):
+        session.start(seed, "bag", player)
+    engine = TetrisEngine(generator=GENERATORS["bag"]())
+    engine.reset(seed)
+    local.begin(engine)
+    return local, remote, engine
+
+
+class Match(object):
+    """
+    Runs the local engine the way TetrisGame does, with inputs[tick] made
+    before each tick and garbage[tick] lines handed to the session, and
+    checks the remote side's simulation of it against the ticks both got to.
+    """
+
+    def __init__(self, input_delay_ms, inputs, garbage=None):
+        self.local, self.remote, self.engine = linked_sessions(input_delay_ms)
+        self.inputs = inputs
+        self.garbage = garbage or {}
+        self.states = {}
+        self.simulated = {}
+        self.snapshots_checked = 0
+        game = self.remote.remote
+        check = game.check
+
+        def counted_check(simulated, sent):
+            self.snapshots_checked += 1
+            check(simulated, sent)
+        game.check = counted_check
+
+    def state(self, engine):
+        return engine.score, engine.lines_cleared, list(engine.grid), list(engine.colors[1])
+
+    def play(self, ticks):
+        local, engine = self.local, self.engine
+        for tick in range(ticks):
+            if engine.game_done:
+                break
+            if tick in self.garbage:
+                local.garbage_sent(self.garbage[tick])
+            for name in self.inputs.get(tick, ()):
+                local.input(engine, name)
+            local.act(engine)
+            engine.update(TICK_MS)
+            local.updated(engine)
+            self.states[engine.elapsed] = self.state(engine)
+            self.remote.poll()
+            simulated = self.remote.remote.engine
+            self.simulated[simulated.elapsed] = self.state(simulated)
+        assert self.remote.remote.desyncs == 0
+        # The remote side may be ahead by up to the input delay.
+        compared = [elapsed for elapsed in self.simulated if elapsed in self.states]
+        for elapsed in compared:
+            assert self.simulated[elapsed] == self.states[elapsed]
+        return len(compared)
+
+
+def random_inputs(ticks, seed):
+    random = Random(seed)
+    inputs = {}
+    for tick in range(ticks):
+        if random.random() < 0.3:
+            inputs[tick] = [random.choice(KEYS)]
+        elif random.random() < 0.01:
+            inputs[tick] = ["hard_drop"]
+    # Key presses right on the snapshot ticks.
+    for tick in range(0, ticks, SNAPSHOT_MS // TICK_MS):
+        inputs[tick] = ["rotate_clock", "piece_left"]
+    return inputs
+
+
+@pytest.mark.parametrize("input_delay_ms", [0, 30, 100])
+def test_key_inputs_across_flushes(input_delay_ms):
+    ticks = 3000
+    match = Match(input_delay_ms, random_inputs(ticks, input_delay_ms))
+    assert match.play(ticks) > 100
+    assert match.engine.elapsed > 3 * SNAPSHOT_MS
+    assert match.snapshots_checked >= 3
+
+
+@pytest.mark.parametrize("input_delay_ms", [0, 100])
+def test_garbage_before_input(input_delay_ms):
+    ticks = 1500
+    inputs = random_inputs(ticks, 1)
+    garbage = {}
+    for tick in range(20, ticks, 70):
+        # Garbage queued at a tick, then keys on that tick and the next.
+        garbage[tick] = 2
+        inputs[tick] = ["piece_right"]
+        inputs[tick + 1] = ["rotate_count"]
+    match = Match(input_delay_ms, inputs, garbage)
+    assert match.play(ticks) > 50
+    assert any(match.engine.colors[1][1:match.engine.cols+1])
@@ -1,16 +1,39 @@
+import argparse
+import os
+import sys
+import time
 import pygame
-import requests
-from random import randint
-from copy import deepcopy
 from widgetstuff import *
 from pygame_textinput import TextInput
+from engine import TetrisEngine, TICK_MS, GENERATORS, GRAVITIES, VERSION as ENGINE_VERSION
+from leaderboard import LeaderboardClient
+from score_queue import ScoreQueue
+from music_player import MusicPlayer
+from replay import Recording, ReplayPlayer, version_problem
+from replay_archive import ReplayArchive
+from bot import Bot
+from frame_profiler import FrameProfiler
+from versus import VersusClient, VersusSession
+
+
+
+START_TIME = time.perf_counter()
+
+# Event types dropped before they reach the queue unless an active surface
+# subscribes to them; mouse motion only gets through while a menu with hover
+# buttons is up. Window and text input events are left alone since pygame
+# relies on them itself.
+FILTERED_EVENTS = [getattr(pygame, name) for name in (
+    "MOUSEMOTION", "MOUSEBUTTONUP", "MOUSEWHEEL", "JOYAXISMOTION", "JOYBALLMOTION", "JOYHATMOTION",
+    "JOYBUTTONDOWN", "JOYBUTTONUP", "CONTROLLERAXISMOTION", "CONTROLLERBUTTONDOWN", "CONTROLLERBUTTONUP",
+    "FINGERMOTION", "FINGERDOWN", "FINGERUP", "MULTIGESTURE") if hasattr(pygame, name)]
 
 
 
 
 class MainMenu(WidgetSurface):
     def __init__(self, parent, pos, image):
-        WidgetSurface.__init__(self, pygame.image.load(image), pos, parent, True)
+        WidgetSurface.__init__(self, assets.image(image), pos, parent, True)
         self.start_button = Button(self, (100, 118), "images/start_button.png", hover_image="images/start_button_hover.png")
         self.scores_button = Button(self, (55, 189), "images/scores_button.png", hover_image="images/scores_button_hover.png")
         self.options_button = Button(self, (145, 189), "images/options_button.png", hover_image="images/options_button_hover.png")
@@ -33,7 +56,7 @@ class MainMenu(WidgetSurface):
 
 class ScoresMenu(WidgetSurface):
     def __init__(self, parent, pos, image):
-        WidgetSurface.__init__(self, pygame.image.load(image), pos, parent, True)
+        WidgetSurface.__init__(self, assets.image(image), pos, parent, True)
         self.back_button = Button(self, (100, 270), "images/back_button.png", hover_image="images/back_button_hover.png")
         self.score_text = Label(self, (100, 160), "", True)
         self.score_text.set_font("menlottc", 11)
@@ -44,7 +67,13 @@ class ScoresMenu(WidgetSurface):
     def connect_back_button(self, func):
         self.back_button.connect(func)
 
+    def set_loading(self):
+        self.score_text.set_text("Loading...")
+
     def set_scores_text(self, high_scores):
+        if high_scores is None:
+            self.score_text.set_text("Scores unavailable")
+            return
         high_scores_text = ""
         if high_scores:
             for i, high_score in enumerate(high_scores):
@@ -61,7 +90,7 @@ class ScoresMenu(WidgetSurface):
 
 class OptionsMenu(WidgetSurface):
     def __init__(self, parent, pos, image):
-        WidgetSurface.__init__(self, pygame.image.load(image), pos, parent, True)
+        WidgetSurface.__init__(self, assets.image(image), pos, parent, True)
         self.music_volume = NumberInput(self, (53, 109), "images/arrow_left.png","images/arrow_right.png", 0, 10, 10, 1)
         self.soundfx_volume = NumberInput(self, (53, 171), "images/arrow_left.png","images/arrow_right.png", 0, 10, 10, 1)
         self.submit_button = Button(self, (100, 230), "images/submit_button.png", hover_image="images/submit_button_hover.png")
@@ -89,7 +118,7 @@ class OptionsMenu(WidgetSurface):
 
 class PauseMenu(WidgetSurface):
     def __init__(self, parent, pos, image):
-        WidgetSurface.__init__(self, pygame.image.load(image), pos, parent, True)
+        WidgetSurface.__init__(self, assets.image(image), pos, parent, True)
         self.resume_button = Button(self, (100, 230), "images/resume_button.png", hover_image="images/resume_button_hover.png")
         self.end_game_button = Button(self, (100, 270), "images/end_game_button.png", hover_image="images/end_game_button_hover.png")
         self.p_key = Key(112)
@@ -111,9 +140,9 @@ class PauseMenu(WidgetSurface):
 
 
 class GameoverMenu(WidgetSurface):
-    def __init__(self, parent, pos, image):
-        WidgetSurface.__init__(self, pygame.image.load(image), pos, parent, True)
-        self.score_label = Label(self, (130, 93), "100", True)
+    def __init__(self, parent, pos, image, clock=None):
+        WidgetSurface.__init__(self, assets.image(image), pos, parent, True)
+        self.score_label = Label(self, (130, 93), "100", True, glyphs=True)
         self.submit_button = Button(self, (100, 230), "images/submit_button.png", hover_image="images/submit_button_hover.png")
         self.main_menu_button = Button(self, (100, 270), "images/main_menu_button.png", hover_image="images/main_menu_button_hover.png")
         self.name_input = TextInput(
@@ -123,7 +152,8 @@ class GameoverMenu(WidgetSurface):
             max_string_length = 15,
             cursor_color = (200, 10, 10),
             pos = (40, 178),
-            parent_pos = self.pos
+            parent_pos = self.pos,
+            clock = clock
         )
         self.add_widget(self.score_label)
         self.add_widget(self.submit_button)
@@ -153,10 +183,10 @@ class GameoverMenu(WidgetSurface):
 
 class Background(WidgetSurface):
     def __init__(self, parent, pos, image):
-        WidgetSurface.__init__(self, pygame.image.load(image), pos, parent, False)
-        self.level_label = Label(self, (475, 405), "1", True)
-        self.score_label = Label(self, (475, 518), "0", True)
-        self.lines_label = Label(self, (475, 628), "0", True)
+        WidgetSurface.__init__(self, assets.image(image), pos, parent, False)
+        self.level_label = Label(self, (475, 405), "1", True, glyphs=True)
+        self.score_label = Label(self, (475, 518), "0", True, glyphs=True)
+        self.lines_label = Label(self, (475, 628), "0", True, glyphs=True)
         self.level_label.set_color((50, 50, 50))
         self.score_label.set_color((50, 50, 50))
         self.lines_label.set_color((50, 50, 50))
@@ -182,96 +212,324 @@ class Background(WidgetSurface):
 
     def draw(self, surface):
         super().draw(surface)
-        self.draw_next_piece()
+        self.draw_next_piece(surface)
+
+
+
+
+
+
+class OpponentView(SurfaceObject):
+    """
+    The opponent's board in miniature, drawn over the logo during versus
+    games, with their score and how the match went once it's over.
+    """
+
+    def __init__(self, parent, pos, cell_imgs, cell=4):
+        SurfaceObject.__init__(self, pygame.Surface((170, 96)), pos, parent)
+        self.cell = cell
+        self.cell_imgs = [img and pygame.transform.smoothscale(img, (cell, cell)) for img in cell_imgs]
+        self.bg = pygame.Color(128, 43, 37)
+        self.grid_bg = pygame.Color(25, 25, 25)
+        self.font = get_font("menlottc", 11)
+        self.remote = None
+        self.result = None
+        self.drawn = None
+
+    def set_game(self, remote):
+        self.remote = remote
+        self.result = None
+        self.drawn = None
+        self.mark_dirty()
+
+    def set_result(self, result):
+        self.result = result
+
+    def update(self):
+        if self.remote is None:
+            return
+        engine = self.remote.view
+        piece = engine.piece
+        key = (tuple(engine.grid), piece and (piece.id, piece.rotation, piece.i, piece.j), engine.score,
+               self.result, engine.clear_step)
+        if key != self.drawn:
+            self.drawn = key
+            self.render(engine)
+            self.mark_dirty()
+
+    def render(self, engine):
+        cell = self.cell
+        surface = self.surface
+        surface.fill(self.bg)
+        board = pygame.Rect(10, 6, engine.cols * cell + 4, engine.rows * cell + 4)
+        surface.fill((179, 179, 179), board)
+        surface.fill(self.grid_bg, board.inflate(-4, -4))
+        left, bottom = board.left + 2 - cell, board.bottom - 2
+        for gi in range(1, engine.rows+1):
+            colors = engine.colors[gi]
+            for gj in range(1, engine.cols+1):
+                if colors[gj]:
+                    surface.blit(self.cell_imgs[colors[gj]], (left + gj * cell, bottom - gi * cell))
+        piece = engine.piece
+        if piece is not None and not engine.clearing_lines:
+            for sq in piece.shape:
+                if piece.i + sq[1] <= engine.rows:
+                    surface.blit(self.cell_imgs[piece.id + 1],
+                                 (left + (piece.j + sq[0]) * cell, bottom - (piece.i + sq[1]) * cell))
+        lines = ["OPPONENT", str(engine.score)]
+        if self.result:
+            lines.append({"win": "YOU WIN", "lose": "YOU LOSE", "left": "THEY LEFT"}[self.result])
+        y = 14
+        for line in lines:
+            surface.blit(self.font.render(line, True, (255, 255, 255)), (board.right + 14, y))
+            y += 22
+
+    def draw(self, surface):
+        if self.remote is not None:
+            surface.blit(self.surface, self.pos)
 
 
 
 
 
+class StartupTimer(object):
+    """
+    Records how long each part of startup takes and the time to the first
+    frame, measured from when this module finished importing. Set
+    TETRO_STARTUP_REPORT=1 to print the report once warm-up finishes.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.components = []
+        self.first_frame = None
+        self.warm = None
+
+    def time(self, name, func, *args, **kwargs):
+        t = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.components.append((name, time.perf_counter() - t))
+        return result
+
+    def frame_shown(self):
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - self.start
+
+    def warmed_up(self):
+        self.warm = time.perf_counter() - self.start
+
+    def report(self):
+        lines = ["startup: first frame %.1f ms" % (self.first_frame * 1000)]
+        if self.warm is not None:
+            lines[0] += ", warm %.1f ms" % (self.warm * 1000)
+        for name, seconds in self.components:
+            lines.append("  %-16s %8.1f ms" % (name, seconds * 1000))
+        lines.append("  assets: " + assets.summary())
+        return "\n".join(lines)
+
+
+
+
 
 class TetrisController(object):
-    def __init__(self):
+    def __init__(self, startup=None, fps=60, vsync=False, generator="uniform", record=True, bot=None, profiler=None, archive=None,
+                 versus=None, gravity="normal", leaderboard=None):
+        self.startup = startup or StartupTimer(START_TIME)
+        time_part = self.startup.time
+
         self.WIDTH, self.HEIGHT = 600, 700
         pygame.display.set_icon(pygame.image.load("images/tetro_icon.png"))
-        self.window = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
+        self.window = time_part("set_mode", self.open_window, vsync)
         pygame.display.set_caption('Tetro')
 
-        self.tetro_song = pygame.mixer.Sound("music/tetro_song.wav")
-        self.tetris_sound = pygame.mixer.Sound("music/tetris_sound.wav")
-        self.clear_sound = pygame.mixer.Sound("music/clear_sound.wav")
-        self.music = pygame.mixer.Channel(1)
+        # The song is streamed from disk; sound effects are decoded on first
+        # use, or during warm-up.
+        self.music = MusicPlayer("music/tetro_song.ogg")
+        self.tetris_sound = "music/tetris_sound.wav"
+        self.clear_sound = "music/clear_sound.wav"
         self.soundfx = pygame.mixer.Channel(2)
 
+        # Benchmarks pass their own leaderboard, so they don't talk to the
+        # real API or touch ~/.tetro.
         self.tetro_api_url = "http://api.ryanstella.me/tetro/high-scores"
-
+        if leaderboard is None:
+            score_queue = time_part("score_queue", ScoreQueue, os.path.join(os.path.expanduser("~"), ".tetro", "score_queue.jsonl"))
+            leaderboard = time_part("leaderboard", LeaderboardClient, self.tetro_api_url, queue=score_queue)
+        self.leaderboard = leaderboard
+        self.score_queue = leaderboard.queue
+
+        # The game runs in fixed TICK_MS steps whatever the frame rate; fps
+        # only caps how often the screen is drawn, 0 meaning uncapped.
         self.clock = pygame.time.Clock()
-        self.fps = 30
+        self.fps = fps
 
-        self.level = 1
-        self.score = 0
-        self.lines_cleared = 0
-        self.line_count_points = [10, 30, 60, 100]
         self.stats_color = pygame.Color(70, 70, 70)
 
         self.tetris_pos = (50, 50)
+        self.next_piece_rect = pygame.Rect(415, 241, 120, 60)
         self.scale = 30
         self.game_done = False
         self.paused = False
 
         self.menu_pos = (200, 350)
 
-        self.background = Background(None, (0, 0), "images/background.png")
+        self.background = time_part("background", Background, None, (0, 0), "images/background.png")
         self.background.connect_draw_next_piece(self.draw_next_piece)
 
-        self.tetris = TetrisGame(self, 300, 600, self.tetris_pos, self.background)
-
-        self.main_menu = MainMenu(self.background, self.menu_pos, "images/menu_main.png")
-        self.main_menu.connect_start_button(self.start_game)
-        self.main_menu.connect_scores_button(self.show_scores_menu)
-        self.main_menu.connect_options_button(self.show_options_menu)
-
-        self.scores_menu = ScoresMenu(self.background, self.menu_pos, "images/menu_scores.png")
-        self.scores_menu.connect_back_button(self.show_main_menu)
-
-        self.gameover_menu = GameoverMenu(self.background, self.menu_pos, "images/menu_gameover.png")
-        self.gameover_menu.connect_submit_button(self.submit_high_score)
-        self.gameover_menu.connect_main_menu_button(self.show_main_menu)
-
-        self.pause_menu = PauseMenu(self.background, self.menu_pos, "images/menu_pause.png")
-        self.pause_menu.connect_resume_button(self.toggle_pause)
-        self.pause_menu.connect_end_game_button(self.game_over)
-        self.pause_menu.connect_p_key(self.toggle_pause)
-
-        self.options_menu = OptionsMenu(self.background, self.menu_pos, "images/menu_options.png")
-        self.options_menu.connect_submit_button(self.set_options)
-        self.options_menu.connect_back_button(self.show_main_menu)
-
+        self.tetris = time_part("tetris", TetrisGame, self, 300, 600, self.tetris_pos, self.background)
+        self.engine = self.tetris.engine
+        self.engine.generator = GENERATORS[generator]()
+        self.gravity = gravity
+
+        # With a bot, games play themselves and restart when they end.
+        self.bot = bot
+
+        # With a VersusSession, Start looks for an opponent instead and the
+        # game starts when one is found. Versus games aren't recorded.
+        self.versus = versus
+        self.opponent_view = OpponentView(self.background, (390, 48), self.tetris.cell_imgs)
+        self.background.add_widget(self.opponent_view)
+        if versus:
+            versus.connect_start(self.start_versus_game)
+            versus.connect_finished(self.opponent_finished)
+
+        # Every game is saved here so it can be replayed with --replay, or
+        # appended to a ReplayArchive instead when one is given.
+        self.replay_dir = os.path.join(os.path.expanduser("~"), ".tetro", "replays") if record else None
+        self.archive = archive if record else None
+        self.recording = None
+
+        # Menus are built the first time they're activated. Whatever hasn't
+        # been built once the main menu is showing is warmed up one piece per
+        # frame, so opening a menu later doesn't stall a frame.
         self.surfs = WidgetSurfaceHolder()
         self.surfs.add_widget_surface("background", self.background)
         self.surfs.add_widget_surface("tetris", self.tetris)
-        self.surfs.add_widget_surface("main_menu", self.main_menu)
-        self.surfs.add_widget_surface("scores_menu", self.scores_menu)
-        self.surfs.add_widget_surface("options_menu", self.options_menu)
-        self.surfs.add_widget_surface("gameover_menu", self.gameover_menu)
-        self.surfs.add_widget_surface("pause_menu", self.pause_menu)
+        self.add_menu("main_menu", self.build_main_menu)
+        self.add_menu("scores_menu", self.build_scores_menu)
+        self.add_menu("options_menu", self.build_options_menu)
+        self.add_menu("gameover_menu", self.build_gameover_menu)
+        self.add_menu("pause_menu", self.build_pause_menu)
         self.surfs.activate("background", "main_menu")
-
-    def start_game(self):
-        self.level = 1
-        self.score = 0
-        self.lines_cleared = 0
+        self.surfs.filter_events(FILTERED_EVENTS)
+        self.warm_up_jobs = None
+
+        # With --profile every frame is timed phase by phase; F3 shows the
+        # timings on screen.
+        self.profiler = profiler
+        self.surfs.profiler = profiler
+
+    def open_window(self, vsync):
+        if vsync:
+            # Needs pygame 2; vsync is only offered for renderer backed windows.
+            try:
+                return pygame.display.set_mode((self.WIDTH, self.HEIGHT), pygame.SCALED, vsync=1)
+            except (TypeError, AttributeError, pygame.error):
+                pass
+        return pygame.display.set_mode((self.WIDTH, self.HEIGHT))
+
+    def add_menu(self, name, build):
+        self.surfs.add_lazy_widget_surface(name, lambda: self.startup.time(name, build))
+
+    def build_main_menu(self):
+        menu = MainMenu(self.background, self.menu_pos, "images/menu_main.png")
+        menu.connect_start_button(self.join_versus if self.versus else self.start_game)
+        menu.connect_scores_button(self.show_scores_menu)
+        menu.connect_options_button(self.show_options_menu)
+        return menu
+
+    def build_scores_menu(self):
+        menu = ScoresMenu(self.background, self.menu_pos, "images/menu_scores.png")
+        menu.connect_back_button(self.show_main_menu)
+        return menu
+
+    def build_gameover_menu(self):
+        menu = GameoverMenu(self.background, self.menu_pos, "images/menu_gameover.png", self.clock)
+        menu.connect_submit_button(self.submit_high_score)
+        menu.connect_main_menu_button(self.show_main_menu)
+        return menu
+
+    def build_pause_menu(self):
+        menu = PauseMenu(self.background, self.menu_pos, "images/menu_pause.png")
+        menu.connect_resume_button(self.toggle_pause)
+        menu.connect_end_game_button(self.game_over)
+        menu.connect_p_key(self.toggle_pause)
+        return menu
+
+    def build_options_menu(self):
+        menu = OptionsMenu(self.background, self.menu_pos, "images/menu_options.png")
+        menu.connect_submit_button(self.set_options)
+        menu.connect_back_button(self.show_main_menu)
+        return menu
+
+    def load_sound(self, path):
+        return self.startup.time(os.path.basename(path), assets.sound, path)
+
+    def warm_up(self):
+        # Called once per frame until everything is loaded.
+        if self.warm_up_jobs is None:
+            self.warm_up_jobs = [(self.surfs.get, name) for name in self.surfs.pending()]
+            self.warm_up_jobs += [(self.load_sound, path) for path in (self.tetris_sound, self.clear_sound)
+                                  if path not in assets.sounds]
+        if self.warm_up_jobs:
+            func, arg = self.warm_up_jobs.pop(0)
+            func(arg)
+            if not self.warm_up_jobs:
+                self.startup.warmed_up()
+                if os.environ.get("TETRO_STARTUP_REPORT"):
+                    print(self.startup.report(), file=sys.stderr)
+
+    def start_game(self, replay=None, seed=None, force_replay=False):
         self.game_done = False
+        if replay:
+            player = ReplayPlayer(replay, force_replay)
+            self.engine.generator = GENERATORS[replay.generator]()
+            self.engine.gravity = GRAVITIES[replay.gravity]
+            self.tetris.reset(replay.seed)
+            self.tetris.replay = player
+        else:
+            # Versus games, started with the match's seed, always play normal
+            # gravity.
+            self.engine.gravity = GRAVITIES["normal" if seed is not None else self.gravity]
+            self.tetris.reset(seed)
+            self.tetris.replay = None
+        self.tetris.bot = self.bot if not replay else None
+        if self.bot:
+            self.bot.reset()
+        self.tetris.versus = None
+        self.opponent_view.set_game(None)
+        if (self.replay_dir or self.archive is not None) and not replay and seed is None:
+            self.recording = Recording.start(self.engine)
+        else:
+            self.recording = None
+            self.engine.connect_input(None)
         self.set_stats()
-        self.tetris.reset()
         self.surfs.activate("background", "tetris")
-        self.music.play(self.tetro_song, loops=-1)
+        self.music.play(loops=-1)
+
+    def join_versus(self):
+        pygame.display.set_caption("Tetro - waiting for an opponent")
+        self.versus.join()
+
+    def start_versus_game(self, seed, generator):
+        pygame.display.set_caption("Tetro")
+        self.engine.generator = GENERATORS[generator]()
+        self.start_game(seed=seed)
+        self.tetris.versus = self.versus
+        self.versus.begin(self.engine)
+        self.opponent_view.set_game(self.versus.remote)
+
+    def opponent_finished(self):
+        self.opponent_view.set_result(self.versus.result)
+        if not self.game_done:
+            self.game_over()
 
     def show_options_menu(self):
         self.surfs.activate("background", "options_menu")
 
     def show_scores_menu(self):
-        high_scores = self.get_high_scores()
-        self.scores_menu.set_scores_text(high_scores)
+        self.surfs.get("scores_menu").set_loading()
+        self.get_high_scores()
         self.surfs.activate("background", "scores_menu")
 
     def show_main_menu(self):
@@ -290,103 +548,188 @@ class TetrisController(object):
     def game_over(self):
         self.paused = False
         self.game_done = True
-        self.gameover_menu.set_final_score(self.score)
+        if self.recording:
+            self.save_recording()
+        if self.tetris.versus:
+            self.tetris.versus.end(self.engine)
+            self.tetris.versus = None
+            self.opponent_view.set_result(self.versus.result)
+            if self.bot:
+                # The board stays up until the next match starts.
+                self.surfs.activate_update("background")
+                self.surfs.activate_draw("background", "tetris")
+                self.join_versus()
+                return
+        if self.tetris.replay:
+            self.tetris.replay = None
+            self.music.fadeout(1000)
+            self.show_main_menu()
+            return
+        if self.tetris.bot:
+            self.start_game()
+            return
+        self.surfs.get("gameover_menu").set_final_score(self.engine.score)
         self.surfs.activate_update("background", "gameover_menu")
         self.surfs.activate_draw("background", "tetris", "gameover_menu")
         self.music.fadeout(1000)
 
+    def save_recording(self):
+        self.recording.finish(self.engine)
+        now = time.time()
+        name = "%s-%03d-%d.json" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), now * 1000 % 1000, self.recording.seed)
+        try:
+            if self.archive is not None:
+                self.archive.append(self.recording, now)
+            else:
+                self.recording.save(os.path.join(self.replay_dir, name))
+        except OSError:
+            pass
+        self.recording = None
+
     def get_high_scores(self):
-        params = {"qnt": 10, "sort": True}
-        response = requests.get(self.tetro_api_url, params=params)
-        high_scores = response.json()
-        return high_scores
+        self.leaderboard.get_high_scores(self.surfs.get("scores_menu").set_scores_text, qnt=10)
 
     def submit_high_score(self):
-        name = self.gameover_menu.get_name().strip()
+        gameover_menu = self.surfs.get("gameover_menu")
+        name = gameover_menu.get_name().strip()
         if name:
-            data = {"name": name, "score": self.score}
-            requests.post(self.tetro_api_url, data=data)
-            self.gameover_menu.clear_name()
+            self.leaderboard.submit_high_score(name, self.engine.score)
+            gameover_menu.clear_name()
             self.show_main_menu()
 
     def set_options(self):
-        music_vol = self.options_menu.get_music_vol()
-        soundfx_vol = self.options_menu.get_soundfx_vol()
+        options_menu = self.surfs.get("options_menu")
+        music_vol = options_menu.get_music_vol()
+        soundfx_vol = options_menu.get_soundfx_vol()
         self.music.set_volume(music_vol/10)
         self.soundfx.set_volume(soundfx_vol/10)
         self.show_main_menu()
 
     def play_sound(self, clear_count):
         if clear_count == 4:
-            self.soundfx.play(self.tetris_sound)
+            self.soundfx.play(assets.sound(self.tetris_sound))
         else:
-            self.soundfx.play(self.clear_sound)
+            self.soundfx.play(assets.sound(self.clear_sound))
 
     def update_score(self, clear_count):
-        if clear_count:
-            self.play_sound(clear_count)
-            self.lines_cleared += clear_count
-            self.score += self.line_count_points[clear_count-1]
-            self.level = self.lines_cleared // 10 + 1
-            self.tetris.time_segment = 15 - self.level
-            if self.tetris.time_segment == 0: self.tetris.time_segment = 1
-            self.set_stats()
+        self.play_sound(clear_count)
+        self.set_stats()
 
     def set_stats(self):
-        self.background.set_level(self.level)
-        self.background.set_score(self.score)
-        self.background.set_lines(self.lines_cleared)
+        self.background.set_level(self.engine.level)
+        self.background.set_score(self.engine.score)
+        self.background.set_lines(self.engine.lines_cleared)
 
-    def draw_next_piece(self):
-        next = self.tetris.next_piece
+    def draw_next_piece(self, surface):
+        next = self.engine.next_piece
         if next:
+            piece_img = self.tetris.piece_imgs[next.id]
             if next.id == 5: xoff, yoff = 445, 253
             elif next.id == 6: xoff, yoff = 445, 271
             else: xoff, yoff = 460, 271
             for sq in next.shape:
                 x = sq[0] * self.scale + xoff
                 y = -sq[1] * self.scale + yoff
-                self.window.blit(next.piece_img, (x, y))
+                surface.blit(piece_img, (x, y))
+
+    def frame(self):
+        # Runs one frame of the main loop; returns False once the window is closed.
+        profiler = self.profiler
+        if profiler:
+            profiler.start_frame()
+        self.clock.tick(self.fps)
+        if profiler:
+            profiler.lap("wait")
+        self.leaderboard.poll()
+        if profiler:
+            profiler.lap("leaderboard")
+        if self.versus:
+            self.versus.poll()
+            if profiler:
+                profiler.lap("versus")
+        self.surfs.update()
+        if profiler:
+            profiler.lap("update")
+        rects = self.surfs.draw(self.window)
+        if profiler:
+            profiler.lap("draw")
+            if profiler.overlay:
+                rect = profiler.overlay.draw(self.window)
+                # The game is redrawn under the overlay on the next frame.
+                self.surfs.mark_dirty(rect)
+                rects.append(rect)
+                profiler.lap("overlay")
+        if rects:
+            pygame.display.update(rects)
+            self.startup.frame_shown()
+        if profiler:
+            profiler.lap("display")
+        if self.warm_up_jobs != []:
+            self.warm_up()
+            if profiler:
+                profiler.lap("warm_up")
+        running = True
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            else:
+                if profiler:
+                    profiler.check_event(event)
+                self.surfs.check_event(event)
+        if profiler:
+            profiler.lap("events")
+            profiler.end_frame()
+        return running
 
     def run(self):
-        running = True
-        while running:
-            self.clock.tick(self.fps)
-            self.surfs.update()
-            self.surfs.draw(self.window)
-            pygame.display.update()
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                else:
-                    self.surfs.check_event(event)
+        while self.frame():
+            pass
+        self.leaderboard.close()
+        if self.versus:
+            self.versus.client.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def save_profile(self, base=None):
+        if base is None:
+            base = os.path.join(os.path.expanduser("~"), ".tetro", "profiles", time.strftime("%Y%m%d-%H%M%S"))
+        paths = self.profiler.save(base)
+        print(self.profiler.summary(), file=sys.stderr)
+        print("wrote " + " and ".join(paths), file=sys.stderr)
 
 
 
 
 
 class TetrisGame(SurfaceObject):
+    event_types = (pygame.KEYDOWN, pygame.KEYUP)
+
     def __init__(self, controller, gw, gh, pos, parent):
         SurfaceObject.__init__(self, pygame.Surface((gw, gh)), pos, parent)
         self.controller = controller
+        self.engine = TetrisEngine()
+        self.engine.connect_lines_cleared(controller.update_score)
+        self.engine.connect_game_over(controller.game_over)
+        self.engine.connect_cells_changed(self.cells_changed)
+        self.engine.connect_rows_removed(self.rows_removed)
+        self.engine.connect_grid_cleared(self.grid_cleared)
+        self.engine.connect_garbage_added(self.garbage_added)
         self.gw, self.gh = gw, gh
         self.scale = 30
-        self.rows = 20
-        self.cols = 10
+        self.rows = self.engine.rows
+        self.cols = self.engine.cols
         self.grid_bg = pygame.Color(50, 50, 50)
-        self.piece = None
-        self.next_piece = None
-        self.init_grid()
+        self.drawn_key = None
+        self.drawn_piece_rects = []
+        self.drawn_ghost_rects = []
+        self.drawn_next = None
+        self.lag = 0
+        self.max_lag = 250
+        self.replay = None
+        self.bot = None
+        self.versus = None
         self.init_pieces()
-        self.init_offsets()
-
-        self.time = 0
-        self.time_segment = 15
-        self.time_step = 1
-        self.down_down = False
-        self.cleared_lines = []
-        self.clear_step = 0
-        self.clearing_lines = False
+        self.surface.fill(self.grid_bg)
 
     def check_event(self, event):
         if event.type == pygame.KEYDOWN:
@@ -395,267 +738,169 @@ class TetrisGame(SurfaceObject):
             self.key_up(event.key)
 
     def key_down(self, key):
-        if key == 273 or key == 105:
-            self.rotate_clock()
+        # Moves go through engine.input so they're recorded; while a replay
+        # or the bot plays they come from there instead. There's no pausing
+        # a versus game.
+        if key == 112:
+            if not self.versus:
+                self.controller.toggle_pause()
+        elif self.replay or self.bot:
+            return
+        elif key == 273 or key == 105:
+            self.input("rotate_clock")
         elif key == 122:
-            self.rotate_count()
+            self.input("rotate_count")
         elif key == 274 or key == 107:
-            self.down_down = True
+            self.input("start_soft_drop")
         elif key == 275 or key == 108:
-            self.piece_right()
+            self.input("piece_right")
         elif key == 276 or key == 106:
-            self.piece_left()
-        elif key == 112:
-            self.controller.toggle_pause()
+            self.input("piece_left")
+        elif key == 32:
+            self.input("hard_drop")
 
     def key_up(self, key):
-        if key == 274 or key == 107:
-            self.down_down = False
-
-    def new_piece(self):
-        self.piece = self.next_piece
-        randi = randint(0, len(self.shapes)-1)
-        self.next_piece = Piece(self, deepcopy(self.shapes[randi]), self.piece_imgs[randi], randi, self.offset_indicies[randi])
-
-    def reset_pieces(self):
-        rand1 = randint(0, len(self.shapes)-1)
-        rand2 = randint(0, len(self.shapes)-1)
-        self.piece = Piece(self, deepcopy(self.shapes[rand1]), self.piece_imgs[rand1], rand1, self.offset_indicies[rand1])
-        self.next_piece = Piece(self, deepcopy(self.shapes[rand2]), self.piece_imgs[rand2], rand2, self.offset_indicies[rand2])
-
-    def reset(self):
-        self.time_segment = 15
-        self.reset_pieces()
-        self.clear_grid()
-
-    def grid_intersect(self):
-        for sq in self.piece.shape:
-            gj = self.piece.j + sq[0] + 1
-            gi = self.piece.i + sq[1]
-            if self.grid[gi][gj]:
-                return True
-        return False
-
-    def piece_down(self):
-        self.piece.i -= 1
-        if self.grid_intersect():
-            self.piece.i += 1
-
-    def piece_right(self):
-        self.piece.j += 1
-        if self.grid_intersect():
-            self.piece.j -= 1
-
-    def piece_left(self):
-        self.piece.j -= 1
-        if self.grid_intersect():
-            self.piece.j += 1
-
-    def rotate_clock(self):
-        old_rot_pos = self.piece.rotation
-        self.piece.rotate_clock()
-        new_rot_pos = self.piece.rotation
-        valid = self.check_offsets(old_rot_pos, new_rot_pos)
-        if not valid:
-            self.piece.rotate_count()
-
-    def rotate_count(self):
-        old_rot_pos = self.piece.rotation
-        self.piece.rotate_count()
-        new_rot_pos = self.piece.rotation
-        valid = self.check_offsets(old_rot_pos, new_rot_pos)
-        if not valid:
-            self.piece.rotate_clock()
-
-    def check_offsets(self, old, new):
-        for offset in self.offsets[self.piece.offset_index]:
-            x1, y1 = offset[old]
-            x2, y2 = offset[new]
-            ox, oy = (x1-x2, y1-y2)
-            self.piece.j += ox
-            self.piece.i += oy
-            if not self.grid_intersect():
-                return True
-            else:
-                self.piece.j -= ox
-                self.piece.i -= oy
-        return False
-
-    def clear_lines(self):
-        cleared_lines = []
-        for i in range(1, self.rows+1):
-            full = True
-            for j in range(1, self.cols+1):
-                if not self.grid[i][j]:
-                    full = False
-                    break
-            if full:
-                cleared_lines.append(i)
-        return cleared_lines
-
-    def place_piece(self):
-        for sq in self.piece.shape:
-            gj = self.piece.j + sq[0] + 1
-            gi = self.piece.i + sq[1]
-            self.grid[gi][gj] = self.piece.piece_img
-
-    def check_clear_lines(self):
-        self.cleared_lines = self.clear_lines()
-        self.controller.update_score(len(self.cleared_lines))
-        if self.cleared_lines:
-            self.clearing_lines = True
-            self.turn_cleared_white()
-
-    def next_down_inter(self):
-        self.piece.i -= 1
-        if self.grid_intersect():
-            self.piece.i += 1
-            return True
-        self.piece.i += 1
-        return False
-
-    def clear_grid(self):
-        for i in range(1, self.rows+2):
-            for j in range(1, self.cols + 1):
-                self.grid[i][j] = 0
+        if (key == 274 or key == 107) and not (self.replay or self.bot):
+            self.input("stop_soft_drop")
 
-    def update(self):
-        if self.clearing_lines:
-            self.clear_lines_animation()
+    def input(self, name):
+        # In a versus game the move may be held back by the input delay.
+        if self.versus:
+            self.versus.input(self.engine, name)
         else:
-            self.time += self.time_step
-            if self.time >= self.time_segment or self.down_down:
-                self.time = 0
-                if self.next_down_inter():
-                    self.place_piece()
-                    self.check_clear_lines()
-                    self.new_piece()
-                    self.down_down = False
-                    if self.grid_intersect():
-                        self.controller.game_over()
-                else:
-                    self.piece.i -= 1
-
-    def turn_cleared_white(self):
-        for row in self.cleared_lines:
-            for j in range(1, self.cols+1):
-                self.grid[row][j] = self.white_piece
-
-    def clear_lines_animation(self):
-        if self.clear_step == 5:
-            self.remove_cleared_lines()
-            self.clear_step = 0
-            self.clearing_lines = False
-        else:
-            for row in self.cleared_lines:
-                self.grid[row][5-self.clear_step] = None
-                self.grid[row][6+self.clear_step] = None
-            self.clear_step += 1
-
-    def remove_cleared_lines(self):
-        for i in range(len(self.cleared_lines)-1, -1, -1):
-            row = self.cleared_lines[i]
-            self.grid.pop(row)
-            self.grid.append([1] + [0] * self.cols + [1])
-        self.cleared_lines = []
+            self.engine.input(name)
+
+    def reset(self, seed=None):
+        self.lag = 0
+        self.engine.reset(seed)
+
+    def update(self):
+        # Steps the engine in fixed ticks for the time since the last frame.
+        # After a stall (a window drag, say) at most max_lag ms is caught up.
+        self.lag += min(self.controller.clock.get_time(), self.max_lag)
+        while self.lag >= TICK_MS:
+            self.lag -= TICK_MS
+            if self.replay:
+                if self.replay.finished(self.engine):
+                    self.controller.game_over()
+                    return
+                self.replay.apply(self.engine)
+            else:
+                if self.versus:
+                    self.versus.act(self.engine)
+                if self.bot:
+                    self.bot.act(self.engine)
+            self.engine.update(TICK_MS)
+            if self.versus:
+                self.versus.updated(self.engine)
+        if self.versus:
+            self.versus.predict(self.engine.elapsed)
+
+    def view_key(self):
+        engine = self.engine
+        piece = engine.piece
+        if piece is None or engine.clearing_lines:
+            return None
+        return (piece, piece.rotation, piece.i, piece.j, engine.landing_row())
+
+    def piece_rects(self, i=None):
+        # The piece's squares on screen, or the ghost's if i is its landing row.
+        piece = self.engine.piece
+        i = piece.i if i is None else i
+        rects = []
+        for sq in piece.shape:
+            if i + sq[1] <= self.rows:
+                x = self.pos[0] + (piece.j + sq[0]) * self.scale
+                y = self.pos[1] + self.gh - (i + sq[1]) * self.scale
+                rects.append(pygame.Rect(x, y, self.scale, self.scale))
+        return rects
+
+    def get_dirty_rects(self):
+        rects = SurfaceObject.get_dirty_rects(self)
+        key = self.view_key()
+        if key != self.drawn_key:
+            self.drawn_key = key
+            rects.extend(self.drawn_piece_rects)
+            rects.extend(self.drawn_ghost_rects)
+            if key is None:
+                self.drawn_piece_rects = self.drawn_ghost_rects = []
+            else:
+                self.drawn_piece_rects = self.piece_rects()
+                self.drawn_ghost_rects = self.piece_rects(key[4])
+            rects.extend(self.drawn_piece_rects)
+            rects.extend(self.drawn_ghost_rects)
+        if self.engine.next_piece is not self.drawn_next:
+            self.drawn_next = self.engine.next_piece
+            rects.append(self.controller.next_piece_rect)
+        return rects
 
     def draw(self, surface):
-        self.surface.fill(self.grid_bg)
-        if not self.clearing_lines:
-            for sq in self.piece.shape:
-                x = (self.piece.j + sq[0]) * self.scale
-                y = self.gh - (self.piece.i + sq[1]) * self.scale
-                self.surface.blit(self.piece.piece_img, (x, y))
-        for gi in range(1, self.rows+1):
-            for gj in range(1, self.cols+1):
-                if self.grid[gi][gj]:
-                    x = (gj-1) * self.scale
-                    y = self.gh - (gi * self.scale)
-                    self.surface.blit(self.grid[gi][gj], (x, y))
         surface.blit(self.surface, self.pos)
+        key = self.view_key()
+        if key is not None:
+            id = self.engine.piece.id
+            if key[4] < key[2]:
+                for rect in self.piece_rects(key[4]):
+                    surface.blit(self.ghost_imgs[id], rect)
+            for rect in self.piece_rects():
+                surface.blit(self.piece_imgs[id], rect)
+
+    def cell_rect(self, gi, gj):
+        return pygame.Rect((gj-1) * self.scale, self.gh - gi * self.scale, self.scale, self.scale)
+
+    def draw_cell(self, gi, gj):
+        rect = self.cell_rect(gi, gj)
+        self.surface.fill(self.grid_bg, rect)
+        color = self.engine.colors[gi][gj]
+        if color:
+            self.surface.blit(self.cell_imgs[color], rect)
+        return rect
+
+    def draw_rows(self, first, last):
+        for gi in range(first, last+1):
+            for gj in range(1, self.cols+1):
+                self.draw_cell(gi, gj)
+
+    def cells_changed(self, cells):
+        for gi, gj in cells:
+            if gi <= self.rows:
+                self.mark_dirty(self.draw_cell(gi, gj).move(self.pos))
+
+    def rows_removed(self, rows):
+        # Shift everything above each removed row down by one row, then fill
+        # the rows that came down from above the visible grid.
+        for row in rows:
+            if row <= self.rows:
+                above = self.surface.subsurface((0, 0, self.gw, self.gh - (row-1) * self.scale))
+                above.scroll(0, self.scale)
+        bottom = min(rows)
+        self.draw_rows(max(bottom, self.rows - len(rows) + 1), self.rows)
+        self.mark_dirty(pygame.Rect(self.pos, (self.gw, self.gh - (bottom-1) * self.scale)))
+
+    def grid_cleared(self):
+        self.surface.fill(self.grid_bg)
+        self.draw_rows(1, self.rows)
+        self.mark_dirty()
 
-    def init_grid(self):
-        self.grid = []
-        self.grid.append([1] * (self.cols+2))
-        for _ in range(self.rows+1):
-            self.grid.append([1] + ([0] * self.cols) + [1])
-
-    def init_offsets(self):
-        self.offsets = [
-            [
-                [(0, 0), (0,  0), (0, 0), ( 0,  0)],
-                [(0, 0), (1,  0), (0, 0), (-1,  0)],
-                [(0, 0), (1, -1), (0, 0), (-1, -1)],
-                [(0, 0), (0,  2), (0, 0), ( 0,  2)],
-                [(0, 0), (1,  2), (0, 0), (-1,  2)]
-            ],
-            [
-                [( 0, 0), (-1,  0), (-1, 1), (0,  1)],
-                [(-1, 0), ( 0,  0), ( 1, 1), (0,  1)],
-                [( 2, 0), ( 0,  0), (-2, 1), (0,  1)],
-                [(-1, 0), ( 0,  1), ( 1, 0), (0, -1)],
-                [( 2, 0), ( 0, -2), (-2, 0), (0,  2)]
-            ],
-            [
-                [(0, 0), (0, -1), (-1, -1), (-1, 0)]
-            ]
-        ]
+    def garbage_added(self, count):
+        self.grid_cleared()
 
     def init_pieces(self):
-        self.white_piece = pygame.image.load("pieces/piece_white.png")
-        self.offset_indicies = [0, 0, 0, 0, 0, 1, 2]
+        self.white_piece = assets.image("pieces/piece_white.png")
         self.piece_imgs = [
-            pygame.image.load("pieces/piece_purple.png"),
-            pygame.image.load("pieces/piece_blue.png"),
-            pygame.image.load("pieces/piece_orange.png"),
-            pygame.image.load("pieces/piece_red.png"),
-            pygame.image.load("pieces/piece_green.png"),
-            pygame.image.load("pieces/piece_lightblue.png"),
-            pygame.image.load("pieces/piece_yellow.png")
+            assets.image("pieces/piece_purple.png"),
+            assets.image("pieces/piece_blue.png"),
+            assets.image("pieces/piece_orange.png"),
+            assets.image("pieces/piece_red.png"),
+            assets.image("pieces/piece_green.png"),
+            assets.image("pieces/piece_lightblue.png"),
+            assets.image("pieces/piece_yellow.png")
         ]
-        self.colors = [
-            (200, 0, 0),
-            (0, 200, 0),
-            (50, 50, 200),
-            (200, 200, 0),
-            (0, 200, 200),
-            (200, 200, 200),
-            (200, 0, 200)
-        ]
-        self.shapes = [
-            [[0, 0], [-1, 0], [1, 0], [ 0, 1]],
-            [[0, 0], [-1, 0], [1, 0], [-1, 1]],
-            [[0, 0], [-1, 0], [1, 0], [ 1, 1]],
-            [[0, 0], [-1, 1], [0, 1], [ 1, 0]],
-            [[0, 0], [-1, 0], [0, 1], [ 1, 1]],
-            [[0, 0], [-1, 0], [1, 0], [ 2, 0]],
-            [[0, 0], [ 0, 1], [1, 1], [ 1, 0]]
-        ]
-
-
-
-
-
-class Piece(object):
-    def __init__(self, tetris, shape, piece_img, id, offset_index):
-        self.tetris = tetris
-        self.shape = shape
-        self.id = id
-        self.offset_index = offset_index
-        self.piece_img = piece_img
-        self.j = 4
-        self.i = 20 if self.id == 5 else 19
-        self.rotation = 0
-
-    def rotate_clock(self):
-        self.rotation = (self.rotation + 1) % 4
-        for i in range(4):
-            self.shape[i] = [self.shape[i][1], -self.shape[i][0]]
-
-    def rotate_count(self):
-        self.rotation = (self.rotation - 1) % 4
-        for i in range(4):
-            self.shape[i] = [-self.shape[i][1], self.shape[i][0]]
+        self.cell_imgs = [None] + self.piece_imgs + [self.white_piece]
+        # Where the piece would land, drawn faintly under it.
+        self.ghost_imgs = [img.copy() for img in self.piece_imgs]
+        for img in self.ghost_imgs:
+            img.set_alpha(70)
 
 
 
@@ -665,10 +910,61 @@ class Piece(object):
 
 
 def main():
-    pygame.init()
-    tetris = TetrisController()
+    parser = argparse.ArgumentParser(description="Tetro")
+    parser.add_argument("--fps", type=int, default=60, help="frame rate cap, 0 for uncapped")
+    parser.add_argument("--vsync", action="store_true", help="sync frames to the display (pygame 2)")
+    parser.add_argument("--generator", choices=sorted(GENERATORS), default="uniform", help="how pieces are picked")
+    parser.add_argument("--gravity", choices=sorted(GRAVITIES), default="normal",
+                        help="20g drops pieces all the way at once; they lock half a second after landing")
+    parser.add_argument("--no-record", action="store_true", help="don't save games to ~/.tetro/replays")
+    parser.add_argument("--archive", metavar="FILE", help="save games into this replay archive instead")
+    parser.add_argument("--replay", metavar="FILE", help="play back a recorded game")
+    parser.add_argument("--force-replay", action="store_true",
+                        help="play back a game recorded by another engine version, which won't play out the same")
+    parser.add_argument("--bot", action="store_true", help="let the bot play, restarting after each game")
+    parser.add_argument("--bot-move-ms", type=int, default=50, help="time between the bot's inputs")
+    parser.add_argument("--versus", metavar="HOST:PORT", help="play against someone else through a versus_server")
+    parser.add_argument("--match", default="", help="versus match key; only players with the same key are paired")
+    parser.add_argument("--input-delay-ms", type=int, default=0,
+                        help="hold versus moves back this long so the opponent's view rarely has to roll back")
+    parser.add_argument("--profile", action="store_true", help="time every frame; F3 shows the timings")
+    parser.add_argument("--profile-out", metavar="PATH", help="write the timings to PATH.json and PATH.csv "
+                                                              "(default ~/.tetro/profiles/<time>)")
+    args = parser.parse_args()
+    replay = Recording.load(args.replay) if args.replay else None
+    if replay and replay.engine_version != ENGINE_VERSION:
+        if not args.force_replay:
+            parser.error("%s was %s; --force-replay plays it anyway" % (args.replay, version_problem(replay)))
+        print("warning: %s was %s, so it won't play out the same" % (args.replay, version_problem(replay)),
+              file=sys.stderr)
+    bot = Bot(move_ms=args.bot_move_ms) if args.bot else None
+    profiler = FrameProfiler(args.fps) if args.profile or args.profile_out else None
+    archive = ReplayArchive(args.archive) if args.archive else None
+    versus = None
+    if args.versus:
+        host, _, port = args.versus.rpartition(":")
+        # The bot's moves have to land on the tick it makes them.
+        delay = 0 if bot else args.input_delay_ms
+        versus = VersusSession(VersusClient(host, int(port)), args.match, delay, args.generator)
+    startup = StartupTimer(START_TIME)
+    startup.time("pygame.init", pygame.init)
+    tetris = TetrisController(startup, fps=args.fps, vsync=args.vsync, generator=args.generator,
+                              record=not args.no_record, bot=bot, profiler=profiler, archive=archive, versus=versus,
+                              gravity=args.gravity)
+    if replay:
+        tetris.start_game(replay, force_replay=True)
+    elif versus and bot:
+        tetris.join_versus()
+    elif bot:
+        tetris.start_game()
     tetris.run()
     pygame.quit()
+    if profiler:
+        tetris.save_profile(args.profile_out)
+    if bot:
+        print(bot.summary())
+    if versus:
+        print(versus.summary())
 
 
 
@@ -0,0 +1,209 @@
+"""
+Plays large numbers of headless bot games across every core, to compare
+bots and tune the gravity curve. The engine and bot don't use pygame, so
+the workers never start SDL.
+
+    python tournament.py --seeds 0-999
+    python tournament.py --seeds 0-9999 --bot lee --bot flat=-0.4,0.76,-0.36,-0.1 --gravity 15,1,1
+    python tournament.py --seeds 0-999 --gravity 12,0.5,2 --csv games.csv --json report.json
+
+Every bot plays the same seeds. Seeds are handed to the workers in chunks
+of --chunk games, so a worker only reports back once per chunk; the
+results are streamed into the report as chunks finish.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+
+from engine import TetrisEngine, GENERATORS
+from bot import Bot, Evaluator, play
+
+
+
+FIELDS = ("score", "lines", "level", "pieces", "duration")
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+
+class FrameGravity(object):
+    """
+    Pieces fall every max(start - step * level, minimum) frames at fps
+    frames a second. The defaults are the engine's own fall_interval.
+    """
+
+    def __init__(self, start=15, step=1, minimum=1, fps=30):
+        self.start = start
+        self.step = step
+        self.minimum = minimum
+        self.fps = fps
+
+    def __call__(self, level):
+        return int(max(self.start - self.step * level, self.minimum) * 1000 // self.fps)
+
+    def __str__(self):
+        return "%g,%g,%g" % (self.start, self.step, self.minimum)
+
+
+def parse_seeds(text):
+    start, _, end = text.partition("-")
+    return range(int(start), int(end or start) + 1)
+
+
+def parse_bot(text):
+    # NAME or NAME=HEIGHT,LINES,HOLES,BUMPINESS
+    name, _, weights = text.partition("=")
+    return name, tuple(float(w) for w in weights.split(",")) if weights else ()
+
+
+def parse_gravity(text):
+    return FrameGravity(*(float(value) for value in text.split(",")))
+
+
+def percentile(values, p):
+    # Nearest rank on sorted values.
+    return values[min(len(values) - 1, max(0, -(-len(values) * p // 100) - 1))]
+
+
+
+
+
+# Set up once in each worker by init_worker.
+worker = {}
+
+def init_worker(bots, generator, gravity, lookahead, hard_drop, max_pieces):
+    worker["bots"] = [Bot(Evaluator(*weights), lookahead=lookahead, hard_drop=hard_drop) for _, weights in bots]
+    worker["engine"] = TetrisEngine(generator=GENERATORS[generator](), gravity=gravity)
+    worker["max_pieces"] = max_pieces
+
+
+def play_chunk(task):
+    """Plays every seed in the task with one bot; returns (bot index, [(seed, score, ...), ...])."""
+    bot_index, seeds = task
+    bot = worker["bots"][bot_index]
+    engine = worker["engine"]
+    results = []
+    for seed in seeds:
+        engine.reset(seed)
+        bot.reset()
+        pieces = play(engine, bot, worker["max_pieces"])
+        results.append((seed, engine.score, engine.lines_cleared, engine.level, pieces, engine.elapsed,
+                        engine.game_done))
+    return bot_index, results
+
+
+
+
+
+class Report(object):
+    def __init__(self, names):
+        self.names = names
+        self.games = [[] for _ in names]
+
+    def add(self, bot_index, results):
+        self.games[bot_index].extend(results)
+
+    def count(self):
+        return sum(len(games) for games in self.games)
+
+    def stats(self, bot_index):
+        games = self.games[bot_index]
+        stats = {"games": len(games), "topped_out": sum(1 for game in games if game[6])}
+        for column, field in enumerate(FIELDS, 1):
+            values = sorted(game[column] for game in games)
+            if field == "duration":
+                values = [ms / 1000 for ms in values]
+            field_stats = {"mean": sum(values) / len(values) if values else 0}
+            for p in PERCENTILES:
+                field_stats["p%d" % p] = percentile(values, p) if values else 0
+            stats[field] = field_stats
+        return stats
+
+    def to_dict(self):
+        return {name: self.stats(i) for i, name in enumerate(self.names)}
+
+    def text(self):
+        lines = []
+        header = "%-10s %10s" % ("", "mean") + "".join("%10s" % ("p%d" % p) for p in PERCENTILES)
+        for i, name in enumerate(self.names):
+            stats = self.stats(i)
+            lines.append("%s: %d games, %d topped out" % (name, stats["games"], stats["topped_out"]))
+            lines.append(header)
+            for field in FIELDS:
+                label = "duration s" if field == "duration" else field
+                lines.append("%-10s %10.1f" % (label, stats[field]["mean"]) +
+                             "".join("%10.1f" % stats[field]["p%d" % p] for p in PERCENTILES))
+        return "\n".join(lines)
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play headless bot games on every core")
+    parser.add_argument("--seeds", type=parse_seeds, default=range(100), help="seed range, e.g. 0-999")
+    parser.add_argument("--bot", dest="bots", type=parse_bot, action="append",
+                        help="NAME or NAME=HEIGHT,LINES,HOLES,BUMPINESS evaluator weights; repeat to compare")
+    parser.add_argument("--lookahead", action="store_true")
+    parser.add_argument("--hard-drop", action="store_true", help="bots hard drop instead of soft dropping")
+    parser.add_argument("--generator", choices=sorted(GENERATORS), default="bag")
+    parser.add_argument("--gravity", type=parse_gravity, default=FrameGravity(),
+                        help="START,STEP,MIN: fall every max(START - STEP*level, MIN) frames at 30 fps; "
+                             "0 frames is 20G")
+    parser.add_argument("--max-pieces", type=int, default=1000, help="end a game after this many pieces")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunk", type=int, default=20, help="games per task sent to a worker")
+    parser.add_argument("--csv", help="write every game's result here as it comes in")
+    parser.add_argument("--json", help="write the report here")
+    args = parser.parse_args()
+    bots = args.bots or [("lee", ())]
+    names = [name for name, _ in bots]
+
+    seeds = args.seeds
+    tasks = [(bot_index, seeds[i:i + args.chunk])
+             for bot_index in range(len(bots)) for i in range(0, len(seeds), args.chunk)]
+    total = len(seeds) * len(bots)
+    report = Report(names)
+    csv_file = open(args.csv, "w", newline="") if args.csv else None
+    if csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(("bot", "seed") + FIELDS + ("topped_out",))
+
+    start = time.perf_counter()
+    initargs = (bots, args.generator, args.gravity, args.lookahead, args.hard_drop, args.max_pieces)
+    with multiprocessing.Pool(args.workers, init_worker, initargs) as pool:
+        for bot_index, results in pool.imap_unordered(play_chunk, tasks):
+            report.add(bot_index, results)
+            if csv_file:
+                writer.writerows((names[bot_index],) + game for game in results)
+            elapsed = time.perf_counter() - start
+            print("\r%d/%d games, %.1f games/sec" % (report.count(), total, report.count() / elapsed),
+                  end="", file=sys.stderr, flush=True)
+    elapsed = time.perf_counter() - start
+    print(file=sys.stderr)
+    if csv_file:
+        csv_file.close()
+
+    print("%d games on %d workers in %.1f s, %.1f games/sec, gravity %s, %s generator" % (
+        total, args.workers, elapsed, total / elapsed, args.gravity, args.generator))
+    print(report.text())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "seeds": [seeds.start, seeds.stop - 1],
+                "generator": args.generator,
+                "gravity": str(args.gravity),
+                "lookahead": args.lookahead,
+                "hard_drop": args.hard_drop,
+                "max_pieces": args.max_pieces,
+                "workers": args.workers,
+                "seconds": elapsed,
+                "games_per_sec": total / elapsed,
+                "bots": report.to_dict()
+            }, f, indent=2)
+
+
+
+if __name__ == "__main__":
+    main()
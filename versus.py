@@ -0,0 +1,495 @@
+"""
+Head-to-head games between two Tetro windows through a versus_server.
+
+Both players get the same seed and generator, so each side can run the
+other's game from its inputs alone. The wire format is frames of a u16
+payload length and a type byte:
+
+    JOIN       client: generator id, then the match key (utf-8, may be empty)
+    START      server: seed u64, generator id, player index
+    EVENTS     client, relayed: varints, see below
+    SNAPSHOT   client, relayed: a check of the game every SNAPSHOT_MS
+    GAME_OVER  client, relayed: the sender's game has ended
+    LEFT       server: the opponent disconnected or joined another match
+
+EVENTS carry one varint per event, as in replay_archive: the ticks since the
+sender's previous event shifted left four bits, with the code in the low
+bits. Codes below THROUGH are indexes into TetrisEngine.INPUTS; GARBAGE is
+followed by the line count and hole column as two more varints, and marks
+when the sender's engine received that garbage. A THROUGH event promises
+that every event before its tick has been sent, which is what lets the
+other side simulate up to it. It leaves its own tick open: inputs held
+back by the input delay are queued for that tick before it's sent, more
+events can still be made at it, and ticks never go backwards in the
+stream.
+
+Local inputs can be held back by an input delay. They are sent as soon as
+they're made, so with a delay at least as long as the trip to the opponent
+they arrive before they're needed. The opponent's board is drawn from a
+prediction run ahead of the last confirmed tick, which is thrown away and
+re-run from the confirmed state whenever more events arrive.
+
+Snapshots hold the sender's score, lines, piece and the rows of the grid
+that changed since the previous snapshot, taken just after the engine's
+update reached the snapshot's time, so every input made on the tick before
+is in them. The receiver compares them with its simulation of the sender
+at the same point and counts desyncs, which
+shouldn't happen while both sides run the same engine version.
+
+    python versus_server.py --port 7777
+    python tetro.py --versus 192.168.1.10:7777 --match lan-party
+"""
+import asyncio
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from queue import Queue, Empty
+from random import Random
+
+from engine import TetrisEngine, TICK_MS, GENERATORS, WALL_BITS
+from replay_archive import write_varint, read_varint, GENERATOR_IDS
+
+
+
+# Frame types; DISCONNECTED never goes on the wire, the client queues it
+# when the connection drops.
+DISCONNECTED, JOIN, START, EVENTS, SNAPSHOT, GAME_OVER, LEFT = range(7)
+# payload length, type
+FRAME_HEADER = struct.Struct("<HB")
+# seed, generator id, player index
+START_MESSAGE = struct.Struct("<QBB")
+
+INPUT_IDS = {name: i for i, name in enumerate(TetrisEngine.INPUTS)}
+CODE_BITS = 4
+THROUGH = 14
+GARBAGE = 15
+
+# Events are sent at most every FLUSH_MS of game time, and a THROUGH at
+# least every HEARTBEAT_MS, which is how often the opponent's confirmed
+# game moves on while nothing happens.
+FLUSH_MS = 50
+HEARTBEAT_MS = 200
+SNAPSHOT_MS = 2000
+# How far the drawn opponent board may be run ahead of what's confirmed.
+MAX_PREDICTION_MS = 500
+
+
+def frame(type, payload=b""):
+    return FRAME_HEADER.pack(len(payload), type) + payload
+
+
+def grid_rows(engine):
+    # The grid's rows without the walls, bottom first.
+    mask = (1 << engine.cols) - 1
+    return [row >> WALL_BITS & mask for row in engine.grid[1:engine.height+1]]
+
+
+def piece_state(engine):
+    piece = engine.piece
+    return (piece.id, piece.rotation, piece.i, piece.j) if piece else None
+
+
+def encode_snapshot(engine, previous_rows):
+    """Returns the SNAPSHOT payload and the rows it was taken against."""
+    rows = grid_rows(engine)
+    out = bytearray()
+    write_varint(out, engine.elapsed // TICK_MS)
+    write_varint(out, engine.score)
+    write_varint(out, engine.lines_cleared)
+    piece = piece_state(engine) or (0xff, 0, 0, 0)
+    # j goes slightly negative against the left wall.
+    out += bytes((piece[0], piece[1], piece[2], piece[3] + 4 & 0xff))
+    changed = [i for i, row in enumerate(rows) if row != previous_rows[i]]
+    write_varint(out, len(changed))
+    for i in changed:
+        out.append(i)
+        write_varint(out, rows[i])
+    return bytes(out), rows
+
+
+def decode_snapshot(payload, previous_rows):
+    """Returns (elapsed, score, lines, piece, rows)."""
+    tick, pos = read_varint(payload, 0)
+    score, pos = read_varint(payload, pos)
+    lines, pos = read_varint(payload, pos)
+    id, rotation, i, j = payload[pos:pos+4]
+    pos += 4
+    piece = None if id == 0xff else (id, rotation, i, j - 4)
+    count, pos = read_varint(payload, pos)
+    rows = list(previous_rows)
+    for _ in range(count):
+        i = payload[pos]
+        rows[i], pos = read_varint(payload, pos + 1)
+    return tick * TICK_MS, score, lines, piece, rows
+
+
+
+
+
+class VersusClient(object):
+    """
+    Connection to a versus server, run by an asyncio loop on a background
+    thread. send() may be called from the game loop at any time, before the
+    connection is up too; received frames are queued for poll().
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.messages = Queue()
+        self.writer = None
+        self.unsent = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.worker = threading.Thread(target=self.work, name="versus", daemon=True)
+        self.worker.start()
+
+    def work(self):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(self.receive())
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    async def receive(self):
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            # Frames are small and latency matters more than packet count.
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.writer = writer
+            for data in self.unsent:
+                writer.write(data)
+            self.unsent = []
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                length, type = FRAME_HEADER.unpack(header)
+                payload = await reader.readexactly(length)
+                self.bytes_received += FRAME_HEADER.size + length
+                self.messages.put((type, payload))
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.messages.put((DISCONNECTED, str(e) or "connection closed"))
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+    def write(self, data):
+        # Runs on the loop.
+        if self.writer is not None:
+            self.writer.write(data)
+        else:
+            self.unsent.append(data)
+
+    def send(self, type, payload=b""):
+        data = frame(type, payload)
+        self.bytes_sent += len(data)
+        try:
+            self.loop.call_soon_threadsafe(self.write, data)
+        except RuntimeError:
+            # The loop has stopped after the connection dropped.
+            pass
+
+    def poll(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except Empty:
+                return messages
+
+    def close(self):
+        if self.task is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.task.cancel)
+            except RuntimeError:
+                pass
+        self.worker.join(1)
+
+
+
+
+
+class RemoteGame(object):
+    """
+    The opponent's game. engine is confirmed: it has only been run through
+    ticks whose events have all arrived. view is what gets drawn: a copy of
+    engine run on towards the local game's time as if no inputs were made,
+    and rolled back to engine whenever engine moves on.
+    """
+
+    def __init__(self, seed, generator, rows=20, cols=10):
+        self.engine = TetrisEngine(rows, cols, GENERATORS[generator]())
+        self.engine.reset(seed)
+        self.view = TetrisEngine(rows, cols, GENERATORS[generator]())
+        self.view.restore(self.engine.snapshot())
+        self.stale = False
+        self.events = deque()
+        self.through = -1
+        self.last_tick = 0
+        self.snapshot_rows = [0] * self.engine.height
+        # {elapsed: (score, lines, piece, rows)} of engine at snapshot ticks,
+        # and snapshots that arrived before engine got to their tick.
+        self.checks = {}
+        self.snapshots = {}
+        self.desyncs = 0
+
+    def add_events(self, payload):
+        events = self.events
+        tick = self.last_tick
+        pos = 0
+        while pos < len(payload):
+            n, pos = read_varint(payload, pos)
+            tick += n >> CODE_BITS
+            code = n & (1 << CODE_BITS) - 1
+            if code == THROUGH:
+                # The last tick that can be simulated is the one before.
+                self.through = (tick - 1) * TICK_MS
+            elif code == GARBAGE:
+                count, pos = read_varint(payload, pos)
+                hole, pos = read_varint(payload, pos)
+                events.append((tick * TICK_MS, code, (count, hole)))
+            else:
+                events.append((tick * TICK_MS, code, None))
+        self.last_tick = tick
+        self.advance()
+
+    def add_snapshot(self, payload):
+        elapsed, score, lines, piece, rows = decode_snapshot(payload, self.snapshot_rows)
+        self.snapshot_rows = rows
+        state = (score, lines, piece, rows)
+        if elapsed in self.checks:
+            self.check(self.checks.pop(elapsed), state)
+        elif elapsed > self.engine.elapsed:
+            self.snapshots[elapsed] = state
+
+    def check(self, simulated, sent):
+        if simulated != sent:
+            self.desyncs += 1
+
+    def advance(self):
+        # Runs engine through every tick that's confirmed.
+        engine = self.engine
+        events = self.events
+        inputs = TetrisEngine.INPUTS
+        while engine.elapsed <= self.through and not engine.game_done:
+            while events and events[0][0] <= engine.elapsed:
+                elapsed, code, arg = events.popleft()
+                if code == GARBAGE:
+                    engine.receive_garbage(*arg)
+                else:
+                    engine.input(inputs[code])
+            engine.update(TICK_MS)
+            self.stale = True
+            if engine.elapsed % SNAPSHOT_MS == 0:
+                state = (engine.score, engine.lines_cleared, piece_state(engine), grid_rows(engine))
+                sent = self.snapshots.pop(engine.elapsed, None)
+                if sent is not None:
+                    self.check(state, sent)
+                else:
+                    self.checks = {engine.elapsed: state}
+
+    def predict(self, elapsed):
+        # Runs view on to elapsed, the local game's time, without inputs.
+        view = self.view
+        if self.stale:
+            self.stale = False
+            view.restore(self.engine.snapshot())
+        target = min(elapsed, self.engine.elapsed + MAX_PREDICTION_MS)
+        while view.elapsed + TICK_MS <= target and not view.game_done:
+            view.update(TICK_MS)
+
+
+
+
+
+class VersusSession(object):
+    """
+    The local player's side of versus matches. The controller calls poll()
+    every frame, and while a match is on TetrisGame calls act() before each
+    engine tick, input() for the player's moves and predict() once a frame.
+
+    join() asks the server for an opponent; once one is found the start
+    callback gets the seed and generator to reset the local game with.
+    Garbage the opponent sends is worked out from the simulation of their
+    game, so it never needs a message of its own.
+    """
+
+    def __init__(self, client, match="", input_delay_ms=0, generator="bag"):
+        self.client = client
+        self.match = match
+        # Rounded up to whole ticks.
+        self.input_delay = -(-input_delay_ms // TICK_MS) * TICK_MS
+        self.generator = generator
+        self.start_func = None
+        self.finished_func = None
+        self.waiting = False
+        self.playing = False
+        self.remote = None
+        self.result = None
+        self.start_time = None
+        self.desyncs = 0
+        self.matches = 0
+        self.reset()
+
+    def connect_start(self, func):
+        # func(seed, generator) when a match starts.
+        self.start_func = func
+
+    def connect_finished(self, func):
+        # func() when the opponent's game ends or they leave mid-match.
+        self.finished_func = func
+
+    def reset(self):
+        self.pending = deque()
+        self.garbage_in = deque()
+        self.holes = None
+        self.unsent = bytearray()
+        self.sent_tick = 0
+        self.last_flush = 0
+        self.next_snapshot = SNAPSHOT_MS
+        self.snapshot_rows = None
+        self.applying = False
+
+    def join(self):
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        self.waiting = True
+        self.client.send(JOIN, bytes((GENERATOR_IDS.index(self.generator),)) + self.match.encode("utf-8"))
+
+    def poll(self):
+        for type, payload in self.client.poll():
+            if type == START:
+                seed, generator, player = START_MESSAGE.unpack(payload)
+                self.start(seed, GENERATOR_IDS[generator], player)
+            elif self.remote is None:
+                continue
+            elif type == EVENTS:
+                self.remote.add_events(payload)
+            elif type == SNAPSHOT:
+                self.remote.add_snapshot(payload)
+            elif type in (GAME_OVER, LEFT, DISCONNECTED):
+                self.opponent_finished("left" if type != GAME_OVER else "win")
+
+    def start(self, seed, generator, player):
+        self.waiting = False
+        self.playing = True
+        self.result = None
+        self.matches += 1
+        self.reset()
+        if self.remote is not None:
+            self.desyncs += self.remote.desyncs
+        self.remote = RemoteGame(seed, generator)
+        self.remote.engine.connect_garbage_sent(self.garbage_sent)
+        # Both players pick holes for the garbage they receive; they only
+        # have to differ from each other's.
+        self.holes = Random(seed * 2 + player)
+        if self.start_func:
+            self.start_func(seed, generator)
+
+    def begin(self, engine):
+        # Called once the local engine has been reset for the match.
+        engine.connect_input(self.input_applied)
+        self.snapshot_rows = [0] * engine.height
+
+    def garbage_sent(self, count):
+        # The opponent's simulated game cleared lines at us.
+        if self.playing:
+            self.garbage_in.append(count)
+
+    def opponent_finished(self, result):
+        if self.playing:
+            self.result = result
+            if self.finished_func:
+                self.finished_func()
+
+    def end(self, engine):
+        """Ends the local game; the opponent is told unless it was them that finished."""
+        engine.connect_input(None)
+        if not self.playing:
+            return
+        self.playing = False
+        if self.result is None:
+            self.result = "lose"
+        self.flush(engine.elapsed + self.input_delay)
+        self.client.send(GAME_OVER)
+
+    def queue_event(self, elapsed, code, arg=None):
+        tick = elapsed // TICK_MS
+        write_varint(self.unsent, (tick - self.sent_tick) << CODE_BITS | code)
+        if arg is not None:
+            write_varint(self.unsent, arg[0])
+            write_varint(self.unsent, arg[1])
+        self.sent_tick = tick
+
+    def flush(self, through):
+        self.queue_event(through, THROUGH)
+        self.client.send(EVENTS, bytes(self.unsent))
+        self.unsent = bytearray()
+
+    def input(self, engine, name):
+        # The local player's move, made input_delay ms from now.
+        if not self.input_delay:
+            engine.input(name)
+            return
+        elapsed = engine.elapsed + self.input_delay
+        self.pending.append((elapsed, INPUT_IDS[name], None))
+        self.queue_event(elapsed, INPUT_IDS[name])
+
+    def input_applied(self, elapsed, name):
+        # Moves made straight on the engine, by the bot or with no delay.
+        if not self.applying:
+            self.queue_event(elapsed, INPUT_IDS[name])
+
+    def act(self, engine):
+        # Runs at the start of a tick, before any other input at this tick
+        # (the bot's) is made; those are sent with the next flush. Every
+        # input before now + input_delay has been queued by now, and garbage
+        # is only ever queued at now + input_delay.
+        now = engine.elapsed
+        since_flush = now - self.last_flush
+        if since_flush >= HEARTBEAT_MS or (self.unsent and since_flush >= FLUSH_MS):
+            self.last_flush = now
+            self.flush(now + self.input_delay)
+        while self.garbage_in:
+            garbage = (self.garbage_in.popleft(), self.holes.randint(1, engine.cols))
+            self.pending.append((now + self.input_delay, GARBAGE, garbage))
+            self.queue_event(now + self.input_delay, GARBAGE, garbage)
+        pending = self.pending
+        if pending and pending[0][0] <= now:
+            inputs = TetrisEngine.INPUTS
+            self.applying = True
+            while pending and pending[0][0] <= now:
+                elapsed, code, arg = pending.popleft()
+                if code == GARBAGE:
+                    engine.receive_garbage(*arg)
+                else:
+                    engine.input(inputs[code])
+            self.applying = False
+
+    def updated(self, engine):
+        # Runs after each engine update, once every input of that tick is in.
+        if engine.elapsed >= self.next_snapshot:
+            self.next_snapshot += SNAPSHOT_MS
+            payload, self.snapshot_rows = encode_snapshot(engine, self.snapshot_rows)
+            self.client.send(SNAPSHOT, payload)
+
+    def predict(self, elapsed):
+        if self.remote is not None:
+            self.remote.predict(elapsed)
+
+    def summary(self):
+        seconds = time.monotonic() - self.start_time if self.start_time is not None else 0
+        desyncs = self.desyncs + (self.remote.desyncs if self.remote is not None else 0)
+        text = "versus: %d matches, %d bytes sent, %d received" % (
+            self.matches, self.client.bytes_sent, self.client.bytes_received)
+        if seconds:
+            text += " (%.0f B/s up, %.0f B/s down)" % (self.client.bytes_sent / seconds,
+                                                      self.client.bytes_received / seconds)
+        return text + ", %d desyncs" % desyncs
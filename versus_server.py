@@ -0,0 +1,150 @@
+"""
+Matchmaking and relay server for versus games (see versus.py).
+
+Clients that JOIN with the same match key are paired in the order they
+arrive; an empty key pairs with anyone else who sent an empty key. Once
+paired both get START with a fresh seed, and from then on EVENTS, SNAPSHOT
+and GAME_OVER frames are passed to the opponent as they are, without being
+decoded. One event loop serves every match.
+
+    python versus_server.py --port 7777
+    python versus_server.py --host 0.0.0.0 --stats 10
+"""
+import argparse
+import asyncio
+import signal
+import socket
+import time
+from random import Random
+
+from versus import FRAME_HEADER, START_MESSAGE, JOIN, START, EVENTS, SNAPSHOT, GAME_OVER, LEFT, frame
+
+
+
+RELAYED = (EVENTS, SNAPSHOT, GAME_OVER)
+# A client that lets this much pile up unread is dropped.
+MAX_WRITE_BUFFER = 1 << 20
+
+
+
+
+
+class Player(object):
+    def __init__(self, writer):
+        self.writer = writer
+        self.key = None
+        self.generator = 0
+        self.opponent = None
+
+    def send(self, data):
+        writer = self.writer
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            writer.close()
+            return
+        writer.write(data)
+
+
+
+
+
+class VersusServer(object):
+    def __init__(self, seed=None):
+        self.random = Random(seed)
+        # {match key: player waiting for an opponent}
+        self.waiting = {}
+        self.players = 0
+        self.matches = 0
+        self.matches_started = 0
+        self.bytes_relayed = 0
+
+    def join(self, player, payload):
+        self.leave(player)
+        player.generator = payload[0] if payload else 0
+        key = payload[1:]
+        opponent = self.waiting.pop(key, None)
+        if opponent is None:
+            player.key = key
+            self.waiting[key] = player
+            return
+        # Both play the first player's generator.
+        opponent.key = None
+        opponent.opponent, player.opponent = player, opponent
+        self.matches += 1
+        self.matches_started += 1
+        seed = self.random.getrandbits(63)
+        opponent.send(frame(START, START_MESSAGE.pack(seed, opponent.generator, 0)))
+        player.send(frame(START, START_MESSAGE.pack(seed, opponent.generator, 1)))
+
+    def leave(self, player):
+        if player.key is not None and self.waiting.get(player.key) is player:
+            del self.waiting[player.key]
+        player.key = None
+        opponent = player.opponent
+        if opponent is not None:
+            self.matches -= 1
+            opponent.opponent = player.opponent = None
+            opponent.send(frame(LEFT))
+
+    async def handle(self, reader, writer):
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        player = Player(writer)
+        self.players += 1
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                length, type = FRAME_HEADER.unpack(header)
+                payload = await reader.readexactly(length)
+                if type in RELAYED:
+                    if player.opponent is not None:
+                        player.opponent.send(header + payload)
+                        self.bytes_relayed += FRAME_HEADER.size + length
+                elif type == JOIN:
+                    self.join(player, payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.players -= 1
+            self.leave(player)
+            writer.close()
+
+    async def report(self, interval):
+        last = time.monotonic()
+        relayed = self.bytes_relayed
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            print("%d players, %d matches on, %d started, %.0f B/s relayed" % (
+                self.players, self.matches, self.matches_started, (self.bytes_relayed - relayed) / (now - last)))
+            last, relayed = now, self.bytes_relayed
+
+    async def serve(self, host, port, stats_interval=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if stats_interval:
+            asyncio.ensure_future(self.report(stats_interval))
+        print("Serving versus matches on %s:%d" % (host, port))
+        async with server:
+            await server.serve_forever()
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tetro versus server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--stats", type=float, metavar="SECONDS", help="print player and traffic counts this often")
+    args = parser.parse_args()
+    server = VersusServer()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.stats))
+    except KeyboardInterrupt:
+        pass
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,74 @@
 import pygame
+from collections import OrderedDict
+
+
+
+def merge_rects(rects):
+    merged = []
+    for rect in rects:
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+
+
+class RectIndex(object):
+    # Uniform grid of cell x cell squares, each listing the items whose rect
+    # overlaps it, so a point lookup only tests the items in one cell. The
+    # rects are kept by reference and must not move once added.
+    def __init__(self, cell=64):
+        self.cell = cell
+        self.cells = {}
+
+    def add(self, rect, item):
+        cell = self.cell
+        for cx in range(rect.left // cell, (rect.right - 1) // cell + 1):
+            for cy in range(rect.top // cell, (rect.bottom - 1) // cell + 1):
+                self.cells.setdefault((cx, cy), []).append((rect, item))
+
+    def at(self, pos):
+        cell = self.cells.get((pos[0] // self.cell, pos[1] // self.cell), ())
+        return [item for rect, item in cell if rect.collidepoint(pos)]
+
+    def __bool__(self):
+        return bool(self.cells)
+
+
+
+
+# pygame 2 reports the pointer leaving the window as WINDOWLEAVE; pygame 1.9
+# only as an ACTIVEEVENT losing mouse focus.
+POINTER_LEFT = getattr(pygame, "WINDOWLEAVE", pygame.ACTIVEEVENT)
+
+def pointer_left(event):
+    if event.type == pygame.ACTIVEEVENT:
+        return event.state & pygame.APPMOUSEFOCUS and not event.gain
+    return event.type == POINTER_LEFT
+
+
+def index_events(widgets):
+    # {event type: [widgets that subscribe to it]}, keeping the widgets' order.
+    handlers = {}
+    for widget in widgets:
+        for event_type in widget.event_types:
+            handlers.setdefault(event_type, []).append(widget)
+    return handlers
+
 
 
 
 class Widget(object):
+    # The event types check_event is called with; other events never reach it.
+    event_types = ()
+
     def check_event(self, event): pass
     def update(self): pass
     def draw(self, surface): pass
+    def get_dirty_rects(self): return []
 
 
 
@@ -23,14 +86,26 @@ class SurfaceObject(Widget):
         if center_blit:
             self.rect.topleft = (self.rect.left-self.rect.w//2, self.rect.top-self.rect.h//2)
         self.pos = self.rect.topleft
+        self.dirty_rects = []
 
     def reset_rect(self, new_rect):
+        old_rect = self.rect
         if self.center_blit:
             new_rect.center = self.rect.center
         else:
             new_rect.topleft = self.rect.topleft
         self.rect = new_rect
         self.pos = self.rect.topleft
+        self.mark_dirty(old_rect)
+        self.mark_dirty()
+
+    def mark_dirty(self, rect=None):
+        self.dirty_rects.append(pygame.Rect(self.rect if rect is None else rect))
+
+    def get_dirty_rects(self):
+        rects = self.dirty_rects
+        self.dirty_rects = []
+        return rects
 
 
 
@@ -39,14 +114,53 @@ class WidgetSurface(SurfaceObject):
     def __init__(self, surface, pos, parent, center_blit):
         SurfaceObject.__init__(self, surface, pos, parent, center_blit)
         self.widgets = []
+        self.handlers = {}
+        self.buttons = RectIndex()
+        self.hover_buttons = RectIndex()
+        self.hovered = []
+        self.event_types = ()
 
     def add_widget(self, widget):
+        # Buttons are found by where they are on screen rather than asked
+        # about every click or mouse move; other widgets get the event types
+        # they ask for.
         self.widgets.append(widget)
+        if isinstance(widget, Button):
+            self.buttons.add(widget.rect, widget)
+            if widget.hovered_image:
+                self.hover_buttons.add(widget.rect, widget)
+        else:
+            for event_type in widget.event_types:
+                self.handlers.setdefault(event_type, []).append(widget)
+        event_types = set(self.handlers)
+        if self.buttons:
+            event_types.add(pygame.MOUSEBUTTONDOWN)
+        if self.hover_buttons:
+            event_types.update((pygame.MOUSEMOTION, POINTER_LEFT))
+        self.event_types = tuple(event_types)
 
     def check_event(self, event):
-        for widget in self.widgets:
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            for button in self.buttons.at(event.pos):
+                button.click()
+        elif event.type == pygame.MOUSEMOTION:
+            self.set_pointer(event.pos)
+        elif event.type == POINTER_LEFT and pointer_left(event):
+            self.set_pointer(None)
+        for widget in self.handlers.get(event.type, ()):
             widget.check_event(event)
 
+    def set_pointer(self, pos):
+        # Only the buttons the pointer entered or left hear about it.
+        hovered = self.hover_buttons.at(pos) if pos else []
+        for button in self.hovered:
+            if button not in hovered:
+                button.set_hovered(False)
+        for button in hovered:
+            if button not in self.hovered:
+                button.set_hovered(True)
+        self.hovered = hovered
+
     def update(self):
         for widget in self.widgets:
             widget.update()
@@ -56,6 +170,12 @@ class WidgetSurface(SurfaceObject):
         for widget in self.widgets:
             widget.draw(surface)
 
+    def get_dirty_rects(self):
+        rects = SurfaceObject.get_dirty_rects(self)
+        for widget in self.widgets:
+            rects.extend(widget.get_dirty_rects())
+        return rects
+
 
 
 
@@ -63,46 +183,256 @@ class WidgetSurface(SurfaceObject):
 class WidgetSurfaceHolder(object):
     def __init__(self):
         self.wss = {}
+        self.factories = {}
         self.update_active = []
         self.draw_active = []
+        self.handlers = {}
+        self.filtered = []
+        self.full_redraw = True
+        self.dirty_rects = []
+        # Set to a FrameProfiler to time each widget surface by name.
+        self.profiler = None
+        self.names = {}
 
     def add_widget_surface(self, name, ws):
         self.wss[name] = ws
+        self.names[ws] = name
+
+    def add_lazy_widget_surface(self, name, factory):
+        # factory() builds the widget surface the first time it's needed.
+        self.factories[name] = factory
+
+    def get(self, name):
+        ws = self.wss.get(name)
+        if ws is None and name in self.factories:
+            ws = self.wss[name] = self.factories.pop(name)()
+            self.names[ws] = name
+        return ws
+
+    def pending(self):
+        return list(self.factories)
+
+    def resolve(self, names):
+        return [self.get(name) for name in names if name in self.wss or name in self.factories]
 
     def activate_update(self, *args):
-        self.update_active = [self.wss[name] for name in args if name in self.wss]
+        self.update_active = self.resolve(args)
+        self.index_events()
+        self.sync_pointer()
 
     def activate_draw(self, *args):
-        self.draw_active = [self.wss[name] for name in args if name in self.wss]
+        self.draw_active = self.resolve(args)
+        self.full_redraw = True
 
     def activate(self, *args):
-        self.update_active = [self.wss[name] for name in args if name in self.wss]
+        self.update_active = self.resolve(args)
         self.draw_active = self.update_active
+        self.full_redraw = True
+        self.index_events()
+        self.sync_pointer()
+
+    def filter_events(self, event_types):
+        # event_types are blocked at the source while no active surface
+        # subscribes to them, so they never fill up the queue.
+        self.filtered = list(event_types)
+        self.index_events()
+
+    def index_events(self):
+        # Events only go to the active surfaces that subscribe to their type.
+        self.handlers = index_events(self.update_active)
+        allowed = [event_type for event_type in self.filtered if event_type in self.handlers]
+        blocked = [event_type for event_type in self.filtered if event_type not in self.handlers]
+        if allowed:
+            pygame.event.set_allowed(allowed)
+        if blocked:
+            pygame.event.set_blocked(blocked)
+
+    def sync_pointer(self):
+        # Hover only changes on mouse events, and motion isn't delivered while
+        # nothing subscribes to it, so newly active surfaces are told where
+        # the pointer is.
+        handlers = self.handlers.get(pygame.MOUSEMOTION)
+        if handlers:
+            pos = pygame.mouse.get_pos() if pygame.mouse.get_focused() else (-1, -1)
+            event = pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(0, 0), buttons=(0, 0, 0))
+            for ws in handlers:
+                ws.check_event(event)
+
+    def mark_dirty(self, rect):
+        # Redraws rect on the next draw, for things drawn on top of the
+        # widget surfaces.
+        self.dirty_rects.append(pygame.Rect(rect))
 
     def update(self):
+        profiler = self.profiler
         for ws in self.update_active:
-            ws.update()
+            if profiler is None:
+                ws.update()
+            else:
+                profiler.time_surface(self.names[ws], "update", ws.update)
 
     def draw(self, surface):
+        # Returns the rects of surface that changed, for pygame.display.update.
+        profiler = self.profiler
+        if self.full_redraw:
+            self.full_redraw = False
+            self.dirty_rects = []
+            for ws in self.wss.values():
+                ws.get_dirty_rects()
+            for ws in self.draw_active:
+                if profiler is None:
+                    ws.draw(surface)
+                else:
+                    profiler.time_surface(self.names[ws], "draw", ws.draw, surface)
+            return [surface.get_rect()]
+        rects = self.dirty_rects
+        self.dirty_rects = []
         for ws in self.draw_active:
-            ws.draw(surface)
+            if profiler is None:
+                rects.extend(ws.get_dirty_rects())
+            else:
+                rects.extend(profiler.time_surface(self.names[ws], "dirty", ws.get_dirty_rects))
+        if rects:
+            rects = merge_rects(rects)
+            clip = surface.get_clip()
+            for rect in rects:
+                surface.set_clip(rect)
+                for ws in self.draw_active:
+                    if profiler is None:
+                        ws.draw(surface)
+                    else:
+                        profiler.time_surface(self.names[ws], "draw", ws.draw, surface)
+            surface.set_clip(clip)
+        return rects
 
     def check_event(self, event):
-        for ws in self.update_active:
+        for ws in self.handlers.get(event.type, ()):
             ws.check_event(event)
 
 
 
 
 
+fonts = {}
+
+def get_font(name, size):
+    font = fonts.get((name, size))
+    if font is None:
+        font = fonts[(name, size)] = pygame.font.SysFont(name, size)
+    return font
+
+
+
+
+class TextCache(object):
+    # Least recently used cache of rendered text, shared by every Label.
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font_key, text, antialias, color):
+        key = (font_key, text, antialias, tuple(color))
+        surf = self.surfaces.get(key)
+        if surf is None:
+            self.misses += 1
+            surf = get_font(*font_key).render(text, antialias, color)
+            self.surfaces[key] = surf
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+        return surf
+
+    def render_glyphs(self, font_key, text, antialias, color):
+        # Builds text from one cached surface per character, so labels that
+        # only show changing numbers stop going through the font renderer.
+        glyphs = [self.render(font_key, char, antialias, color) for char in text]
+        if not glyphs:
+            return self.render(font_key, text, antialias, color)
+        w = sum(glyph.get_width() for glyph in glyphs)
+        h = max(glyph.get_height() for glyph in glyphs)
+        surf = pygame.Surface((w, h), pygame.SRCALPHA)
+        # Transparent pixels already carry the text colour, so blending the
+        # glyphs' antialiased edges onto them doesn't darken the edges.
+        surf.fill(tuple(color)[:3] + (0,))
+        x = 0
+        for glyph in glyphs:
+            surf.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return surf
+
+    def clear(self):
+        self.surfaces.clear()
+
+text_cache = TextCache()
+
+
+
+
+class AssetCache(object):
+    # Loads each image once and hands out the same surface to every widget
+    # that asks for it. Images loaded after pygame.display.set_mode are
+    # converted to the display's pixel format so blits don't convert them
+    # on every frame. Sounds are decoded the first time they're asked for.
+    def __init__(self):
+        self.images = {}
+        self.sounds = {}
+        self.hits = 0
+
+    def image(self, path):
+        surf = self.images.get(path)
+        if surf is None:
+            surf = self.images[path] = self.convert(pygame.image.load(path))
+        else:
+            self.hits += 1
+        return surf
+
+    def sound(self, path):
+        sound = self.sounds.get(path)
+        if sound is None:
+            sound = self.sounds[path] = pygame.mixer.Sound(path)
+        else:
+            self.hits += 1
+        return sound
+
+    def convert(self, surf):
+        if pygame.display.get_surface() is None:
+            return surf
+        if surf.get_flags() & pygame.SRCALPHA:
+            return surf.convert_alpha()
+        return surf.convert()
+
+    def stats(self):
+        return {
+            "images": len(self.images),
+            "bytes": sum(surf.get_pitch() * surf.get_height() for surf in self.images.values()),
+            "sounds": len(self.sounds),
+            "hits": self.hits
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return "%d images, %.1f KiB, %d sounds, %d shared loads" % (
+            stats["images"], stats["bytes"] / 1024, stats["sounds"], stats["hits"])
+
+assets = AssetCache()
+
+
+
+
 class Label(SurfaceObject):
-    def __init__(self, parent, pos, text="", center_blit=False):
+    def __init__(self, parent, pos, text="", center_blit=False, glyphs=False):
         SurfaceObject.__init__(self, pygame.Surface((1,1)), pos, parent, center_blit)
         self.color = pygame.Color(255, 255, 255)
-        self.font = pygame.font.SysFont("menlottc", 20)
+        self.font_key = ("menlottc", 20)
+        self.glyphs = glyphs
         self.lines = []
         self.lines_height = 0
         self.gap = 5
+        self.text = None
         self.set_text(text)
 
     def set_gap(self, gap):
@@ -110,22 +440,25 @@ class Label(SurfaceObject):
         self.updated = True
 
     def set_text(self, text):
-        self.text = str(text).split("\n")
-        self.updated = True
+        text = str(text).split("\n")
+        if text != self.text:
+            self.text = text
+            self.updated = True
 
     def set_color(self, color):
         self.color = color
         self.updated = True
 
     def set_font(self, name, size):
-        self.font = pygame.font.SysFont(name, size)
+        self.font_key = (name, size)
         self.updated = True
 
     def render_text(self):
         self.lines = []
         w, h = 0, 0
+        render = text_cache.render_glyphs if self.glyphs else text_cache.render
         for line in self.text:
-            text_surf = self.font.render(line, True, self.color)
+            text_surf = render(self.font_key, line, True, self.color)
             rect = text_surf.get_rect()
             if rect.w > w: w = rect.w
             h += rect.h + self.gap
@@ -150,11 +483,14 @@ class Label(SurfaceObject):
 
 
 class Button(SurfaceObject):
+    event_types = (pygame.MOUSEBUTTONDOWN,)
+
     def __init__(self, parent, pos, image, hover_image=None, center_blit=True):
-        SurfaceObject.__init__(self, pygame.image.load(image), pos, parent, center_blit)
-        self.hovered_image = pygame.image.load(hover_image) if hover_image else None
+        SurfaceObject.__init__(self, assets.image(image), pos, parent, center_blit)
+        self.hovered_image = assets.image(hover_image) if hover_image else None
         self.function = None
         self.draw_image = self.surface
+        self.hovered = False
 
     def connect(self, func):
         self.function = func
@@ -165,15 +501,21 @@ class Button(SurfaceObject):
 
     def on_click(self, event):
         if self.rect.collidepoint(event.pos):
-            self.function()
+            self.click()
+
+    def click(self):
+        self.function()
 
     def is_hovered(self):
-        return self.rect.collidepoint(pygame.mouse.get_pos())
+        return self.hovered
 
-    def update(self):
-        self.draw_image = self.surface
-        if self.hovered_image and self.is_hovered():
-            self.draw_image = self.hovered_image
+    def set_hovered(self, hovered):
+        # Called by the parent WidgetSurface when the pointer enters or leaves.
+        self.hovered = hovered
+        draw_image = self.hovered_image if hovered and self.hovered_image else self.surface
+        if draw_image is not self.draw_image:
+            self.draw_image = draw_image
+            self.mark_dirty()
 
     def draw(self, surface):
         surface.blit(self.draw_image, self.pos)
@@ -189,12 +531,10 @@ class NumberInput(WidgetSurface):
         self.max = max
         self.val = start
         self.step = step
-        left_image = pygame.image.load(btn_left_img)
-        right_image = pygame.image.load(btn_right_img)
-        btn_rect = left_image.get_rect()
+        btn_rect = assets.image(btn_left_img).get_rect()
         self.left_button = Button(self, (0, 0), btn_left_img, center_blit=False)
         self.right_button = Button(self, (btn_rect.w+15, 0), btn_right_img, center_blit=False)
-        self.val_label = Label(self, ((btn_rect.w*2)+30, 0), self.val)
+        self.val_label = Label(self, ((btn_rect.w*2)+30, 0), self.val, glyphs=True)
         self.left_button.connect(lambda: self.set_val(self.val-self.step))
         self.right_button.connect(lambda: self.set_val(self.val+self.step))
         self.add_widget(self.left_button)
@@ -217,6 +557,8 @@ class NumberInput(WidgetSurface):
 
 
 class Key(Widget):
+    event_types = (pygame.KEYDOWN,)
+
     def __init__(self, key, func=None):
         Widget.__init__(self)
         self.key = key